@@ -85,138 +85,563 @@
 #     except Exception as e:
 #         raise HTTPException(status_code=500, detail=f"生成个人陈述时发生内部错误: {e}")
 
-import json
-import fitz # PyMuPDF
-from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile
-from fastapi.responses import Response, JSONResponse
+import asyncio
+import math
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, File, Form, UploadFile, Request, Query
+from pydantic import ValidationError
 from fastapi.concurrency import run_in_threadpool
-from typing import Dict, Any
+from fastapi.responses import Response, ORJSONResponse, StreamingResponse, HTMLResponse
+from typing import Dict, Any, AsyncIterator, Callable, Optional, Literal
 
-from app.models.schemas import TextInput, NewResumeProfile, PromptTextInput
-from app.services.auth import auth_validator
-from app.services.dify_client import dify_client
-from app.services.pdf_generator import create_resume_pdf
+from app.models.schemas import TextInput, NewResumeProfile, PromptTextInput, BulkTextInput, JobSubmission
+from app.services.auth import auth_validator, rate_limit
+from app.services.clients import charge, current_client, RateLimitedError
+from app.services.dify_client import dify_client, parse_statement_answer, DifyCallError
+from app.services.structured_output import StructuredOutputError
+from app.services.resilience import dify_resilience, DifyUnavailableError, read_deadline
+from app.services.render_engine import render_engine, RenderQueueFullError
+from app.services.pdf_cache import pdf_cache
+from app.services.template_registry import template_registry, UnknownTemplateError, PREVIEW_ASSET_PATH
+from app.services.preview import preview_coordinator, rasterize_first_page, PreviewSupersededError
+from app.services.dify_cache import dify_cache, read_cache_bypass
+from app.services.dify_sessions import dify_sessions, use_session
+from app.services.idempotency import idempotency_store, mark_response_failed
+from app.services.bulk_transform import transform_texts
+from app.services.pdf_extractor import pdf_extractor, PDFIngestionError
+from app.services.job_queue import job_queue, JobNotFoundError, CallbackURLError
+from app.services.batch_render import stream_batch_zip, parse_items, parse_ndjson_items
+from app.services.resume_pipeline import run_resume_pipeline, PipelineError
+from app.services.chunked_parse import chunk_upload, parse_chunks
+from app.core.config import settings
+from app.core.tracing import tracer
 
-router = APIRouter()
+# 所有路由都会读取缓存控制请求头（以便客户端跳过 Dify 响应缓存）和截止时间请求头
+router = APIRouter(dependencies=[Depends(read_cache_bypass), Depends(read_deadline)])
 
+# SSE 响应头：禁止缓存，并关闭反向代理（如 Nginx）的缓冲，保证逐段下发
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
 
-@router.post("/generate-resume/", response_class=Response)
-async def generate_resume(profile: NewResumeProfile, api_key: str = Depends(auth_validator)):
+
+def _sse_event(event: str, data: Any) -> str:
+    """将数据编码为一条 Server-Sent Event。"""
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """判断 If-None-Match 请求头是否与给定 ETag 匹配（弱比较）。"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+
+def _stream_response(chunks: AsyncIterator[str], result_key: Optional[str],
+                     finalize: Optional[Callable[[str], Any]] = None) -> StreamingResponse:
+    """
+    将 Dify 的文本增量以 SSE 转发给客户端：
+    每个增量为一条 `message` 事件，结束时发送 `done` 事件携带完整结果，出错时发送 `error` 事件。
+    """
+    async def event_source():
+        parts = []
+        try:
+            async for delta in chunks:
+                parts.append(delta)
+                yield _sse_event("message", {"delta": delta})
+            answer = "".join(parts)
+            yield _sse_event("done", finalize(answer) if finalize else {result_key: answer})
+        except Exception as e:
+            mark_response_failed()
+            yield _sse_event("error", {"detail": f"流式生成时发生错误: {e}"})
+
+    return StreamingResponse(event_source(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.post("/generate-resume/", response_class=Response, dependencies=[Depends(rate_limit('render'))])
+async def generate_resume(profile: NewResumeProfile, request: Request, api_key: str = Depends(auth_validator),
+                          compact: bool = Query(False)):
+    """
+    生成简历 PDF。compact=true 时输出精简的 PDF（字体子集化并去掉 hinting、图片降采样并重新压缩），
+    响应头 X-PDF-Size 为 PDF 大小，精简输出另有 X-PDF-Original-Size 为常规输出的大小。
+    """
+    # PDF 内容由简历数据和模板唯一决定，缓存键即强 ETag，命中 If-None-Match 时无需渲染
     try:
-        pdf_bytes = create_resume_pdf(profile)
-        headers = {'Content-Disposition': f'attachment; filename="resume_{profile.user_uid}.pdf"'}
+        cache_key = pdf_cache.key_for(profile, compact)
+    except UnknownTemplateError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    etag = f'"{cache_key}"'
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={'ETag': etag})
+
+    async def render_compact() -> bytes:
+        sizes: Dict[str, int] = {}
+        pdf_bytes = await render_engine.render(profile, compact=True, sizes=sizes)
+        pdf_cache.note_original_size(cache_key, sizes.get("original"))
+        return pdf_bytes
+
+    try:
+        pdf_bytes = await pdf_cache.get_or_render(
+            cache_key, render_compact if compact else lambda: render_engine.render(profile))
+        headers = {
+            'Content-Disposition': f'attachment; filename="resume_{profile.user_uid}.pdf"',
+            'ETag': etag,
+            'X-PDF-Size': str(len(pdf_bytes)),
+        }
+        original_size = pdf_cache.original_size(cache_key) if compact else None
+        if original_size:
+            headers['X-PDF-Original-Size'] = str(original_size)
         return Response(content=pdf_bytes, media_type='application/pdf', headers=headers)
+    except RenderQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="生成PDF超时，请稍后重试。")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"生成PDF时发生内部错误: {e}")
 
 
-@router.post("/parse-resume/")
-async def parse_resume(api_key: str = Depends(auth_validator), file: UploadFile = File(...)):
+@router.post("/generate-resume/preview/")
+async def preview_resume(profile: NewResumeProfile, request: Request,
+                         format: Literal['png', 'html'] = Query('png'),
+                         dpi: Optional[int] = Query(None, ge=12),
+                         api_key: str = Depends(auth_validator)):
+    """
+    简历预览，供编辑器在每次修改后调用。
+    - format=html：立即返回内联样式的 HTML，不经过 PDF 排版，字体从 PREVIEW_ASSET_PATH 加载；
+    - format=png：返回第一页的低分辨率 PNG。PDF 只排版一次并写入 PDF 缓存，
+      之后以相同数据请求 /generate-resume/ 会直接命中缓存（响应头 X-PDF-ETag 即该 PDF 的 ETag）。
+    同一 user_uid 的新预览请求会取消尚未完成的旧请求，旧请求返回 409。
+    """
+    if format == 'html':
+        try:
+            html = await run_in_threadpool(
+                template_registry.render_html, profile.model_dump(by_alias=True), profile.style,
+                request.scope.get("root_path", "") + PREVIEW_ASSET_PATH)
+        except UnknownTemplateError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        return HTMLResponse(content=html, headers={'Cache-Control': 'no-store'})
+
+    charge('render')
+    dpi = min(dpi or settings.PREVIEW_DPI, settings.PREVIEW_MAX_DPI)
+    try:
+        cache_key = pdf_cache.key_for(profile)
+    except UnknownTemplateError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    etag = f'"{cache_key}-{dpi}"'
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={'ETag': etag})
+
+    async def render_preview():
+        pdf_bytes = await pdf_cache.get_or_render(
+            cache_key, lambda: render_engine.render(profile), cancel_if_abandoned=True)
+        return await rasterize_first_page(pdf_bytes, dpi)
+
+    try:
+        png_bytes, page_count = await preview_coordinator.run(profile.user_uid, render_preview)
+    except PreviewSupersededError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except RenderQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="生成预览超时，请稍后重试。")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"生成预览时发生内部错误: {e}")
+    headers = {'ETag': etag, 'X-PDF-ETag': f'"{cache_key}"', 'X-Page-Count': str(page_count)}
+    return Response(content=png_bytes, media_type='image/png', headers=headers)
+
+
+@router.post("/generate-resume/batch/")
+async def generate_resume_batch(request: Request, api_key: str = Depends(auth_validator)):
+    """
+    批量生成简历PDF，以ZIP流的形式返回，每份渲染完成后立即写出。
+    请求体为 NewResumeProfile 的 JSON 数组，或 Content-Type 为 application/x-ndjson 的逐行 JSON。
+    每份的结果（含失败原因）记录在 ZIP 末尾的 manifest.json 中。
+    """
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonl" in content_type:
+        body = await request.body()
+        count = sum(1 for line in body.splitlines() if line.strip())
+        items = parse_ndjson_items(body)
+    else:
+        try:
+            payload = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="请求体不是有效的 JSON。")
+        if not isinstance(payload, list):
+            raise HTTPException(status_code=400, detail="请求体必须是 NewResumeProfile 的 JSON 数组。")
+        count = len(payload)
+        items = parse_items(payload)
+    # 请求体在响应开始前已全部读入，按份数计费
+    charge('render', count)
+
+    concurrency = settings.BATCH_RENDER_CONCURRENCY or render_engine.workers
+    headers = {'Content-Disposition': 'attachment; filename="resumes.zip"'}
+    return StreamingResponse(stream_batch_zip(items, concurrency), media_type='application/zip', headers=headers)
+
+
+@router.get("/templates/")
+async def list_templates(api_key: str = Depends(auth_validator)):
+    """
+    返回可用的简历样式及其内容指纹，生成简历时通过 style 字段选择。
+    """
+    return ORJSONResponse(content=template_registry.describe())
+
+
+@router.get("/cache/stats/")
+async def cache_stats(api_key: str = Depends(auth_validator)):
+    """
+    返回各缓存（含 Idempotency-Key 记录和 Dify 会话）的命中/未命中/淘汰计数。
+    """
+    return ORJSONResponse(content={"pdf": pdf_cache.stats(), "dify": dify_cache.stats(),
+                                   "idempotency": idempotency_store.stats(),
+                                   "dify_sessions": dify_sessions.stats()})
+
+
+@router.get("/dify/status/")
+async def dify_status(api_key: str = Depends(auth_validator)):
+    """
+    返回每个 Dify 应用的熔断状态、并发/排队数、耗时分位数、当前超时时间和对冲等待时间，
+    以及全局重试预算（retry_budget）。
+    """
+    return ORJSONResponse(content={**dify_resilience.stats(), "retry_budget": dify_resilience.retry_budget.stats()})
+
+
+@router.post("/parse-resume/", dependencies=[Depends(rate_limit('llm'))])
+async def parse_resume(api_key: str = Depends(auth_validator), file: UploadFile = File(...),
+                       chunked: Optional[bool] = Query(None)):
+    """
+    解析上传的PDF简历。较长的简历按章节分段并发解析后合并（chunked 默认为 PARSE_CHUNKED_ENABLED），
+    短于 PARSE_CHUNK_MIN_CHARS 的简历按整篇解析。
+    """
+    # 请求体（multipart 上传）在进入端点前已接收并解析完毕，补记这段耗时
+    tracer.record_since_request_start("request.body", bytes=file.size)
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="无效的文件类型，请上传PDF。")
     try:
-        pdf_bytes = await file.read()
-        extracted_text = "".join(page.get_text() for page in fitz.open(stream=pdf_bytes, filetype="pdf"))
+        extracted = await pdf_extractor.extract(file)
+    except PDFIngestionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    chunks = await chunk_upload(file, extracted, settings.PARSE_CHUNKED_ENABLED if chunked is None else chunked)
+    if len(chunks) > 1:
+        # 路由依赖已按一次解析计费，多出的分段另行计费
+        charge('llm', len(chunks) - 1)
+    try:
+        extracted_text = extracted.text
         if not extracted_text.strip():
             raise ValueError("无法从PDF中提取任何文本。")
 
-        result = await run_in_threadpool(dify_client.parse_text, extracted_text)
+        result = await parse_chunks(chunks, extracted_text, settings.PARSE_CHUNK_CONCURRENCY)
         if "error" in result:
             raise HTTPException(status_code=502, detail=result["error"])
-        return JSONResponse(content=result)
+        return ORJSONResponse(content=result)
+    except (DifyUnavailableError, RateLimitedError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/parse-resume-text/")
+@router.post("/parse-resume-text/", dependencies=[Depends(rate_limit('llm'))])
 async def parse_resume_text(input_data: TextInput, api_key: str = Depends(auth_validator)):
-    result = await run_in_threadpool(dify_client.parse_text, input_data.text)
+    use_session(input_data.user_uid)
+    result = await dify_client.parse_text(input_data.text)
     if "error" in result:
         raise HTTPException(status_code=502, detail=result["error"])
-    return JSONResponse(content=result)
+    return ORJSONResponse(content=result)
+
+
+@router.post("/resume-pipeline/")
+async def resume_pipeline(api_key: str = Depends(auth_validator), file: UploadFile = File(...),
+                          operation: Literal['rewrite', 'expand', 'contract', 'none'] = Form('rewrite'),
+                          style: Optional[str] = Form(None),
+                          user_uid: Optional[str] = Form(None),
+                          concurrency: Optional[int] = Form(None, ge=1),
+                          stream: bool = Query(False), chunked: Optional[bool] = Query(None)):
+    """
+    一次完成"导入旧简历并美化"：上传PDF → 提取文本 → 解析为简历数据 → 并发润色所有描述要点 → 渲染PDF。
+    返回 {"profile": 简历数据, "pdf": base64 编码的PDF, "etag", "polish", "timings"}。
+    stream=true 时以 SSE 返回：各阶段的 progress 事件，最后一条 done 事件携带上述结果，失败时为 error 事件。
+    operation=none 时跳过润色；较长的简历按章节分段解析（见 /parse-resume/ 的 chunked）。
+    """
+    # 请求体（multipart 上传）在进入端点前已接收并解析完毕，补记这段耗时
+    tracer.record_since_request_start("request.body", bytes=file.size)
+    if file.content_type != "application/pdf":
+        raise HTTPException(status_code=400, detail="无效的文件类型，请上传PDF。")
+    try:
+        template_registry.resolve(style)
+    except UnknownTemplateError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    # 上传文件在端点返回后即被关闭，因此提取在请求内完成，之后的阶段才进入流式响应
+    try:
+        extracted = await pdf_extractor.extract(file)
+    except PDFIngestionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    if not extracted.text.strip():
+        raise HTTPException(status_code=400, detail="无法从PDF中提取任何文本。")
+
+    chunks = await chunk_upload(file, extracted, settings.PARSE_CHUNKED_ENABLED if chunked is None else chunked)
+    # 这里按解析的分段数和一次渲染计费；润色的要点数在解析后才知道，由流水线在润色前计费
+    charge('llm', len(chunks))
+    charge('render')
+    concurrency = min(concurrency or settings.BULK_DEFAULT_CONCURRENCY, settings.BULK_MAX_CONCURRENCY)
+    events = run_resume_pipeline(extracted, None if operation == 'none' else operation,
+                                 style, user_uid, concurrency, chunks)
 
+    if stream:
+        async def event_source():
+            # 超出限速可能发生在解析（分段失败后退回整篇解析）或润色阶段
+            stage = "parse"
+            try:
+                async for event, data in events:
+                    if event == "progress" and data["stage"] in ("parse", "polish"):
+                        stage = "polish"
+                    yield _sse_event(event, data)
+            except PipelineError as e:
+                mark_response_failed()
+                yield _sse_event("error", {"stage": e.stage, "status": e.status_code, "detail": e.detail})
+            except RateLimitedError as e:
+                mark_response_failed()
+                yield _sse_event("error", {"stage": stage, "status": 429, "detail": str(e),
+                                           "retry_after": max(1, math.ceil(e.retry_after))})
+            except Exception as e:
+                mark_response_failed()
+                yield _sse_event("error", {"detail": f"流水线执行失败: {e}"})
 
-@router.post("/rewrite-text/")
+        return StreamingResponse(event_source(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+    try:
+        async for event, data in events:
+            if event == "done":
+                return ORJSONResponse(content=data, headers={'ETag': data["etag"]})
+    except PipelineError as e:
+        raise HTTPException(status_code=e.status_code, detail=f"{e.stage}: {e.detail}")
+    except (DifyUnavailableError, RateLimitedError):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"流水线执行失败: {e}")
+
+
+@router.post("/rewrite-text/", dependencies=[Depends(rate_limit('llm'))])
 async def rewrite_text(input_data: TextInput, api_key: str = Depends(auth_validator)):
-    result = await run_in_threadpool(dify_client.rewrite_text, input_data.text)
-    return JSONResponse(content={"rewritten_text": result})
+    use_session(input_data.user_uid)
+    result = await dify_client.rewrite_text(input_data.text)
+    return ORJSONResponse(content={"rewritten_text": result})
 
 
-@router.post("/expand-text/")
+@router.post("/expand-text/", dependencies=[Depends(rate_limit('llm'))])
 async def expand_text(input_data: TextInput, api_key: str = Depends(auth_validator)):
-    result = await run_in_threadpool(dify_client.expand_text, input_data.text)
-    return JSONResponse(content={"expanded_text": result})
+    use_session(input_data.user_uid)
+    result = await dify_client.expand_text(input_data.text)
+    return ORJSONResponse(content={"expanded_text": result})
 
 
-@router.post("/contract-text/")
+@router.post("/contract-text/", dependencies=[Depends(rate_limit('llm'))])
 async def contract_text(input_data: TextInput, api_key: str = Depends(auth_validator)):
-    result = await run_in_threadpool(dify_client.contract_text, input_data.text)
-    return JSONResponse(content={"contracted_text": result})
+    use_session(input_data.user_uid)
+    result = await dify_client.contract_text(input_data.text)
+    return ORJSONResponse(content={"contracted_text": result})
 
 
-@router.post("/process_json_to_text/")
+@router.post("/process_json_to_text/", dependencies=[Depends(rate_limit('llm'))])
 async def process_json_to_text(input_data: Dict[str, Any], api_key: str = Depends(auth_validator)):
-    json_as_text = json.dumps(input_data, indent=2, ensure_ascii=False)
-    result = await run_in_threadpool(dify_client.process_json_as_text, json_as_text)
-    return JSONResponse(content={"processed_text": result})
+    json_as_text = orjson.dumps(input_data, option=orjson.OPT_INDENT_2).decode()
+    result = await dify_client.process_json_as_text(json_as_text)
+    return ORJSONResponse(content={"processed_text": result})
 
 
-@router.post("/generate_statement/")
+@router.post("/generate_statement/", dependencies=[Depends(rate_limit('llm'))])
 async def generate_statement(input_data: TextInput, api_key: str = Depends(auth_validator)):
     """
     接收包含个人陈述相关信息的文本，调用 Dify 生成个人陈述。
     """
+    use_session(input_data.user_uid)
     try:
         # dify_client.generate_statement 返回一个 JSON 格式的字符串
-        statement_text = await run_in_threadpool(dify_client.generate_statement,input_data.text)
-
-        # 1. 清理可能存在的 ```json ``` 包裹（如果有）
-        clean = statement_text
-        if clean.startswith("```"):
-            clean = clean.strip("`").strip("json").strip()
+        statement_text = await dify_client.generate_statement(input_data.text)
 
-        # 2. 把 JSON 字符串转成 dict
-        statement_dict = json.loads(clean)
+        # 从回答中提取 JSON（兼容 ```json ``` 包裹、前后说明文字和截断）并转成 dict
+        statement_dict = parse_statement_answer(statement_text)
 
-        # 3. 直接返回 dict，FastAPI 会自动序列化为 JSON
+        # 直接返回 dict，FastAPI 会自动序列化为 JSON
         return statement_dict
         # return {"personal_statement": statement_dict}    #包在一个字段里返回
 
-    except json.JSONDecodeError:
+    except StructuredOutputError:
         raise HTTPException(
-            status_code=500,
+            status_code=502,
             detail="生成的个人陈述不是有效的 JSON，解析失败"
         )
+    except (DifyUnavailableError, DifyCallError):
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"生成个人陈述时发生内部错误: {e}"
         )
 
-@router.post("/generate_recommendation/")
+@router.post("/generate_recommendation/", dependencies=[Depends(rate_limit('llm'))])
 async def generate_recommendation(input_data: TextInput, api_key: str = Depends(auth_validator)):
     """
     接收生成推荐信所需的信息文本，调用Dify并返回其生成的JSON结构。
     """
+    use_session(input_data.user_uid)
     try:
-        recommendation_json = await run_in_threadpool(dify_client.generate_recommendation, input_data.text)
+        recommendation_json = await dify_client.generate_recommendation(input_data.text)
         if "error" in recommendation_json:
             raise HTTPException(status_code=502, detail=recommendation_json["error"])
-        return JSONResponse(content=recommendation_json)
+        return ORJSONResponse(content=recommendation_json)
+    except DifyUnavailableError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"生成推荐信时发生内部错误: {e}")
 
-@router.post("/rewrite_prompt/")
+@router.post("/rewrite_prompt/", dependencies=[Depends(rate_limit('llm'))])
 async def generate_with_prompt(input_data: PromptTextInput, api_key: str = Depends(auth_validator)):
     """
     接收文本和自定义提示，调用Dify生成文本，并以指定格式返回。
     """
+    use_session(input_data.user_uid)
     try:
-        generated_text = await run_in_threadpool(
-            dify_client.generate_with_prompt,
+        generated_text = await dify_client.generate_with_prompt(
             text=input_data.text,
             prompt=input_data.prompt
         )
-        return JSONResponse(content={"text": generated_text})
+        return ORJSONResponse(content={"text": generated_text})
+    except (DifyUnavailableError, DifyCallError):
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"生成文本时发生内部错误: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"生成文本时发生内部错误: {e}")
+
+
+@router.post("/bulk-transform/")
+async def bulk_transform(input_data: BulkTextInput, api_key: str = Depends(auth_validator)):
+    """
+    对多段文本并发执行同一种变换（rewrite/expand/contract/prompt），
+    以 NDJSON 流返回，每完成一段输出一行 {"index": i, "result": "..."}（失败时为 "error"）。
+    """
+    if len(input_data.texts) > settings.BULK_MAX_TEXTS:
+        raise HTTPException(status_code=400, detail=f"单次最多提交 {settings.BULK_MAX_TEXTS} 段文本。")
+    if input_data.operation == 'prompt' and not input_data.prompt:
+        raise HTTPException(status_code=400, detail="operation 为 prompt 时必须提供 prompt。")
+
+    charge('llm', len(input_data.texts))
+    concurrency = min(input_data.concurrency or settings.BULK_DEFAULT_CONCURRENCY, settings.BULK_MAX_CONCURRENCY)
+    results = transform_texts(input_data.texts, input_data.operation, input_data.prompt, concurrency)
+
+    async def ndjson_lines():
+        async for item in results:
+            if "error" in item:
+                mark_response_failed()
+            yield orjson.dumps(item) + b"\n"
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
+# --- 流式 (SSE) 版本：首个 token 生成后立即下发，不必等待完整答案 ---
+
+@router.post("/rewrite-text/stream", dependencies=[Depends(rate_limit('llm'))])
+async def rewrite_text_stream(input_data: TextInput, api_key: str = Depends(auth_validator)):
+    use_session(input_data.user_uid)
+    return _stream_response(dify_client.stream_rewrite_text(input_data.text), "rewritten_text")
+
+
+@router.post("/expand-text/stream", dependencies=[Depends(rate_limit('llm'))])
+async def expand_text_stream(input_data: TextInput, api_key: str = Depends(auth_validator)):
+    use_session(input_data.user_uid)
+    return _stream_response(dify_client.stream_expand_text(input_data.text), "expanded_text")
+
+
+@router.post("/contract-text/stream", dependencies=[Depends(rate_limit('llm'))])
+async def contract_text_stream(input_data: TextInput, api_key: str = Depends(auth_validator)):
+    use_session(input_data.user_uid)
+    return _stream_response(dify_client.stream_contract_text(input_data.text), "contracted_text")
+
+
+@router.post("/rewrite_prompt/stream", dependencies=[Depends(rate_limit('llm'))])
+async def generate_with_prompt_stream(input_data: PromptTextInput, api_key: str = Depends(auth_validator)):
+    use_session(input_data.user_uid)
+    chunks = dify_client.stream_with_prompt(text=input_data.text, prompt=input_data.prompt)
+    return _stream_response(chunks, "text")
+
+
+@router.post("/generate_statement/stream", dependencies=[Depends(rate_limit('llm'))])
+async def generate_statement_stream(input_data: TextInput, api_key: str = Depends(auth_validator)):
+    """
+    流式生成个人陈述；`done` 事件中携带解析后的完整 JSON。
+    """
+    use_session(input_data.user_uid)
+    return _stream_response(dify_client.stream_statement(input_data.text), None, finalize=parse_statement_answer)
+
+
+# --- 异步任务：提交后立即返回任务 ID，通过轮询或回调获取结果 ---
+
+def _job_owner() -> str:
+    """当前调用方的名字，记录在任务中，查询任务时据此校验归属。"""
+    return current_client.get().name
+
+
+@router.post("/jobs/", status_code=202)
+async def submit_job(submission: JobSubmission, api_key: str = Depends(auth_validator)):
+    """
+    将任意已有操作（parse/rewrite/expand/contract/prompt/statement/recommendation/render）作为异步任务提交。
+    payload 与对应同步接口的请求体相同。
+    """
+    charge('render' if submission.operation == 'render' else 'llm')
+    try:
+        job_id = await job_queue.submit(submission.operation, submission.payload, submission.callback_url,
+                                        _job_owner())
+    except (ValueError, ValidationError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"job_id": job_id, "status": "queued"}
+
+
+@router.post("/jobs/parse-resume/", status_code=202, dependencies=[Depends(rate_limit('llm'))])
+async def submit_parse_resume_job(api_key: str = Depends(auth_validator), file: UploadFile = File(...),
+                                  callback_url: Optional[str] = Form(None)):
+    """
+    上传PDF并以异步任务的方式解析：文本提取在请求内完成，Dify 解析在后台执行。
+    """
+    # 请求体（multipart 上传）在进入端点前已接收并解析完毕，补记这段耗时
+    tracer.record_since_request_start("request.body", bytes=file.size)
+    if file.content_type != "application/pdf":
+        raise HTTPException(status_code=400, detail="无效的文件类型，请上传PDF。")
+    try:
+        extracted = await pdf_extractor.extract(file)
+    except PDFIngestionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    if not extracted.text.strip():
+        raise HTTPException(status_code=400, detail="无法从PDF中提取任何文本。")
+    try:
+        job_id = await job_queue.submit('parse', {"text": extracted.text}, callback_url, _job_owner())
+    except CallbackURLError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"job_id": job_id, "status": "queued"}
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, api_key: str = Depends(auth_validator)):
+    """
+    查询任务状态；成功的 JSON 结果直接内联在 result 字段中，PDF 等二进制结果通过 result_url 下载。
+    """
+    try:
+        row = await job_queue.get(job_id, _job_owner())
+    except JobNotFoundError:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期。")
+    return job_queue.describe(row)
+
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, api_key: str = Depends(auth_validator)):
+    """
+    下载任务结果，内容类型与对应的同步接口一致。
+    """
+    try:
+        row = await job_queue.get(job_id, _job_owner())
+    except JobNotFoundError:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期。")
+    if row["status"] == "failed":
+        raise HTTPException(status_code=502, detail=row["error"])
+    if row["status"] != "succeeded":
+        raise HTTPException(status_code=409, detail=f"任务尚未完成，当前状态: {row['status']}")
+    headers = {}
+    if row["media_type"] == "application/pdf":
+        headers['Content-Disposition'] = f'attachment; filename="resume_{job_id}.pdf"'
+    return Response(content=row["result"], media_type=row["media_type"], headers=headers)
@@ -0,0 +1,150 @@
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.metrics import RESPONSE_COMPRESSION_BYTES
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 只压缩这些类型的响应：PDF、PNG、ZIP 本身已经压缩，SSE 需要逐条立即送达，不做处理
+COMPRESSIBLE_TYPES = frozenset(("application/json", "application/x-ndjson"))
+
+
+def negotiate_encoding(accept_encoding: str, brotli_available: bool = brotli is not None) -> Optional[str]:
+    """
+    按 Accept-Encoding 选择压缩方式：q 值最高者优先，相同时 br 优先于 gzip；
+    客户端都不接受（或 q=0）时返回 None。
+    """
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            weights[name] = quality
+    candidates = ("br", "gzip") if brotli_available else ("gzip",)
+    best, best_quality = None, 0.0
+    for name in candidates:
+        quality = weights.get(name, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+class StreamCompressor:
+    """逐段压缩：process() 返回可以立即解压的完整数据块，finish() 写出结尾。"""
+
+    def __init__(self, encoding: str, gzip_level: int = 6, brotli_quality: int = 4):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            # wbits=31 生成带 gzip 头和尾的数据
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def process(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.finish()
+        return self._zlib.compress(data) + self._zlib.flush()
+
+
+class CompressionMiddleware:
+    """
+    按 Accept-Encoding 压缩 JSON / NDJSON 响应（brotli 需要安装 brotli 包，否则只使用 gzip）。
+
+    - 非流式响应小于 minimum_size 时原样返回，压缩后改写 Content-Length；
+    - 流式响应（如 /bulk-transform/ 的 NDJSON）无法预知大小，总是压缩，每段数据单独刷新，
+      客户端收到一段即可解出一段，不会因压缩而攒批；
+    - 已带 Content-Encoding 的响应和其他类型的响应不处理。
+    纯 ASGI 实现，只在响应开始时缓存响应头。
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: Optional[int] = None,
+                 gzip_level: Optional[int] = None, brotli_quality: Optional[int] = None):
+        self.app = app
+        self.minimum_size = settings.COMPRESSION_MIN_BYTES if minimum_size is None else minimum_size
+        self.gzip_level = settings.COMPRESSION_GZIP_LEVEL if gzip_level is None else gzip_level
+        self.brotli_quality = settings.COMPRESSION_BROTLI_QUALITY if brotli_quality is None else brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        compressor: Optional[StreamCompressor] = None
+        passthrough = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                # 等到第一段响应体才能判断是否为流式响应
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is not None:
+                data = compressor.process(body) if more_body else compressor.finish(body)
+                self._count(encoding, len(body), len(data))
+                await send({"type": "http.response.body", "body": data, "more_body": more_body})
+                return
+
+            headers = MutableHeaders(raw=start["headers"])
+            compressible = self._compressible(start["status"], headers)
+            if compressible:
+                headers.add_vary_header("Accept-Encoding")
+            if not compressible or (not more_body and len(body) < self.minimum_size):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+            headers["Content-Encoding"] = encoding
+            compressor = StreamCompressor(encoding, self.gzip_level, self.brotli_quality)
+            if more_body:
+                del headers["Content-Length"]
+                data = compressor.process(body)
+            else:
+                data = compressor.finish(body)
+                headers["Content-Length"] = str(len(data))
+            self._count(encoding, len(body), len(data))
+            await send(start)
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _compressible(status: int, headers: MutableHeaders) -> bool:
+        if status < 200 or status in (204, 304) or "content-encoding" in headers:
+            return False
+        media_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        return media_type in COMPRESSIBLE_TYPES
+
+    @staticmethod
+    def _count(encoding: str, original: int, compressed: int) -> None:
+        RESPONSE_COMPRESSION_BYTES.labels(encoding, "original").inc(original)
+        RESPONSE_COMPRESSION_BYTES.labels(encoding, "compressed").inc(compressed)
@@ -39,24 +39,213 @@
 # settings = Settings()
 
 import os
+import tempfile
 from dotenv import load_dotenv
 from pydantic import BaseModel
-from typing import Dict
+from typing import Dict, Literal, Optional
 
 # 在所有配置读取之前加载 .env 文件
 load_dotenv()
 
 
+def _env_bool(name: str, default: str = "false") -> bool:
+    """将环境变量解析为布尔值（true/1/yes/on 视为真）。"""
+    return os.getenv(name, default).strip().lower() in ("true", "1", "yes", "on")
+
+
+def parse_key_values(spec: str) -> Dict[str, float]:
+    """解析形如 `parse=3600,rewrite=600` 的按 Dify 应用覆盖的数值配置。"""
+    values = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        values[name.strip()] = float(value)
+    return values
+
+
 class Settings(BaseModel):
     """
     应用配置模型，通过 Pydantic 自动加载和验证环境变量。
     """
-    # 服务鉴权密钥
-    API_KEY: str = os.getenv("API_KEY")
+    # 服务鉴权密钥（作为名为 default 的调用方）
+    API_KEY: Optional[str] = os.getenv("API_KEY")
+    # 多个调用方的密钥、公平调度权重和限速，JSON 对象，见 app/services/clients.py
+    API_CLIENTS: str = os.getenv("API_CLIENTS", "")
+    # 每个调用方默认的令牌桶：每秒补充的令牌数（0 表示不限速）和桶容量
+    CLIENT_LLM_RATE: float = float(os.getenv("CLIENT_LLM_RATE", "0"))
+    CLIENT_LLM_BURST: float = float(os.getenv("CLIENT_LLM_BURST", "20"))
+    CLIENT_RENDER_RATE: float = float(os.getenv("CLIENT_RENDER_RATE", "0"))
+    CLIENT_RENDER_BURST: float = float(os.getenv("CLIENT_RENDER_BURST", "50"))
 
     # Dify 服务配置
     DIFY_API_URL: str = os.getenv("DIFY_API_URL")
 
+    # Dify 连接池配置（每个 Dify 主机共享一个长连接池）
+    DIFY_TIMEOUT: float = float(os.getenv("DIFY_TIMEOUT", "120"))
+    DIFY_POOL_MAX_CONNECTIONS: int = int(os.getenv("DIFY_POOL_MAX_CONNECTIONS", "100"))
+    DIFY_POOL_MAX_KEEPALIVE: int = int(os.getenv("DIFY_POOL_MAX_KEEPALIVE", "20"))
+    DIFY_POOL_KEEPALIVE_EXPIRY: float = float(os.getenv("DIFY_POOL_KEEPALIVE_EXPIRY", "30"))
+    DIFY_HTTP2: bool = _env_bool("DIFY_HTTP2", "true")
+    # 每个 Dify 应用密钥允许的最大并发请求数
+    DIFY_PER_KEY_CONCURRENCY: int = int(os.getenv("DIFY_PER_KEY_CONCURRENCY", "16"))
+    # 按应用覆盖并发上限，例如 "recommendation=4,parse=8"
+    DIFY_APP_CONCURRENCY: str = os.getenv("DIFY_APP_CONCURRENCY", "")
+    # 每个应用在并发占满时最多允许排队的请求数，超出时直接返回 503
+    DIFY_APP_MAX_QUEUE: int = int(os.getenv("DIFY_APP_MAX_QUEUE", "32"))
+    # 熔断器：连续失败多少次后打开，打开后多少秒进入半开探测
+    DIFY_BREAKER_FAILURES: int = int(os.getenv("DIFY_BREAKER_FAILURES", "5"))
+    DIFY_BREAKER_RESET_SECONDS: float = float(os.getenv("DIFY_BREAKER_RESET_SECONDS", "30"))
+    # 自适应超时：取近期耗时的该分位数乘以倍数，并限制在 [DIFY_TIMEOUT_MIN, DIFY_TIMEOUT] 内
+    DIFY_TIMEOUT_MIN: float = float(os.getenv("DIFY_TIMEOUT_MIN", "15"))
+    DIFY_TIMEOUT_PERCENTILE: float = float(os.getenv("DIFY_TIMEOUT_PERCENTILE", "99"))
+    DIFY_TIMEOUT_MULTIPLIER: float = float(os.getenv("DIFY_TIMEOUT_MULTIPLIER", "2"))
+    # 重试：网络错误、超时和 502/503/504 按带抖动的指数退避重试，含首次在内最多尝试的次数
+    DIFY_RETRY_MAX_ATTEMPTS: int = int(os.getenv("DIFY_RETRY_MAX_ATTEMPTS", "3"))
+    DIFY_RETRY_BACKOFF_BASE: float = float(os.getenv("DIFY_RETRY_BACKOFF_BASE", "0.2"))
+    DIFY_RETRY_BACKOFF_MAX: float = float(os.getenv("DIFY_RETRY_BACKOFF_MAX", "2"))
+    # 全局重试预算：重试和对冲请求最多为正常请求数的该比例，另有每秒的保底额度
+    DIFY_RETRY_BUDGET_RATIO: float = float(os.getenv("DIFY_RETRY_BUDGET_RATIO", "0.1"))
+    DIFY_RETRY_BUDGET_MIN_PER_SECOND: float = float(os.getenv("DIFY_RETRY_BUDGET_MIN_PER_SECOND", "1"))
+    # 对冲请求：这些应用的调用超过近期耗时的该分位数仍未返回时，再发出一个相同的请求，采用先返回的结果
+    DIFY_HEDGE_APPS: str = os.getenv("DIFY_HEDGE_APPS", "parse,rewrite,expand,contract")
+    DIFY_HEDGE_PERCENTILE: float = float(os.getenv("DIFY_HEDGE_PERCENTILE", "95"))
+    # 对冲前至少等待的秒数，以及开始对冲前需要的耗时样本数
+    DIFY_HEDGE_MIN_DELAY: float = float(os.getenv("DIFY_HEDGE_MIN_DELAY", "1"))
+    DIFY_HEDGE_MIN_SAMPLES: int = int(os.getenv("DIFY_HEDGE_MIN_SAMPLES", "20"))
+
+    # 响应压缩：JSON / NDJSON 响应按 Accept-Encoding 使用 brotli（需要安装 brotli）或 gzip 压缩
+    COMPRESSION_ENABLED: bool = _env_bool("COMPRESSION_ENABLED", "true")
+    # 小于该大小（字节）的非流式响应不压缩；流式响应（NDJSON）总是逐段压缩
+    COMPRESSION_MIN_BYTES: int = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+    COMPRESSION_GZIP_LEVEL: int = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+    COMPRESSION_BROTLI_QUALITY: int = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+    # 是否开启 Prometheus 指标（/metrics）
+    METRICS_ENABLED: bool = _env_bool("METRICS_ENABLED", "true")
+
+    # 启动后是否在后台预热渲染进程、PDF 提取和缓存；预热完成前 /ready 返回 503
+    WARMUP_ENABLED: bool = _env_bool("WARMUP_ENABLED", "true")
+
+    # PDF 渲染进程池配置
+    # 工作进程数，0 表示等于 CPU 核数
+    RENDER_WORKERS: int = int(os.getenv("RENDER_WORKERS", "0"))
+    # 除正在执行的任务外，最多允许排队的任务数
+    RENDER_QUEUE_SIZE: int = int(os.getenv("RENDER_QUEUE_SIZE", "16"))
+    # 单个渲染任务的超时时间（秒）
+    RENDER_JOB_TIMEOUT: float = float(os.getenv("RENDER_JOB_TIMEOUT", "60"))
+    # 每个工作进程处理多少个任务后重启，0 表示不重启
+    RENDER_MAX_JOBS_PER_WORKER: int = int(os.getenv("RENDER_MAX_JOBS_PER_WORKER", "100"))
+    # 是否只嵌入用到的字形（字体子集化），关闭后 PDF 会包含完整字体
+    RENDER_SUBSET_FONTS: bool = _env_bool("RENDER_SUBSET_FONTS", "true")
+    # 精简输出（/generate-resume/?compact=true）：图片重新压缩的 JPEG 质量和降采样的目标分辨率（DPI）
+    RENDER_COMPACT_JPEG_QUALITY: int = int(os.getenv("RENDER_COMPACT_JPEG_QUALITY", "75"))
+    RENDER_COMPACT_DPI: int = int(os.getenv("RENDER_COMPACT_DPI", "150"))
+
+    # 模板配置
+    # Jinja 字节码缓存目录，渲染进程重启后无需重新编译模板；留空表示不使用
+    TEMPLATE_BYTECODE_DIR: str = os.getenv(
+        "TEMPLATE_BYTECODE_DIR", os.path.join(tempfile.gettempdir(), "resume_api", "jinja_cache"))
+    # 是否监听 templates/ 目录，模板变化后无需重启即可生效（需要安装 watchfiles）
+    TEMPLATE_HOT_RELOAD: bool = _env_bool("TEMPLATE_HOT_RELOAD", "false")
+
+    # 批量渲染时同时渲染的份数，0 表示等于渲染进程数
+    BATCH_RENDER_CONCURRENCY: int = int(os.getenv("BATCH_RENDER_CONCURRENCY", "0"))
+
+    # 批量文本变换配置
+    # 单次请求最多包含的文本段数
+    BULK_MAX_TEXTS: int = int(os.getenv("BULK_MAX_TEXTS", "200"))
+    # 默认并发数，以及客户端可请求的最大并发数
+    BULK_DEFAULT_CONCURRENCY: int = int(os.getenv("BULK_DEFAULT_CONCURRENCY", "8"))
+    BULK_MAX_CONCURRENCY: int = int(os.getenv("BULK_MAX_CONCURRENCY", "16"))
+
+    # 上传PDF解析配置
+    PDF_MAX_UPLOAD_BYTES: int = int(os.getenv("PDF_MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+    PDF_MAX_PAGES: int = int(os.getenv("PDF_MAX_PAGES", "200"))
+    # 页数达到该值时按页段并行提取文本
+    PDF_PARALLEL_PAGE_THRESHOLD: int = int(os.getenv("PDF_PARALLEL_PAGE_THRESHOLD", "24"))
+    # 并行提取的进程数，0 表示 min(4, CPU 核数)
+    PDF_EXTRACT_WORKERS: int = int(os.getenv("PDF_EXTRACT_WORKERS", "0"))
+    # 按 SHA-256 缓存的提取结果条数
+    PDF_TEXT_CACHE_ENTRIES: int = int(os.getenv("PDF_TEXT_CACHE_ENTRIES", "256"))
+
+    # 分段解析：长简历按章节标题和页切分后并发解析再合并，短于 PARSE_CHUNK_MIN_CHARS 的按整篇解析
+    PARSE_CHUNKED_ENABLED: bool = _env_bool("PARSE_CHUNKED_ENABLED", "true")
+    PARSE_CHUNK_MIN_CHARS: int = int(os.getenv("PARSE_CHUNK_MIN_CHARS", "6000"))
+    # 每段的最大字符数
+    PARSE_CHUNK_MAX_CHARS: int = int(os.getenv("PARSE_CHUNK_MAX_CHARS", "4000"))
+    # 同一份简历最多同时解析的分段数
+    PARSE_CHUNK_CONCURRENCY: int = int(os.getenv("PARSE_CHUNK_CONCURRENCY", "4"))
+
+    # 异步任务队列配置
+    JOB_DB_PATH: str = os.getenv("JOB_DB_PATH", os.path.join(tempfile.gettempdir(), "resume_api", "jobs.sqlite3"))
+    # 同时执行的任务数
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "4"))
+    # 任务结果保留时间（秒）
+    JOB_RESULT_TTL: float = float(os.getenv("JOB_RESULT_TTL", "86400"))
+    # 执行中任务的租约时长（秒）：执行进程每 1/3 个租约时长续期一次，进程退出后租约过期的任务重新排队
+    JOB_LEASE_TTL: float = float(os.getenv("JOB_LEASE_TTL", "60"))
+    # 允许的 callback_url 主机，逗号分隔，支持 *.example.com；留空表示允许任意公网地址。
+    # 不在列表中的主机解析到内网、回环、链路本地等非公网地址时拒绝回调
+    JOB_CALLBACK_ALLOWED_HOSTS: str = os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "")
+
+    # PDF 结果缓存配置
+    PDF_CACHE_ENABLED: bool = _env_bool("PDF_CACHE_ENABLED", "true")
+    # 内存层容量（字节）
+    PDF_CACHE_MEMORY_BYTES: int = int(os.getenv("PDF_CACHE_MEMORY_BYTES", str(256 * 1024 * 1024)))
+    # 磁盘层目录，留空表示不使用磁盘层
+    PDF_CACHE_DIR: str = os.getenv("PDF_CACHE_DIR", os.path.join(tempfile.gettempdir(), "resume_api", "pdf_cache"))
+    # 磁盘层容量（字节）
+    PDF_CACHE_DISK_BYTES: int = int(os.getenv("PDF_CACHE_DISK_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+    # 简历预览配置
+    # PNG 缩略图的默认分辨率和客户端可请求的最大分辨率（DPI）
+    PREVIEW_DPI: int = int(os.getenv("PREVIEW_DPI", "48"))
+    PREVIEW_MAX_DPI: int = int(os.getenv("PREVIEW_MAX_DPI", "150"))
+    # 同一 user_uid 的预览请求在该时间（毫秒）内被新请求取代时不会开始渲染
+    PREVIEW_DEBOUNCE_MS: int = int(os.getenv("PREVIEW_DEBOUNCE_MS", "150"))
+
+    # Dify 响应缓存配置（默认关闭）
+    DIFY_CACHE_ENABLED: bool = _env_bool("DIFY_CACHE_ENABLED", "false")
+    # 默认 TTL（秒）
+    DIFY_CACHE_DEFAULT_TTL: float = float(os.getenv("DIFY_CACHE_DEFAULT_TTL", "600"))
+    # 按应用覆盖 TTL，例如 "parse=3600,recommendation=0"（0 表示该应用不缓存）
+    DIFY_CACHE_TTLS: str = os.getenv("DIFY_CACHE_TTLS", "")
+    DIFY_CACHE_MAX_ENTRIES: int = int(os.getenv("DIFY_CACHE_MAX_ENTRIES", "2048"))
+    DIFY_CACHE_MAX_BYTES: int = int(os.getenv("DIFY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+    # Dify 会话（默认关闭）：请求带 user_uid 时按用户和应用保存 conversation_id，追问只发送修改内容
+    DIFY_SESSIONS_ENABLED: bool = _env_bool("DIFY_SESSIONS_ENABLED", "false")
+    DIFY_SESSION_APPS: str = os.getenv("DIFY_SESSION_APPS", "rewrite,expand,contract,personal_statement,prompt_based")
+    # 会话空闲多久（秒）后失效，以及最多保存的会话数
+    DIFY_SESSION_TTL: float = float(os.getenv("DIFY_SESSION_TTL", "1800"))
+    DIFY_SESSION_MAX_ENTRIES: int = int(os.getenv("DIFY_SESSION_MAX_ENTRIES", "10000"))
+    # 修改内容超过全文的该比例时不再续用会话，改为发送全文并开启新会话
+    DIFY_SESSION_MAX_DELTA_RATIO: float = float(os.getenv("DIFY_SESSION_MAX_DELTA_RATIO", "0.5"))
+
+    # Idempotency-Key 配置：带相同键的重试请求直接重放首次的响应
+    IDEMPOTENCY_ENABLED: bool = _env_bool("IDEMPOTENCY_ENABLED", "true")
+    # 响应保留时间（秒）
+    IDEMPOTENCY_TTL: float = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+    # 保存的响应总大小上限（字节），超出时淘汰最早完成的记录
+    IDEMPOTENCY_MAX_BYTES: int = int(os.getenv("IDEMPOTENCY_MAX_BYTES", str(64 * 1024 * 1024)))
+    # 单个响应超过该大小（字节）时不保存，重试会重新执行
+    IDEMPOTENCY_MAX_RESPONSE_BYTES: int = int(os.getenv("IDEMPOTENCY_MAX_RESPONSE_BYTES", str(8 * 1024 * 1024)))
+    # 带 Idempotency-Key 的请求体需要先读入内存计算指纹，超过该大小（字节）时返回 413；
+    # 默认为上传PDF上限加 1MB（multipart 的分隔和表单字段）
+    IDEMPOTENCY_MAX_REQUEST_BYTES: int = int(os.getenv("IDEMPOTENCY_MAX_REQUEST_BYTES",
+                                                       str(PDF_MAX_UPLOAD_BYTES + 1024 * 1024)))
+
+    # 请求追踪配置：采样率为 0 时只分配 trace_id（响应头 X-Trace-Id），不记录 Span
+    TRACE_SAMPLE_RATE: float = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+    # 导出方式：jsonl 写入本地文件，otlp 以 OTLP/HTTP JSON 发送到采集器
+    TRACE_EXPORTER: Literal['jsonl', 'otlp'] = os.getenv("TRACE_EXPORTER", "jsonl")
+    TRACE_JSONL_PATH: str = os.getenv("TRACE_JSONL_PATH", os.path.join(tempfile.gettempdir(), "resume_api_traces.jsonl"))
+    TRACE_OTLP_ENDPOINT: str = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+    TRACE_SERVICE_NAME: str = os.getenv("TRACE_SERVICE_NAME", "resume-api")
+    # 待导出 Span 的缓冲上限，超出时丢弃
+    TRACE_MAX_QUEUE: int = int(os.getenv("TRACE_MAX_QUEUE", "10000"))
+    # 批量导出间隔（秒）
+    TRACE_FLUSH_SECONDS: float = float(os.getenv("TRACE_FLUSH_SECONDS", "2"))
+
     # Dify 各功能对应的密钥
     DIFY_API_KEYS: Dict[str, str] = {
         'parse': os.getenv("DIFY_API_KEY_PARSE"),
@@ -72,7 +261,7 @@ class Settings(BaseModel):
     # 校验所有必要环境变量是否已设置
     def __init__(self, **data):
         super().__init__(**data)
-        if not self.API_KEY or not self.DIFY_API_URL or not all(self.DIFY_API_KEYS.values()):
+        if not (self.API_KEY or self.API_CLIENTS) or not self.DIFY_API_URL or not all(self.DIFY_API_KEYS.values()):
             raise ValueError("缺少必要的环境变量，请检查 .env 文件配置。")
 
 
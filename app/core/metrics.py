@@ -0,0 +1,134 @@
+import time
+from typing import Dict
+
+from anyio.to_thread import current_default_thread_limiter
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Dify 调用通常在秒级，渲染和提取在毫秒到秒级，两组分桶分开设置
+FAST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+BYTE_BUCKETS = (16e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 5e6, 10e6)
+PAGE_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+HTTP_REQUESTS = Counter(
+    "resume_api_http_requests_total", "HTTP 请求数", ["method", "route", "status"])
+HTTP_LATENCY = Histogram(
+    "resume_api_http_request_duration_seconds", "HTTP 请求耗时（含流式响应的完整传输时间）",
+    ["method", "route"], buckets=SLOW_BUCKETS)
+HTTP_IN_FLIGHT = Gauge(
+    "resume_api_http_requests_in_flight", "正在处理的 HTTP 请求数", ["method", "route"])
+
+THREADPOOL_BUSY = Gauge(
+    "resume_api_threadpool_busy_threads", "默认线程池中正在执行的任务数")
+THREADPOOL_WAITING = Gauge(
+    "resume_api_threadpool_queue_depth", "等待默认线程池空闲线程的任务数")
+THREADPOOL_SIZE = Gauge(
+    "resume_api_threadpool_size", "默认线程池的线程上限")
+
+DIFY_LATENCY = Histogram(
+    "resume_api_dify_request_duration_seconds", "Dify 应用的上游耗时", ["app"], buckets=SLOW_BUCKETS)
+DIFY_ERRORS = Counter(
+    "resume_api_dify_errors_total", "Dify 应用的调用失败数", ["app", "reason"])
+DIFY_IN_FLIGHT = Gauge(
+    "resume_api_dify_requests_in_flight", "正在进行的 Dify 调用数", ["app"])
+DIFY_RETRIES = Counter(
+    "resume_api_dify_retries_total", "Dify 调用的重试数（按原因），budget_exhausted 为因预算耗尽放弃的重试", ["app", "reason"])
+DIFY_HEDGES = Counter(
+    "resume_api_dify_hedges_total",
+    "Dify 对冲请求（sent / hedge_won / primary_won / budget_exhausted）", ["app", "outcome"])
+
+RENDER_PHASE_SECONDS = Histogram(
+    "resume_api_render_phase_seconds", "PDF 渲染各阶段耗时（jinja / layout / write_pdf）",
+    ["phase"], buckets=FAST_BUCKETS)
+RENDER_OUTPUT_BYTES = Histogram(
+    "resume_api_render_output_bytes", "渲染得到的 PDF 大小（字节）", buckets=BYTE_BUCKETS)
+RENDER_COMPACT_RATIO = Histogram(
+    "resume_api_render_compact_ratio", "精简输出的 PDF 大小与常规输出之比",
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1))
+RENDER_IN_FLIGHT = Gauge(
+    "resume_api_render_jobs_in_flight", "渲染进程池中执行中和排队中的任务数")
+
+CLIENT_THROTTLED = Counter(
+    "resume_api_client_throttled_total", "因超出速率限制被拒绝（429）的请求数", ["client", "op_class"])
+
+IDEMPOTENCY_REQUESTS = Counter(
+    "resume_api_idempotency_requests_total",
+    "带 Idempotency-Key 的请求数（executed / replayed / attached / mismatch）", ["outcome"])
+
+RESPONSE_COMPRESSION_BYTES = Counter(
+    "resume_api_response_compression_bytes_total",
+    "响应压缩前后的字节数（original / compressed）", ["encoding", "kind"])
+
+EXTRACT_SECONDS = Histogram(
+    "resume_api_pdf_extract_seconds", "PyMuPDF 提取上传PDF文本的耗时", buckets=FAST_BUCKETS)
+EXTRACT_PAGES = Histogram(
+    "resume_api_pdf_extract_pages", "上传PDF的页数", buckets=PAGE_BUCKETS)
+
+
+def observe_render(timings: Dict[str, float], size: int) -> None:
+    """记录工作进程返回的各阶段耗时和输出大小（工作进程内的指标无法直接被采集）。"""
+    for phase, seconds in timings.items():
+        RENDER_PHASE_SECONDS.labels(phase).observe(seconds)
+    RENDER_OUTPUT_BYTES.observe(size)
+
+
+def _update_threadpool_gauges() -> None:
+    # run_in_threadpool 使用 anyio 的默认线程限流器，借出的令牌即正在执行的任务
+    statistics = current_default_thread_limiter().statistics()
+    THREADPOOL_BUSY.set(statistics.borrowed_tokens)
+    THREADPOOL_WAITING.set(statistics.tasks_waiting)
+    THREADPOOL_SIZE.set(statistics.total_tokens)
+
+
+def render_latest() -> bytes:
+    """生成 Prometheus 文本格式的指标，需在事件循环中调用。"""
+    _update_threadpool_gauges()
+    return generate_latest()
+
+
+def route_template(scope: Scope) -> str:
+    """请求对应的路由模板（如 /jobs/{job_id}），未匹配的路径统一记为 unmatched。"""
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    记录每个路由的请求数、耗时和在途请求数。
+
+    使用纯 ASGI 中间件而不是 BaseHTTPMiddleware，避免缓冲流式响应；
+    路由标签取路由模板（如 /jobs/{job_id}），未匹配的路径统一记为 unmatched，防止标签基数失控。
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(scope)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight = HTTP_IN_FLIGHT.labels(method, route)
+        in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+            HTTP_LATENCY.labels(method, route).observe(time.perf_counter() - started)
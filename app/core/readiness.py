@@ -0,0 +1,57 @@
+import time
+from typing import Any, Dict, Optional
+
+
+class ReadinessRegistry:
+    """
+    记录各组件的初始化状态，供 /ready 就绪探针使用。
+
+    - 启动时用 expect() 登记需要等待的组件，状态为 starting；
+    - 组件初始化（含后台预热）完成后调用 mark_ready()，失败时调用 mark_failed()；
+    - 所有登记的组件都就绪后才算就绪；关闭时调用 drain()，让负载均衡器先摘除流量。
+
+    与 / 健康检查不同：/ 只表示进程存活，/ready 表示可以接收流量。
+    """
+
+    def __init__(self):
+        self._components: Dict[str, Dict[str, Any]] = {}
+        self._started = time.monotonic()
+        self._draining = False
+
+    def expect(self, *names: str) -> None:
+        self._started = time.monotonic()
+        self._draining = False
+        for name in names:
+            self._components[name] = {"status": "starting"}
+
+    def mark_ready(self, name: str, seconds: Optional[float] = None) -> None:
+        if seconds is None:
+            seconds = time.monotonic() - self._started
+        self._components[name] = {"status": "ready", "seconds": round(seconds, 3)}
+
+    def mark_failed(self, name: str, error: BaseException) -> None:
+        self._components[name] = {"status": "failed", "error": f"{type(error).__name__}: {error}"}
+
+    def drain(self) -> None:
+        """进入关闭流程：之后 /ready 一律返回未就绪。"""
+        self._draining = True
+
+    @property
+    def ready(self) -> bool:
+        return (not self._draining and bool(self._components)
+                and all(c["status"] == "ready" for c in self._components.values()))
+
+    def status(self) -> Dict[str, Any]:
+        if self._draining:
+            state = "draining"
+        elif self.ready:
+            state = "ready"
+        elif any(c["status"] == "failed" for c in self._components.values()):
+            state = "failed"
+        else:
+            state = "starting"
+        return {"status": state, "components": dict(self._components)}
+
+
+# 创建一个全局的就绪状态实例
+readiness = ReadinessRegistry()
@@ -0,0 +1,361 @@
+import asyncio
+import os
+import random
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+import orjson
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.metrics import route_template
+
+# W3C Trace Context：version-traceid-parentid-flags
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_TRACE_ID = re.compile(r"^[0-9a-f]{32}$")
+TRACE_ID_HEADER = "X-Trace-Id"
+
+
+def _new_id(nbytes: int) -> str:
+    return random.getrandbits(nbytes * 8).to_bytes(nbytes, "big").hex()
+
+
+class Span:
+    """一个计时区间。只有被采样的请求才会创建 Span，未采样时使用 _NoopSpan。"""
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str,
+                 attributes: Dict[str, Any], start_ns: Optional[int] = None):
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    @property
+    def sampled(self) -> bool:
+        return True
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """未采样请求的占位 Span：只携带 trace_id 用于日志关联和向下游传递。"""
+    __slots__ = ("trace_id", "span_id")
+
+    def __init__(self, trace_id: str, span_id: str):
+        self.trace_id = trace_id
+        self.span_id = span_id
+
+    @property
+    def sampled(self) -> bool:
+        return False
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+
+_current_span: ContextVar[Optional[Any]] = ContextVar("current_span", default=None)
+
+
+class JSONLExporter:
+    """把 Span 逐行追加到本地 JSONL 文件。"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, spans: List[Span]) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(b"".join(orjson.dumps(span.to_dict()) + b"\n" for span in spans))
+
+    async def export(self, spans: List[Span]) -> None:
+        await run_in_threadpool(self._write, spans)
+
+    async def close(self) -> None:
+        pass
+
+
+class OTLPExporter:
+    """以 OTLP/HTTP JSON 格式发送到兼容的采集器（如 OpenTelemetry Collector、Jaeger、Tempo）。"""
+
+    def __init__(self, endpoint: str, service_name: str):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self._client = httpx.AsyncClient(timeout=10)
+
+    @staticmethod
+    def _value(value: Any) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)}
+
+    def _span(self, span: Span) -> Dict[str, Any]:
+        data = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 2 if span.parent_id is None else 1,   # SERVER / INTERNAL
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [{"key": k, "value": self._value(v)} for k, v in span.attributes.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            data["parentSpanId"] = span.parent_id
+        return data
+
+    async def export(self, spans: List[Span]) -> None:
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": "resume_api"}, "spans": [self._span(s) for s in spans]}],
+        }]}
+        response = await self._client.post(self.endpoint, content=orjson.dumps(payload),
+                                           headers={"Content-Type": "application/json"})
+        response.raise_for_status()
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+class Tracer:
+    """
+    轻量的请求追踪。
+
+    - 每个请求都有 trace_id：沿用请求头 traceparent / X-Trace-Id，否则新生成，并在响应头 X-Trace-Id 中返回；
+    - 按 sample_rate 采样（携带 traceparent 时沿用上游的采样标记），未采样的请求只分配 ID，不记录 Span；
+    - 结束的 Span 放入有界缓冲区，由后台任务定期批量导出，缓冲区满时丢弃，不阻塞请求；
+    - 调用 Dify 时通过 traceparent 请求头向下游传递。
+    """
+
+    def __init__(self, sample_rate: float, exporter=None, max_queue: int = 10000, flush_interval: float = 2.0):
+        self.sample_rate = sample_rate if exporter is not None else 0.0
+        self.exporter = exporter
+        self.max_queue = max_queue
+        self.flush_interval = flush_interval
+        self._buffer: Deque[Span] = deque()
+        self._task: Optional[asyncio.Task] = None
+        self.exported = 0
+        self.dropped = 0
+        self.export_errors = 0
+
+    # --- 请求入口 ---
+
+    def start_trace(self, headers: Headers) -> Tuple[str, Optional[str], bool]:
+        """返回 (trace_id, 上游 span_id, 是否采样)。"""
+        match = _TRACEPARENT.match(headers.get("traceparent", "").strip().lower())
+        if match:
+            trace_id, parent_id, flags = match.groups()
+            # 沿用上游的采样决定，保证同一条链路要么完整记录、要么都不记录
+            return trace_id, parent_id, bool(int(flags, 16) & 1) and self.exporter is not None
+        trace_id = headers.get(TRACE_ID_HEADER, "").strip().lower()
+        if not _TRACE_ID.match(trace_id):
+            trace_id = _new_id(16)
+        return trace_id, None, self._sample()
+
+    def _sample(self) -> bool:
+        return self.sample_rate > 0 and (self.sample_rate >= 1 or random.random() < self.sample_rate)
+
+    # --- Span ---
+
+    @staticmethod
+    def current() -> Optional[Any]:
+        return _current_span.get()
+
+    @staticmethod
+    def annotate(**attributes: Any) -> None:
+        """为当前 Span 添加属性；不在请求内时忽略。"""
+        span = _current_span.get()
+        if span is not None:
+            span.set(**attributes)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Any]:
+        """在当前 Span 下创建子 Span；当前请求未采样或不在请求内时几乎没有开销。"""
+        parent = _current_span.get()
+        if parent is None or not parent.sampled:
+            yield parent if parent is not None else _NOOP
+            return
+        span = Span(parent.trace_id, parent.span_id, name, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            self.finish(span)
+
+    @contextmanager
+    def root(self, trace_id: str, parent_id: Optional[str], sampled: bool, name: str,
+             **attributes: Any) -> Iterator[Any]:
+        if not sampled:
+            token = _current_span.set(_NoopSpan(trace_id, parent_id or _new_id(8)))
+            try:
+                yield _current_span.get()
+            finally:
+                _current_span.reset(token)
+            return
+        span = Span(trace_id, parent_id, name, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            self.finish(span)
+
+    def record(self, name: str, start_ns: int, end_ns: int, **attributes: Any) -> None:
+        """补记一个已经结束的子 Span（例如工作进程返回的各阶段耗时）。"""
+        parent = _current_span.get()
+        if parent is None or not parent.sampled:
+            return
+        span = Span(parent.trace_id, parent.span_id, name, attributes, start_ns)
+        span.end_ns = end_ns
+        self._enqueue(span)
+
+    def record_since_request_start(self, name: str, **attributes: Any) -> None:
+        """补记从请求开始到现在的区间，例如 multipart 上传和请求体解析。"""
+        parent = _current_span.get()
+        if isinstance(parent, Span):
+            self.record(name, _request_start.get() or parent.start_ns, time.time_ns(), **attributes)
+
+    def finish(self, span: Span) -> None:
+        span.end_ns = time.time_ns()
+        self._enqueue(span)
+
+    def _enqueue(self, span: Span) -> None:
+        if len(self._buffer) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._buffer.append(span)
+
+    def traceparent(self) -> Optional[str]:
+        """当前 Span 对应的 traceparent 请求头，用于向下游传递。"""
+        span = _current_span.get()
+        if span is None:
+            return None
+        return f"00-{span.trace_id}-{span.span_id}-{'01' if span.sampled else '00'}"
+
+    # --- 导出 ---
+
+    async def flush(self) -> None:
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(len(self._buffer), 512))]
+            try:
+                await self.exporter.export(batch)
+                self.exported += len(batch)
+            except Exception as e:
+                self.export_errors += 1
+                self.dropped += len(batch)
+                print(f"Trace export failed: {e}")
+                return
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def startup(self) -> None:
+        """启动后台导出任务，在 FastAPI 启动时调用。"""
+        if self.exporter is not None and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def shutdown(self) -> None:
+        """导出剩余的 Span 并停止后台任务，在 FastAPI 关闭时调用。"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            await self.flush()
+            await self.exporter.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sample_rate": self.sample_rate,
+            "buffered": len(self._buffer),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "export_errors": self.export_errors,
+        }
+
+
+_NOOP = _NoopSpan("0" * 32, "0" * 16)
+_request_start: ContextVar[Optional[int]] = ContextVar("request_start", default=None)
+
+
+class TracingMiddleware:
+    """
+    为每个 HTTP 请求建立根 Span（名称为 方法 + 路由模板），记录状态码，
+    并在响应头中返回 X-Trace-Id，便于客户端反馈问题时定位。纯 ASGI 实现，不缓冲流式响应。
+    """
+
+    def __init__(self, app: ASGIApp, instance: Optional[Tracer] = None):
+        self.app = app
+        self.tracer = instance or tracer
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace_id, parent_id, sampled = self.tracer.start_trace(Headers(scope=scope))
+        name = f"{scope['method']} {route_template(scope)}" if sampled else ""
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)[TRACE_ID_HEADER] = trace_id
+                span.set(**{"http.status_code": message["status"]})
+            await send(message)
+
+        token = _request_start.set(time.time_ns())
+        try:
+            with self.tracer.root(trace_id, parent_id, sampled, name,
+                                  **{"http.method": scope["method"], "http.target": scope["path"]}) as span:
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_start.reset(token)
+
+
+def _create_tracer() -> Tracer:
+    exporter = None
+    if settings.TRACE_SAMPLE_RATE > 0:
+        if settings.TRACE_EXPORTER == "otlp":
+            exporter = OTLPExporter(settings.TRACE_OTLP_ENDPOINT, settings.TRACE_SERVICE_NAME)
+        elif settings.TRACE_EXPORTER == "jsonl":
+            exporter = JSONLExporter(settings.TRACE_JSONL_PATH)
+    return Tracer(settings.TRACE_SAMPLE_RATE, exporter, settings.TRACE_MAX_QUEUE, settings.TRACE_FLUSH_SECONDS)
+
+
+# 创建一个全局的追踪器实例
+tracer = _create_tracer()
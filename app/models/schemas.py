@@ -55,16 +55,33 @@
 #     user_target: Optional[str] = None
 
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
 
 # --- 通用输入模型 ---
 class TextInput(BaseModel):
     text: str = Field(..., min_length=1)
+    # 可选：按用户区分 Dify user；开启 DIFY_SESSIONS_ENABLED 时同一用户的多次编辑复用 Dify 会话
+    user_uid: Optional[str] = Field(None, max_length=128)
 
 # 新增：用于接收文本和Prompt的模型
 class PromptTextInput(BaseModel):
     text: str
     prompt: str
+    user_uid: Optional[str] = Field(None, max_length=128)
+
+# 批量文本变换：对多段文本执行同一种操作
+class BulkTextInput(BaseModel):
+    texts: List[str] = Field(..., min_length=1)
+    operation: Literal['rewrite', 'expand', 'contract', 'prompt']
+    prompt: Optional[str] = None           # operation 为 prompt 时必填
+    concurrency: Optional[int] = Field(None, ge=1)
+
+# 异步任务提交：operation 为任意已有操作，payload 为该操作对应接口的请求体
+class JobSubmission(BaseModel):
+    operation: Literal['parse', 'rewrite', 'expand', 'contract', 'prompt',
+                       'statement', 'recommendation', 'render']
+    payload: Dict[str, Any]
+    callback_url: Optional[str] = None     # 任务结束后以 POST 回调通知该地址
 
 # --- 简历生成相关的结构化模型 ---
 class ContactInfo(BaseModel):
@@ -112,4 +129,5 @@ class NewResumeProfile(BaseModel):
     internship_experience: List[ExperienceItem]
     user_research_experience: Optional[List[ResearchItem]] = []
     user_extracurricular_activities: Optional[List[ActivityItem]] = []
-    user_target: Optional[str] = None
\ No newline at end of file
+    user_target: Optional[str] = None
+    style: Optional[str] = None            # 简历样式名（见 GET /templates/），默认 default
\ No newline at end of file
@@ -1,7 +1,6 @@
-import secrets
 from fastapi import Depends, HTTPException, status
 from fastapi.security import APIKeyHeader
-from app.core.config import settings
+from app.services.clients import ClientRegistry, client_registry, current_client, charge
 
 # 定义从请求头 'X-API-Key' 中获取密钥的方案
 api_key_header_scheme = APIKeyHeader(name="X-API-Key")
@@ -9,15 +8,18 @@ api_key_header_scheme = APIKeyHeader(name="X-API-Key")
 class APIKeyValidator:
     """
     API Key 验证器类，用于验证请求头中的 X-API-Key。
+    支持多个调用方（见 clients 模块），验证通过后把调用方记录到 current_client，供限速和公平调度使用。
     """
-    def __init__(self, expected_key: str):
-        self.expected_key = expected_key
+    def __init__(self, registry: ClientRegistry):
+        self.registry = registry
 
     async def __call__(self, api_key_header: str = Depends(api_key_header_scheme)) -> str:
         """
         作为FastAPI依赖项被调用，验证传入的API Key。
         """
-        if self.expected_key and secrets.compare_digest(api_key_header, self.expected_key):
+        client = self.registry.lookup(api_key_header)
+        if client is not None:
+            current_client.set(client)
             return api_key_header
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -25,4 +27,14 @@ class APIKeyValidator:
         )
 
 # 创建一个全局的验证器实例，供路由层直接使用
-auth_validator = APIKeyValidator(settings.API_KEY)
+auth_validator = APIKeyValidator(client_registry)
+
+
+def rate_limit(op_class: str, cost: int = 1):
+    """
+    生成一个路由依赖：验证 API Key 后按调用方扣除 op_class（llm / render）类令牌，
+    超出限速时抛出 RateLimitedError（返回 429）。开销取决于请求体时，在路由内直接调用 charge()。
+    """
+    async def dependency(api_key: str = Depends(auth_validator)) -> None:
+        charge(op_class, cost)
+    return dependency
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import re
+import time
+import zipfile
+from typing import Any, AsyncIterator, Dict, List, Set, Tuple, Union
+
+from pydantic import ValidationError
+
+from app.models.schemas import NewResumeProfile
+from app.services.idempotency import mark_response_failed
+from app.services.pdf_cache import pdf_cache
+from app.services.render_engine import render_engine, RenderQueueFullError
+
+# 批量请求中的一项：(序号, 简历数据或解析错误)
+BatchItem = Tuple[int, Union[NewResumeProfile, Exception]]
+
+
+class _ZipChunkBuffer:
+    """
+    ZipFile 的输出目标：只追加、不支持 seek（ZipFile 会因此改用数据描述符），
+    写入的字节由调用方通过 drain() 分段取走，内存中只保留尚未发送的部分。
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _safe_filename(index: int, user_uid: str) -> str:
+    safe_uid = re.sub(r'[^A-Za-z0-9._-]', '_', user_uid)[:64] or "unknown"
+    return f"{index:05d}_resume_{safe_uid}.pdf"
+
+
+async def parse_items(payload: List[Any]) -> AsyncIterator[BatchItem]:
+    """将 JSON 数组中的每个元素校验为 NewResumeProfile。"""
+    for index, raw in enumerate(payload):
+        try:
+            yield index, NewResumeProfile.model_validate(raw)
+        except ValidationError as e:
+            yield index, e
+
+
+async def parse_ndjson_items(body: bytes) -> AsyncIterator[BatchItem]:
+    """
+    逐行解析 NDJSON 请求体，每行一个 NewResumeProfile，按需校验而不是一次性全部转换为模型。
+    （StreamingResponse 会在发送期间监听客户端断开并占用 receive 通道，因此请求体需在响应开始前读完。）
+    """
+    index = 0
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            yield index, NewResumeProfile.model_validate_json(line)
+        except ValidationError as e:
+            yield index, e
+        index += 1
+
+
+async def _render_with_retry(profile: NewResumeProfile) -> bytes:
+    """批量渲染时渲染队列满不算失败，稍后重试，让出队列给交互请求。"""
+    cache_key = pdf_cache.key_for(profile)
+    delay = 0.2
+    while True:
+        try:
+            return await pdf_cache.get_or_render(cache_key, lambda: render_engine.render(profile))
+        except RenderQueueFullError:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 2.0)
+
+
+async def stream_batch_zip(items: AsyncIterator[BatchItem], concurrency: int) -> AsyncIterator[bytes]:
+    """
+    并行渲染一批简历，并以流的形式产出 ZIP 归档的字节。
+
+    最多同时渲染 concurrency 份；每份完成后立即写入 ZIP 并发送，内存占用与批量大小无关。
+    单份失败不会中断整批，结果统一记录在最后写入的 manifest.json 中。
+    """
+    buffer = _ZipChunkBuffer()
+    archive = zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_STORED)
+    manifest: List[Dict[str, Any]] = []
+    pending: Set[asyncio.Task] = set()
+    started = time.monotonic()
+
+    async def render_one(index: int, profile: NewResumeProfile):
+        try:
+            return index, profile, await _render_with_retry(profile), None
+        except Exception as e:
+            return index, profile, None, e
+
+    def write_result(index, profile, pdf_bytes, error) -> None:
+        entry: Dict[str, Any] = {"index": index}
+        if isinstance(profile, NewResumeProfile):
+            entry["user_uid"] = profile.user_uid
+        if error is None:
+            entry["file"] = _safe_filename(index, profile.user_uid)
+            entry["status"] = "ok"
+            entry["bytes"] = len(pdf_bytes)
+            archive.writestr(entry["file"], pdf_bytes)
+        else:
+            entry["status"] = "invalid" if isinstance(error, ValidationError) else "failed"
+            entry["error"] = str(error)
+            if entry["status"] == "failed":
+                # 渲染失败可能是暂时的，整批响应不保存为幂等结果，重试时重新渲染
+                mark_response_failed()
+        manifest.append(entry)
+
+    async def drain_completed() -> None:
+        nonlocal pending
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            write_result(*task.result())
+
+    try:
+        async for index, item in items:
+            if isinstance(item, Exception):
+                write_result(index, None, None, item)
+            else:
+                pending.add(asyncio.ensure_future(render_one(index, item)))
+                if len(pending) >= concurrency:
+                    await drain_completed()
+            data = buffer.drain()
+            if data:
+                yield data
+        while pending:
+            await drain_completed()
+            data = buffer.drain()
+            if data:
+                yield data
+
+        manifest.sort(key=lambda entry: entry["index"])
+        summary = {
+            "total": len(manifest),
+            "succeeded": sum(1 for entry in manifest if entry["status"] == "ok"),
+            "failed": sum(1 for entry in manifest if entry["status"] != "ok"),
+            "elapsed_seconds": round(time.monotonic() - started, 3),
+            "items": manifest,
+        }
+        archive.writestr("manifest.json", json.dumps(summary, ensure_ascii=False, indent=2))
+        archive.close()
+        yield buffer.drain()
+    finally:
+        # 客户端中途断开时取消尚未完成的渲染
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,30 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app.services.dify_client import dify_client
+
+
+async def transform_texts(texts: List[str], operation: str, prompt: Optional[str] = None,
+                          concurrency: int = 8) -> AsyncIterator[Dict[str, Any]]:
+    """
+    对一组文本并发执行同一种变换（改写/扩写/缩写/按提示生成），最多同时发出 concurrency 个 Dify 请求。
+    按完成顺序逐个产出结果，每个结果都带有输入序号：
+    成功为 {"index": i, "result": "..."}，失败为 {"index": i, "error": "..."}。
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index: int, text: str) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                return {"index": index, "result": await dify_client.transform_text(operation, text, prompt)}
+            except Exception as e:
+                return {"index": index, "error": f"调用Dify {operation} 接口失败: {e}"}
+
+    tasks = [asyncio.ensure_future(run(index, text)) for index, text in enumerate(texts)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # 客户端中途断开时取消剩余请求
+        for task in tasks:
+            task.cancel()
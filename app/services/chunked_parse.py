@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import re
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+from fastapi import UploadFile
+
+from app.core.config import settings
+from app.core.tracing import tracer
+from app.services.clients import charge
+from app.services.dify_client import dify_client
+from app.services.pdf_extractor import ExtractedPDF, InvalidPDFError, LayoutLine, pdf_extractor
+from app.services.structured_output import validate_profile
+
+logger = logging.getLogger(__name__)
+
+# 常见的简历章节名：字号和粗体都不突出的标题也能识别
+SECTION_KEYWORDS = re.compile(
+    r"(教育|学历|经历|经验|实习|工作|项目|科研|研究|论文|发表|出版|专利|获奖|荣誉|奖项|技能|证书|活动|社团|志愿|自我评价|"
+    r"education|experience|employment|internship|project|research|publication|patent|award|honou?r|skill|"
+    r"certificat|activit|volunteer|leadership|summary|profile)",
+    re.IGNORECASE,
+)
+# 以这些标点结尾的行是正文而不是标题
+SENTENCE_END = ("。", "，", "；", "：", ".", ",", ";", ":")
+MAX_HEADING_CHARS = 40
+
+# 各经历列表中用于判断"同一条经历"的字段（键为 model_dump(by_alias=True) 中的字段名）
+LIST_IDENTITIES = {
+    "user_education": ("user_university", "degree"),
+    "internship_experience": ("company", "role"),
+    "user_research_experience": ("research project", "role"),
+    "user_extracurricular_activities": ("organization", "role"),
+}
+
+
+class Section:
+    """简历中的一个章节：标题和按页分开的正文行，超长章节按页拆分。"""
+    __slots__ = ("heading", "pages")
+
+    def __init__(self, heading: str):
+        self.heading = heading
+        self.pages: List[List[str]] = []
+
+    def add(self, page: int, text: str) -> None:
+        while len(self.pages) <= page:
+            self.pages.append([])
+        self.pages[page].append(text)
+
+    def render(self) -> str:
+        return "\n".join(line for page in self.pages for line in page)
+
+
+def _body_style(pages: List[List[LayoutLine]]) -> Tuple[float, float]:
+    """按字数统计正文字号（出现最多的字号）和粗体文字的占比。"""
+    sizes: Counter = Counter()
+    bold_chars = total_chars = 0
+    for lines in pages:
+        for line in lines:
+            sizes[round(line.size * 2) / 2] += len(line.text)
+            total_chars += len(line.text)
+            bold_chars += len(line.text) if line.bold else 0
+    body_size = sizes.most_common(1)[0][0] if sizes else 0.0
+    return body_size, (bold_chars / total_chars if total_chars else 0.0)
+
+
+def _is_heading(line: LayoutLine, body_size: float, bold_ratio: float) -> bool:
+    text = line.text
+    if len(text) > MAX_HEADING_CHARS or len(text) < 2 or text.endswith(SENTENCE_END):
+        return False
+    if body_size and line.size >= body_size * 1.15:
+        return True
+    # 粗体只有在正文大多不是粗体时才有区分度
+    if line.bold and bold_ratio < 0.5 and line.block_lines <= 2:
+        return True
+    return len(text) <= 20 and bool(SECTION_KEYWORDS.search(text))
+
+
+def split_sections(pages: List[List[LayoutLine]]) -> List[Section]:
+    """按章节标题切分全文；第一个标题之前的内容（姓名、联系方式等）为标题为空的首个章节。"""
+    body_size, bold_ratio = _body_style(pages)
+    sections = [Section("")]
+    for page, lines in enumerate(pages):
+        for line in lines:
+            if _is_heading(line, body_size, bold_ratio):
+                sections.append(Section(line.text))
+            sections[-1].add(page, line.text)
+    return [section for section in sections if section.pages]
+
+
+def _split_long(lines: List[str], max_chars: int) -> List[str]:
+    """把一段正文按行打包成不超过 max_chars 的若干块（单行超长时单独成块）。"""
+    pieces, current, size = [], [], 0
+    for line in lines:
+        if current and size + len(line) + 1 > max_chars:
+            pieces.append("\n".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        pieces.append("\n".join(current))
+    return pieces
+
+
+def plan_chunks(sections: List[Section], max_chars: int) -> List[str]:
+    """
+    把章节按顺序打包成不超过 max_chars 的分段，章节不被拆开；
+    单个章节超长时先按页、再按行拆分，续段开头重复章节标题，便于模型识别所属章节。
+    """
+    units: List[str] = []
+    for section in sections:
+        text = section.render()
+        if len(text) <= max_chars:
+            units.append(text)
+            continue
+        prefix = f"{section.heading}（续）\n" if section.heading else ""
+        first = True
+        for page_lines in section.pages:
+            for piece in _split_long(page_lines, max_chars - len(prefix)):
+                units.append(piece if first else prefix + piece)
+                first = False
+
+    chunks, current = [], ""
+    for unit in units:
+        if current and len(current) + len(unit) + 2 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{unit}" if current else unit
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _normalize(value: Any) -> str:
+    return re.sub(r"[\s\W_]+", "", str(value or "")).casefold()
+
+
+def _merge_item(target: Dict[str, Any], item: Dict[str, Any]) -> None:
+    """合并同一条经历：补全空字段，描述要点按去重后的顺序追加。"""
+    for key, value in item.items():
+        if isinstance(value, list):
+            existing = target.setdefault(key, [])
+            seen = {_normalize(point) for point in existing}
+            for point in value:
+                if _normalize(point) not in seen:
+                    existing.append(point)
+                    seen.add(_normalize(point))
+        elif value not in (None, "") and target.get(key) in (None, ""):
+            target[key] = value
+
+
+def merge_profiles(parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    合并各分段的解析结果：标量字段取第一个非空值（首段包含姓名和联系方式），
+    联系方式逐项取非空值，经历列表按 LIST_IDENTITIES 中的字段去重合并，其余列表按内容去重。
+    """
+    merged: Dict[str, Any] = {}
+    indexes: Dict[str, Dict[Tuple[str, ...], Dict[str, Any]]] = {}
+    for part in parts:
+        for key, value in part.items():
+            if isinstance(value, list):
+                items = merged.setdefault(key, [])
+                index = indexes.setdefault(key, {})
+                fields = LIST_IDENTITIES.get(key)
+                for item in value:
+                    if isinstance(item, dict) and fields:
+                        identity = tuple(_normalize(item.get(field)) for field in fields)
+                        if not any(identity):
+                            identity = (_normalize(item),)
+                    else:
+                        identity = (_normalize(item),)
+                    if identity in index:
+                        if isinstance(item, dict):
+                            _merge_item(index[identity], item)
+                        continue
+                    item = dict(item) if isinstance(item, dict) else item
+                    index[identity] = item
+                    items.append(item)
+            elif isinstance(value, dict):
+                target = merged.setdefault(key, {})
+                if isinstance(target, dict):
+                    _merge_item(target, value)
+            elif value not in (None, "") and merged.get(key) in (None, ""):
+                merged[key] = value
+            else:
+                merged.setdefault(key, value)
+    return merged
+
+
+async def chunk_upload(file: UploadFile, extracted: ExtractedPDF, enabled: bool = True) -> List[str]:
+    """
+    为上传的PDF规划分段解析用的分段；未开启、文本短于 PARSE_CHUNK_MIN_CHARS 或只切出一段时
+    返回 [全文]，按整篇解析。需要在上传文件关闭之前调用。
+    """
+    if not enabled or len(extracted.text) < settings.PARSE_CHUNK_MIN_CHARS:
+        return [extracted.text]
+    try:
+        pages = await pdf_extractor.extract_layout(file, extracted.page_count)
+    except InvalidPDFError:
+        # 全文已经提取成功，只是无法读取版面信息，按整篇解析
+        return [extracted.text]
+    chunks = plan_chunks(split_sections(pages), settings.PARSE_CHUNK_MAX_CHARS)
+    return chunks if len(chunks) > 1 else [extracted.text]
+
+
+async def parse_chunks(chunks: List[str], text: str, concurrency: int = 4) -> Dict[str, Any]:
+    """
+    并发解析各分段并合并为一份 NewResumeProfile 形式的结果；只有一段时等同于 dify_client.parse_text。
+    任一分段解析失败时取消其余分段，退回整篇解析（额外按一次 llm 调用计费）。
+    返回值与 parse_text 相同，失败时为 {"error": ...}。
+    """
+    if len(chunks) <= 1:
+        return await dify_client.parse_text(text)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def parse_one(chunk: str) -> Dict[str, Any]:
+        async with semaphore:
+            return await dify_client.parse_text(chunk)
+
+    with tracer.span("parse.chunked", chunks=len(chunks)) as span:
+        tasks = [asyncio.ensure_future(parse_one(chunk)) for chunk in chunks]
+        error = None
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                part = await next_done
+                if "error" in part:
+                    error = part["error"]
+                    break
+        finally:
+            # 某段失败、抛出异常或请求被取消时，取消其余分段的 Dify 调用
+            for task in tasks:
+                task.cancel()
+        if error is not None:
+            span.set(fallback=True)
+            logger.warning("Chunked parse failed (%d chunks), falling back to the whole text: %s", len(chunks), error)
+            charge('llm')
+            return await dify_client.parse_text(text)
+        profile, _ = validate_profile(merge_profiles([task.result() for task in tasks]))
+        return profile
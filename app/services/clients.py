@@ -0,0 +1,226 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import CLIENT_THROTTLED
+
+# 限速的操作类别：llm 为 Dify 调用，render 为 PDF 渲染
+OPERATION_CLASSES = ("llm", "render")
+# 没有调用方上下文的任务（启动预热、异步任务队列）在公平调度中的名字
+INTERNAL_CLIENT = "_internal"
+
+
+class RateLimitedError(RuntimeError):
+    """调用方超出了某类操作的速率限制，应返回 429 并提示何时重试。"""
+
+    def __init__(self, client: str, op_class: str, retry_after: float):
+        super().__init__(f"客户端 {client} 的 {op_class} 请求过于频繁，请稍后重试。")
+        self.client = client
+        self.op_class = op_class
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多积累 burst 个；rate 为 0 表示不限速。"""
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self, cost: float = 1) -> float:
+        """
+        尝试取出 cost 个令牌：成功返回 0，否则返回需要等待的秒数（不扣除令牌）。
+        cost 超过桶容量时，桶装满即可通过，但会按全额扣除，令牌变为负数（欠账），
+        之后的请求要等欠账补齐才能通过，大批量请求因此按实际数量计费。
+        """
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        required = min(cost, self.burst)
+        if self.tokens >= required:
+            self.tokens -= cost
+            return 0.0
+        return (required - self.tokens) / self.rate
+
+
+class APIClient:
+    """一个 API Key 对应的调用方：名字、公平调度权重和各类操作的令牌桶。"""
+    __slots__ = ("name", "weight", "buckets")
+
+    def __init__(self, name: str, weight: int, limits: Dict[str, Tuple[float, float]]):
+        self.name = name
+        self.weight = max(1, int(weight))
+        self.buckets = {op_class: TokenBucket(*limits[op_class]) for op_class in OPERATION_CLASSES}
+
+    def charge(self, op_class: str, cost: float = 1) -> None:
+        """扣除 cost 个令牌，不足时抛出 RateLimitedError。"""
+        wait = self.buckets[op_class].take(cost)
+        if wait > 0:
+            CLIENT_THROTTLED.labels(self.name, op_class).inc()
+            raise RateLimitedError(self.name, op_class, wait)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "weight": self.weight,
+            "tokens": {op_class: (None if bucket.rate <= 0 else round(bucket.tokens, 2))
+                       for op_class, bucket in self.buckets.items()},
+        }
+
+
+class ClientRegistry:
+    """
+    API Key 到调用方的映射。按密钥的 SHA-256 建立字典，查找为 O(1)，
+    且不会因逐字符比较泄露密钥内容。
+    """
+
+    def __init__(self, clients: List[Tuple[str, APIClient]]):
+        self._by_digest = {self._digest(key): client for key, client in clients if key}
+        self.clients = {client.name: client for _, client in clients}
+
+    @staticmethod
+    def _digest(key: str) -> bytes:
+        return hashlib.sha256(key.encode()).digest()
+
+    def lookup(self, api_key: str) -> Optional[APIClient]:
+        return self._by_digest.get(self._digest(api_key))
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: client.stats() for name, client in self.clients.items()}
+
+
+def load_clients(api_key: Optional[str], clients_json: str,
+                 default_limits: Dict[str, Tuple[float, float]]) -> ClientRegistry:
+    """
+    从配置加载调用方：API_KEY 作为名为 default 的调用方；API_CLIENTS 为 JSON 对象，例如
+    {"web": {"key": "...", "weight": 4}, "importer": {"key": "...", "weight": 1, "llm_rate": 0.5, "llm_burst": 5}}，
+    未指定的限速参数使用 CLIENT_* 默认值。
+    """
+    clients = []
+    if api_key:
+        clients.append((api_key, APIClient("default", 1, default_limits)))
+    for name, spec in (json.loads(clients_json) if clients_json.strip() else {}).items():
+        limits = {
+            op_class: (float(spec.get(f"{op_class}_rate", rate)), float(spec.get(f"{op_class}_burst", burst)))
+            for op_class, (rate, burst) in default_limits.items()
+        }
+        clients.append((spec["key"], APIClient(name, spec.get("weight", 1), limits)))
+    return ClientRegistry(clients)
+
+
+# 当前请求的调用方，由鉴权依赖设置；在请求内创建的任务和流式响应中同样可见
+current_client: ContextVar[Optional[APIClient]] = ContextVar("current_client", default=None)
+
+
+def charge(op_class: str, cost: float = 1) -> None:
+    """按当前调用方扣除令牌；没有调用方上下文（后台任务）时不限速。"""
+    client = current_client.get()
+    if client is not None:
+        client.charge(op_class, cost)
+
+
+def current_share() -> Tuple[str, int]:
+    """当前调用方在公平调度中的 (名字, 权重)。"""
+    client = current_client.get()
+    return (client.name, client.weight) if client is not None else (INTERNAL_CLIENT, 1)
+
+
+class FairScheduler:
+    """
+    按调用方加权轮询的并发许可，用来替代 asyncio.Semaphore。
+
+    有空闲许可且无人排队时直接进入；否则按调用方分别排队，释放许可时轮流唤醒各调用方，
+    每轮每个调用方最多连续获得 weight 个许可。某个调用方一次提交大量请求，
+    也只占用自己的份额，其他调用方的请求不会排在它的整批请求之后。
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.in_use = 0
+        self._queues: Dict[str, Deque[asyncio.Future]] = {}
+        self._credits: Dict[str, int] = {}
+        self._weights: Dict[str, int] = {}
+        # 有请求在排队的调用方，按轮询顺序排列
+        self._active: Deque[str] = deque()
+
+    @property
+    def full(self) -> bool:
+        return self.in_use >= self.capacity
+
+    def waiting(self) -> Dict[str, int]:
+        return {name: len(queue) for name, queue in self._queues.items()}
+
+    async def acquire(self, client: str = INTERNAL_CLIENT, weight: int = 1) -> None:
+        if self.in_use < self.capacity and not self._active:
+            self.in_use += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(client)
+        if queue is None:
+            queue = self._queues[client] = deque()
+            self._credits[client] = self._weights[client] = max(1, weight)
+            self._active.append(client)
+        queue.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已经拿到许可后才被取消，把许可交给下一个等待者
+                self.release()
+            else:
+                self._discard(client, future)
+            raise
+
+    def release(self) -> None:
+        self.in_use -= 1
+        self._wake()
+
+    def _discard(self, client: str, future: asyncio.Future) -> None:
+        queue = self._queues.get(client)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            return
+        if not queue:
+            self._drop(client)
+
+    def _drop(self, client: str) -> None:
+        del self._queues[client], self._credits[client], self._weights[client]
+        self._active.remove(client)
+
+    def _wake(self) -> None:
+        while self.in_use < self.capacity and self._active:
+            client = self._active[0]
+            queue = self._queues[client]
+            future = queue.popleft()
+            self._credits[client] -= 1
+            if not queue:
+                self._drop(client)
+            elif self._credits[client] <= 0:
+                self._credits[client] = self._weights[client]
+                self._active.rotate(-1)
+            if not future.done():
+                future.set_result(None)
+                self.in_use += 1
+
+
+# 创建一个全局的调用方注册表实例
+client_registry = load_clients(
+    settings.API_KEY,
+    settings.API_CLIENTS,
+    {
+        "llm": (settings.CLIENT_LLM_RATE, settings.CLIENT_LLM_BURST),
+        "render": (settings.CLIENT_RENDER_RATE, settings.CLIENT_RENDER_BURST),
+    },
+)
@@ -0,0 +1,171 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import orjson
+from fastapi import Request
+
+from app.core.config import settings, parse_key_values
+from app.services.resilience import DeadlineExceededError, remaining_time, request_deadline
+
+# 当前请求是否跳过缓存读取（由请求头决定，见 read_cache_bypass）
+cache_bypass: ContextVar[bool] = ContextVar("dify_cache_bypass", default=False)
+
+
+async def read_cache_bypass(request: Request) -> None:
+    """
+    路由依赖：请求头带有 `X-Cache-Bypass: 1` 或 `Cache-Control: no-cache` 时，
+    本次请求跳过 Dify 响应缓存（结果仍会写回缓存）。
+    必须是 async 函数，ContextVar 的修改才能传递到路由函数中。
+    """
+    bypass = request.headers.get("x-cache-bypass", "").lower() in ("1", "true", "yes")
+    bypass = bypass or "no-cache" in request.headers.get("cache-control", "").lower()
+    cache_bypass.set(bypass)
+
+
+class DifyResponseCache:
+    """
+    Dify 响应缓存（可选开启）。
+
+    - 键：(应用密钥名, query, inputs)，与 user 字段无关；
+    - 每个应用可单独配置 TTL，TTL 为 0 表示该应用不缓存；
+    - 总条目数和总字节数有上限，超过时按 LRU 淘汰；
+    - 相同请求在途时只向上游发送一次（single-flight），其余请求共享结果。
+      共享的上游调用不受任何一个请求的截止时间和取消影响，每个等待者按自己的截止时间等待；
+    只缓存成功的响应，异常会直接抛给所有等待者。
+    """
+
+    def __init__(self, ttls: Dict[str, float], default_ttl: float, max_entries: int,
+                 max_bytes: int, enabled: bool = False):
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+        self._bytes = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+        self.bypassed = 0
+
+    def ttl_for(self, key_name: str) -> float:
+        return self.ttls.get(key_name, self.default_ttl)
+
+    @staticmethod
+    def make_key(key_name: str, query: str, inputs: Optional[Dict[str, Any]]) -> str:
+        raw = json.dumps([key_name, query, inputs or {}], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "coalesced": self.coalesced,
+            "bypassed": self.bypassed,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, size, value = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _put(self, key: str, value: Dict[str, Any], ttl: float) -> None:
+        size = len(orjson.dumps(value))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, size, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    async def get_or_call(self, key_name: str, query: str, inputs: Optional[Dict[str, Any]],
+                          call: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """返回缓存中的 Dify 响应；未命中时调用 call() 并缓存其结果。"""
+        ttl = self.ttl_for(key_name)
+        if not self.enabled or ttl <= 0:
+            return await call()
+
+        key = self.make_key(key_name, query, inputs)
+        if cache_bypass.get():
+            self.bypassed += 1
+            value = await call()
+            self._put(key, value, ttl)
+            return value
+
+        value = self._get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            # 在去掉截止时间的上下文中发起：发起者的截止时间较短时，不会连带其他等待者一起失败
+            context = contextvars.copy_context()
+            context.run(request_deadline.set, None)
+            task = asyncio.get_running_loop().create_task(call(), context=context)
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish_inflight(key, ttl, t))
+        return await self._wait(task, key_name)
+
+    @staticmethod
+    async def _wait(task: asyncio.Future, key_name: str) -> Dict[str, Any]:
+        """按当前请求的截止时间等待共享的调用；等待者被取消或超时不会取消共享的调用。"""
+        remaining = remaining_time()
+        if remaining is None:
+            return await asyncio.shield(task)
+        scope = asyncio.timeout(max(0.0, remaining))
+        try:
+            async with scope:
+                return await asyncio.shield(task)
+        except TimeoutError:
+            if scope.expired():
+                raise DeadlineExceededError(key_name) from None
+            raise
+
+    def _finish_inflight(self, key: str, ttl: float, task: asyncio.Future) -> None:
+        self._inflight.pop(key, None)
+        if task.cancelled():
+            return
+        if task.exception() is None:
+            self._put(key, task.result(), ttl)
+
+
+# 创建一个全局的Dify响应缓存实例
+dify_cache = DifyResponseCache(
+    ttls=parse_key_values(settings.DIFY_CACHE_TTLS),
+    default_ttl=settings.DIFY_CACHE_DEFAULT_TTL,
+    max_entries=settings.DIFY_CACHE_MAX_ENTRIES,
+    max_bytes=settings.DIFY_CACHE_MAX_BYTES,
+    enabled=settings.DIFY_CACHE_ENABLED,
+)
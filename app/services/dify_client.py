@@ -92,111 +92,369 @@
 # # 创建一个全局的Dify客户端实例
 # dify_client = DifyClient(settings.DIFY_API_URL, settings.DIFY_API_KEYS)
 
-import requests
-import json
-from typing import Dict, Any
+import time
+import httpx
+import orjson
+from typing import Dict, Any, Optional, AsyncIterator
 from urllib.parse import urlparse, urlunparse
 from app.core.config import settings
+from app.core.tracing import tracer, TRACE_ID_HEADER
+from app.services.dify_cache import dify_cache
+from app.services.dify_sessions import dify_sessions, session_uid
+from app.services.resilience import dify_resilience, DifyUnavailableError, DeadlineExceededError, remaining_time
+from app.services.structured_output import extract_json_object, validate_profile
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class DifyCallError(RuntimeError):
+    """Dify 调用失败（上游返回错误或响应无效），应返回 502，不应作为正常结果返回给客户端。"""
+
+
+def parse_statement_answer(statement_text: str) -> Dict[str, Any]:
+    """将 Dify 返回的个人陈述文本解析为 dict，失败时抛出 StructuredOutputError。"""
+    return extract_json_object(statement_text)
 
 
 class DifyClient:
     """
     Dify API 客户端，封装了对Dify各项功能的调用。
+
+    所有请求复用同一个 httpx.AsyncClient 长连接池（每个 Dify 主机一个）；
+    每个应用密钥经过独立的隔离舱（并发/排队上限、熔断、自适应超时，见 resilience 模块），
+    避免单个应用变慢拖垮其他应用。
     """
 
-    def __init__(self, base_url: str, api_keys: Dict[str, str], timeout: int = 120):
+    # 文本变换操作 -> (应用密钥名, Dify user)
+    TEXT_OPERATIONS = {
+        'rewrite': ('rewrite', 'rewrite-user'),
+        'expand': ('expand', 'expand-user'),
+        'contract': ('contract', 'contract-user'),
+        'prompt': ('prompt_based', 'prompt-based-user'),
+    }
+
+    def __init__(
+        self,
+        base_url: str,
+        api_keys: Dict[str, str],
+        timeout: float = 120,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = True,
+    ):
         # 解析传入的URL，并只保留 scheme 和 netloc (例如 'http://localhost:8681')
         parsed_url = urlparse(base_url)
         self.base_url = urlunparse((parsed_url.scheme, parsed_url.netloc, '', '', '', ''))
 
         self.api_keys = api_keys
         self.timeout = timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self._client: Optional[httpx.AsyncClient] = None
 
-    def _post(self, path: str, key_name: str, payload: Dict[str, Any]) -> requests.Response:
-        """
-        一个通用的POST请求方法。
-        """
-        url = f"{self.base_url}{path}"
+    async def startup(self) -> None:
+        """打开共享连接池，在 FastAPI 启动时调用。"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=self.http2,
+            )
+
+    async def shutdown(self) -> None:
+        """关闭共享连接池，在 FastAPI 关闭时调用。"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            raise RuntimeError("DifyClient 连接池尚未打开，请先调用 startup()。")
+        return self._client
+
+    def _headers(self, key_name: str) -> Dict[str, str]:
         headers = {
             'Authorization': f"Bearer {self.api_keys[key_name]}",
             'Content-Type': 'application/json'
         }
-        return requests.post(url, headers=headers, json=payload, timeout=self.timeout)
+        # 向 Dify 传递追踪上下文，便于在其日志中按 trace_id 关联
+        traceparent = tracer.traceparent()
+        if traceparent:
+            headers['traceparent'] = traceparent
+            headers[TRACE_ID_HEADER] = traceparent[3:35]
+        return headers
 
-    def _clean_response(self, text: str) -> str:
-        """清理Dify返回的字符串，移除Markdown代码块标记。"""
-        if text.strip().startswith("```json"):
-            text = text.strip()[7:-3].strip()
-        return text
+    async def _post(self, path: str, key_name: str, payload: Dict[str, Any], hedge: bool = True) -> httpx.Response:
+        """
+        一个通用的POST请求方法，经过该应用的隔离舱，并使用其自适应超时；
+        按配置对冲和重试，且不超过当前请求的截止时间（见 DifyResilience.call）。
+        """
+        async def send(timeout: float) -> httpx.Response:
+            response = await self.client.post(path, headers=self._headers(key_name), json=payload, timeout=timeout)
+            # 在隔离舱内检查状态码，使 5xx 计入熔断器
+            response.raise_for_status()
+            return response
+
+        with tracer.span("dify.request", app=key_name, path=path) as span:
+            response = await dify_resilience.call(key_name, send, hedge=hedge)
+            span.set(status=response.status_code, response_bytes=len(response.content))
+            return response
+
+    async def _chat(self, key_name: str, query: str, user: str,
+                    inputs: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        以 blocking 模式调用 chat-messages，返回 Dify 的响应体；失败时抛出异常。
+        开启响应缓存时，相同的 (应用, query, inputs) 会直接返回缓存结果。
+        当前请求带有 user_uid 时（见 dify_sessions.use_session），Dify user 按用户区分，
+        开启会话的应用改为在该用户的会话中调用（不经过响应缓存）。
+        """
+        user_uid = session_uid.get()
+        if user_uid:
+            user = f"{user}-{user_uid}"
+            if dify_sessions.enabled_for(key_name):
+                return await self._chat_session(key_name, query, user, inputs, user_uid)
+        return await dify_cache.get_or_call(
+            key_name, query, inputs,
+            lambda: self._chat_uncached(key_name, query, user, inputs),
+        )
+
+    async def _chat_uncached(self, key_name: str, query: str, user: str,
+                             inputs: Optional[Dict[str, Any]] = None,
+                             conversation_id: Optional[str] = None) -> Dict[str, Any]:
+        payload = {"inputs": inputs or {}, "query": query, "response_mode": "blocking", "user": user}
+        if conversation_id:
+            payload["conversation_id"] = conversation_id
+        response = await self._post('/v1/chat-messages', key_name, payload, hedge=conversation_id is None)
+        return orjson.loads(response.content)
 
-    def parse_text(self, text: str) -> Dict[str, Any]:
-        """调用Dify解析文本，返回结构化JSON。"""
-        payload = {"inputs": {}, "query": text, "response_mode": "blocking", "user": "resume-parser-user"}
+    async def _chat_session(self, key_name: str, query: str, user: str,
+                            inputs: Optional[Dict[str, Any]], user_uid: str) -> Dict[str, Any]:
+        """
+        在 (user_uid, 应用) 的会话中调用：能续用会话时只发送相对上一轮原文的修改，否则发送全文并开启新会话。
+        会话已在 Dify 侧失效（404）时改为发送全文重新开始。
+        其他失败（包括超时和取消）时 Dify 可能已经处理了这一轮，会话的原文与 Dify 侧不再一致，
+        因此丢弃会话，下次发送全文。
+        """
+        session = dify_sessions.acquire(user_uid, key_name)
+        if session is None:
+            return await self._chat_uncached(key_name, query, user, inputs)
         try:
-            response = self._post('/v1/chat-messages', 'parse', payload)
-            response.raise_for_status()
-            answer = response.json().get('answer', '{}')
-            cleaned_answer = self._clean_response(answer)
-            return json.loads(cleaned_answer)
+            message, conversation_id = dify_sessions.plan(session, query, inputs)
+            with tracer.span("dify.session", app=key_name, followup=conversation_id is not None,
+                             sent_chars=len(message), text_chars=len(query)):
+                try:
+                    body = await self._chat_uncached(key_name, message, user, inputs, conversation_id)
+                except httpx.HTTPStatusError as e:
+                    if conversation_id is None or e.response.status_code != 404:
+                        raise
+                    body = await self._chat_uncached(key_name, query, user, inputs)
+            dify_sessions.commit(session, query, inputs, body.get("conversation_id"))
+            return body
+        except BaseException:
+            session.conversation_id = None
+            raise
+        finally:
+            dify_sessions.release(session)
+
+    async def _chat_stream(self, key_name: str, query: str, user: str,
+                           inputs: Optional[Dict[str, Any]] = None,
+                           conversation_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        以 streaming 模式调用 chat-messages，逐个产出 Dify 推送的 SSE 事件（已解析为 dict）。
+        调用方停止迭代时会立即关闭上游连接。流式调用不重试也不对冲，但同样受请求截止时间约束。
+        """
+        payload = {"inputs": inputs or {}, "query": query, "response_mode": "streaming", "user": user}
+        if conversation_id:
+            payload["conversation_id"] = conversation_id
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceededError(key_name)
+        # 生成器在多次 yield 之间会切换上下文，不能持有当前 Span，结束后补记
+        started_ns = time.time_ns()
+        attributes: Dict[str, Any] = {"app": key_name}
+        try:
+            async with dify_resilience.guard(key_name) as timeout:
+                attributes["queue_ms"] = round((time.time_ns() - started_ns) / 1e6, 3)
+                remaining = remaining_time()
+                if remaining is not None:
+                    if remaining <= 0:
+                        raise DeadlineExceededError(key_name)
+                    # 两次事件之间的等待不超过剩余时间
+                    timeout = min(timeout, remaining)
+                try:
+                    async with self.client.stream(
+                        "POST", '/v1/chat-messages', headers=self._headers(key_name), json=payload, timeout=timeout
+                    ) as response:
+                        attributes["status"] = response.status_code
+                        response.raise_for_status()
+                        events = 0
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[5:].strip()
+                            if data:
+                                if remaining is not None and remaining_time() <= 0:
+                                    raise DeadlineExceededError(key_name)
+                                if not events:
+                                    attributes["first_event_ms"] = round((time.time_ns() - started_ns) / 1e6, 3)
+                                events += 1
+                                attributes["events"] = events
+                                yield orjson.loads(data)
+                except httpx.TimeoutException:
+                    # 因截止时间缩短了超时而超时，不算 Dify 的故障
+                    if remaining is not None and remaining_time() <= 0:
+                        raise DeadlineExceededError(key_name) from None
+                    raise
+        finally:
+            tracer.record("dify.stream", started_ns, time.time_ns(), **attributes)
+
+    async def stream_answer(self, key_name: str, text: str, user: str,
+                            inputs: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """
+        流式调用 Dify，逐段产出 answer 文本增量。
+        Dify 返回 error 事件时抛出 RuntimeError。与 _chat 相同，带有 user_uid 时按用户区分 Dify user 并按需使用会话。
+        """
+        user_uid = session_uid.get()
+        session = None
+        if user_uid:
+            user = f"{user}-{user_uid}"
+            if dify_sessions.enabled_for(key_name):
+                session = dify_sessions.acquire(user_uid, key_name)
+        query, conversation_id = dify_sessions.plan(session, text, inputs) if session else (text, None)
+        try:
+            async for event in self._chat_stream(key_name, query, user, inputs, conversation_id):
+                kind = event.get("event")
+                if kind in ("message", "agent_message"):
+                    conversation_id = event.get("conversation_id") or conversation_id
+                    delta = event.get("answer")
+                    if delta:
+                        yield delta
+                elif kind == "error":
+                    raise RuntimeError(event.get("message", "Dify流式接口返回错误"))
+                elif kind == "message_end":
+                    if session is not None:
+                        dify_sessions.commit(session, text, inputs, event.get("conversation_id") or conversation_id)
+                    break
+        except Exception:
+            if session is not None:
+                # 会话可能已在 Dify 侧失效，下次发送全文重新开始
+                session.conversation_id = None
+            raise
+        finally:
+            if session is not None:
+                dify_sessions.release(session)
+
+    async def parse_text(self, text: str) -> Dict[str, Any]:
+        """
+        调用Dify解析文本，返回结构化JSON。
+        回答经 structured_output 提取和修复后按 NewResumeProfile 校验，缺失的必填字段补为空值。
+        """
+        try:
+            body = await self._chat('parse', text, "resume-parser-user")
+            answer = body.get('answer', '{}')
+            profile, _ = validate_profile(extract_json_object(answer))
+            return profile
+        except DifyUnavailableError:
+            raise
         except Exception as e:
             return {"error": f"调用Dify解析接口失败: {e}"}
 
-    def _call_text_modification_api(self, key_name: str, text: str, user: str) -> str:
-        """调用文本修改类API（改写、扩写、缩写）的通用方法。"""
-        payload = {"inputs": {}, "query": text, "response_mode": "blocking", "user": user}
+    async def _call_text_modification_api(self, key_name: str, text: str, user: str) -> str:
+        """调用文本修改类API（改写、扩写、缩写）的通用方法，失败时抛出 DifyCallError。"""
         try:
-            response = self._post('/v1/chat-messages', key_name, payload)
-            response.raise_for_status()
-            return response.json().get('answer', 'Dify未能返回有效结果。')
+            body = await self._chat(key_name, text, user)
+            return body.get('answer', 'Dify未能返回有效结果。')
+        except DifyUnavailableError:
+            raise
         except Exception as e:
-            return f"调用Dify {key_name} 接口失败: {e}"
+            raise DifyCallError(f"调用Dify {key_name} 接口失败: {e}") from e
 
-    def rewrite_text(self, text: str) -> str:
-        return self._call_text_modification_api('rewrite', text, 'rewrite-user')
+    async def transform_text(self, operation: str, text: str, prompt: Optional[str] = None) -> str:
+        """
+        按操作名执行一次文本变换（见 TEXT_OPERATIONS）。
+        失败时直接抛出底层异常，便于批量调用方区分结果。
+        """
+        key_name, user = self.TEXT_OPERATIONS[operation]
+        inputs = {"prompt": prompt} if operation == 'prompt' else None
+        body = await self._chat(key_name, text, user, inputs)
+        return body.get('answer', 'Dify未能返回有效结果。')
+
+    async def rewrite_text(self, text: str) -> str:
+        return await self._call_text_modification_api('rewrite', text, 'rewrite-user')
+
+    async def expand_text(self, text: str) -> str:
+        return await self._call_text_modification_api('expand', text, 'expand-user')
+
+    async def contract_text(self, text: str) -> str:
+        return await self._call_text_modification_api('contract', text, 'contract-user')
+
+    async def process_json_as_text(self, text: str) -> str:
+        return await self._call_text_modification_api('process_text', text, 'process-text-user')
 
-    def expand_text(self, text: str) -> str:
-        return self._call_text_modification_api('expand', text, 'expand-user')
+    async def generate_statement(self, text: str) -> str:
+        return await self._call_text_modification_api('personal_statement', text, 'statement-user')
 
-    def contract_text(self, text: str) -> str:
-        return self._call_text_modification_api('contract', text, 'contract-user')
+    def stream_rewrite_text(self, text: str) -> AsyncIterator[str]:
+        return self.stream_answer('rewrite', text, 'rewrite-user')
 
-    def process_json_as_text(self, text: str) -> str:
-        return self._call_text_modification_api('process_text', text, 'process-text-user')
+    def stream_expand_text(self, text: str) -> AsyncIterator[str]:
+        return self.stream_answer('expand', text, 'expand-user')
 
-    def generate_statement(self, text: str) -> str:
-        return self._call_text_modification_api('personal_statement', text, 'statement-user')
+    def stream_contract_text(self, text: str) -> AsyncIterator[str]:
+        return self.stream_answer('contract', text, 'contract-user')
 
-    def generate_recommendation(self, text: str) -> Dict[str, Any]:
+    def stream_statement(self, text: str) -> AsyncIterator[str]:
+        return self.stream_answer('personal_statement', text, 'statement-user')
+
+    async def generate_recommendation(self, text: str) -> Dict[str, Any]:
         """调用Dify生成推荐信，期望返回一个包含Markdown的JSON结构。"""
-        payload = {"inputs": {}, "query": text, "response_mode": "blocking", "user": "recommendation-user"}
         try:
-            response = self._post('/v1/chat-messages', 'recommendation', payload)
-            response.raise_for_status()
+            body = await self._chat('recommendation', text, "recommendation-user")
             # 假设Dify的'answer'字段本身就是一个JSON字符串
-            answer = response.json().get('answer', '{}')
-            return json.loads(self._clean_response(answer))
+            answer = body.get('answer', '{}')
+            return extract_json_object(answer)
+        except DifyUnavailableError:
+            raise
         except Exception as e:
             return {"error": f"调用Dify推荐信接口失败: {e}"}
 
-    def generate_with_prompt(self, text: str, prompt: str) -> str:
+    async def generate_with_prompt(self, text: str, prompt: str) -> str:
         """
         调用Dify，将前端传入的 'prompt' 放入 Dify 的 'inputs.prompt'，
         将前端传入的 'text' 放入 Dify 的 'query'。
         """
-        payload = {
-            "inputs": {"prompt": prompt},  # 'prompt' 字段进入 inputs
-            "query": text,                 # 'text' 字段进入 query (sys.query)
-            "response_mode": "blocking",
-            "user": "prompt-based-user"
-        }
         try:
+            # 'prompt' 字段进入 inputs，'text' 字段进入 query (sys.query)
             # 假设此功能也使用 'prompt_based' 的密钥
-            response = self._post('/v1/chat-messages', 'prompt_based', payload)
-            response.raise_for_status()
-            return response.json().get('answer', 'Dify未能返回有效结果。')
+            body = await self._chat('prompt_based', text, "prompt-based-user", inputs={"prompt": prompt})
+            return body.get('answer', 'Dify未能返回有效结果。')
+        except DifyUnavailableError:
+            raise
         except Exception as e:
-            return f"调用Dify prompt-based接口失败: {e}"
+            raise DifyCallError(f"调用Dify prompt-based接口失败: {e}") from e
+
+    def stream_with_prompt(self, text: str, prompt: str) -> AsyncIterator[str]:
+        return self.stream_answer('prompt_based', text, "prompt-based-user", inputs={"prompt": prompt})
 
 
 # 创建一个全局的Dify客户端实例
-dify_client = DifyClient(settings.DIFY_API_URL, settings.DIFY_API_KEYS)
\ No newline at end of file
+dify_client = DifyClient(
+    settings.DIFY_API_URL,
+    settings.DIFY_API_KEYS,
+    timeout=settings.DIFY_TIMEOUT,
+    max_connections=settings.DIFY_POOL_MAX_CONNECTIONS,
+    max_keepalive_connections=settings.DIFY_POOL_MAX_KEEPALIVE,
+    keepalive_expiry=settings.DIFY_POOL_KEEPALIVE_EXPIRY,
+    http2=settings.DIFY_HTTP2,
+)
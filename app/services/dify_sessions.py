@@ -0,0 +1,161 @@
+import difflib
+import re
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+# 当前请求的 user_uid，由路由根据请求体设置；为 None 时不使用会话，Dify user 保持原来的固定值
+session_uid: ContextVar[Optional[str]] = ContextVar("dify_session_uid", default=None)
+
+# 追问时放在差异前面的说明，让 Dify 应用在上一轮结果的基础上生成
+DELTA_HEADER = "原文在上一轮的基础上有以下修改，请按修改后的原文重新生成完整结果：\n"
+_SENTENCE_END = re.compile(r"(?<=[。！？；.!?;])\s*")
+
+
+def use_session(user_uid: Optional[str]) -> None:
+    """在路由中调用：之后本请求内的 Dify 调用按该 user_uid 区分 Dify user，并按需使用会话。"""
+    session_uid.set(user_uid or None)
+
+
+def _units(text: str) -> List[str]:
+    """差异比较的单位：多行文本按行，单段文本按句。"""
+    lines = text.splitlines()
+    if len(lines) > 1:
+        return lines
+    return [unit for unit in _SENTENCE_END.split(text) if unit]
+
+
+def build_delta(previous: str, current: str, max_ratio: float) -> Optional[str]:
+    """
+    把 current 相对 previous 的修改整理成简短的追问文本。
+    没有修改，或差异文本超过 current 长度的 max_ratio 倍（不如直接重发全文）时返回 None。
+    """
+    old, new = _units(previous), _units(current)
+    changes = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(a=old, b=new, autojunk=False).get_opcodes():
+        if tag == "replace":
+            changes.append(f"- 原文：{' '.join(old[i1:i2])}\n+ 改为：{' '.join(new[j1:j2])}")
+        elif tag == "delete":
+            changes.append(f"- 删除：{' '.join(old[i1:i2])}")
+        elif tag == "insert":
+            after = f"（位于「{old[i1 - 1]}」之后）" if i1 > 0 else "（位于开头）"
+            changes.append(f"+ 新增{after}：{' '.join(new[j1:j2])}")
+    if not changes:
+        return None
+    delta = DELTA_HEADER + "\n".join(changes)
+    return delta if len(delta) <= len(current) * max_ratio else None
+
+
+class DifySession:
+    """一个 (user_uid, 应用) 的会话：Dify conversation_id 和上一轮发送的完整原文。"""
+    __slots__ = ("conversation_id", "text", "inputs", "expires", "busy")
+
+    def __init__(self):
+        self.conversation_id: Optional[str] = None
+        self.text = ""
+        self.inputs: Optional[Dict[str, Any]] = None
+        self.expires = 0.0
+        self.busy = False
+
+
+class DifySessionStore:
+    """
+    按 (user_uid, 应用密钥名) 保存 Dify 会话，条数有上限（LRU 淘汰），空闲超过 ttl 秒后失效。
+
+    - 首次调用发送全文并开启新会话；之后的调用只发送相对上一轮原文的修改（见 build_delta），
+      Dify 在同一会话中已有上一轮的原文和结果；
+    - 修改过多、inputs（如 prompt）变化或会话失效时，发送全文并开启新会话；
+    - 同一会话同时只进行一次调用，并发的调用不使用会话（按原来的方式单独调用）。
+    """
+
+    def __init__(self, max_entries: int, ttl: float, apps, max_delta_ratio: float = 0.5, enabled: bool = True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.apps = frozenset(apps)
+        self.max_delta_ratio = max_delta_ratio
+        self.enabled = enabled
+        self._sessions: "OrderedDict[Tuple[str, str], DifySession]" = OrderedDict()
+        self.followups = 0
+        self.started = 0
+        self.busy = 0
+        self.evictions = 0
+
+    def enabled_for(self, key_name: str) -> bool:
+        return self.enabled and key_name in self.apps
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._sessions),
+            "followups": self.followups,
+            "started": self.started,
+            "busy": self.busy,
+            "evictions": self.evictions,
+        }
+
+    def acquire(self, user_uid: str, key_name: str) -> Optional[DifySession]:
+        """取出（或新建）会话并标记为使用中；会话正被另一个调用使用时返回 None。"""
+        now = time.monotonic()
+        self._expire(now)
+        key = (user_uid, key_name)
+        session = self._sessions.get(key)
+        if session is not None and session.busy:
+            self.busy += 1
+            return None
+        if session is None or session.expires <= now:
+            session = self._sessions[key] = DifySession()
+        self._sessions.move_to_end(key)
+        session.busy = True
+        self._evict()
+        return session
+
+    def release(self, session: DifySession) -> None:
+        session.busy = False
+        session.expires = time.monotonic() + self.ttl
+
+    def plan(self, session: DifySession, text: str, inputs: Optional[Dict[str, Any]]) -> Tuple[str, Optional[str]]:
+        """返回本次应发送的 (query, conversation_id)：能续用会话时为修改内容，否则为全文和 None。"""
+        if session.conversation_id and session.inputs == inputs:
+            delta = build_delta(session.text, text, self.max_delta_ratio)
+            if delta is not None:
+                self.followups += 1
+                return delta, session.conversation_id
+        self.started += 1
+        return text, None
+
+    @staticmethod
+    def commit(session: DifySession, text: str, inputs: Optional[Dict[str, Any]],
+               conversation_id: Optional[str]) -> None:
+        """调用成功后记录本轮的完整原文和会话 ID。"""
+        session.conversation_id = conversation_id or None
+        session.text = text
+        session.inputs = inputs
+
+    def _expire(self, now: float) -> None:
+        # 会话按最近使用时间排列，从头检查即可
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if session.busy or session.expires > now:
+                break
+            del self._sessions[key]
+
+    def _evict(self) -> None:
+        # 从最久未使用的一端淘汰，跳过正在使用的会话
+        for key in list(self._sessions):
+            if len(self._sessions) <= self.max_entries:
+                break
+            if not self._sessions[key].busy:
+                del self._sessions[key]
+                self.evictions += 1
+
+
+# 创建一个全局的 Dify 会话实例
+dify_sessions = DifySessionStore(
+    max_entries=settings.DIFY_SESSION_MAX_ENTRIES,
+    ttl=settings.DIFY_SESSION_TTL,
+    apps=[name.strip() for name in settings.DIFY_SESSION_APPS.split(",") if name.strip()],
+    max_delta_ratio=settings.DIFY_SESSION_MAX_DELTA_RATIO,
+    enabled=settings.DIFY_SESSIONS_ENABLED,
+)
@@ -0,0 +1,323 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from fastapi.responses import ORJSONResponse
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.metrics import IDEMPOTENCY_REQUESTS
+
+# 只有可能产生副作用（或触发耗时生成）的方法才处理 Idempotency-Key
+IDEMPOTENT_METHODS = frozenset({"POST", "PUT", "PATCH", "DELETE"})
+MAX_KEY_LENGTH = 255
+# 这些状态码表示请求未被真正执行（冲突、限流、超时），不保存，重试时重新执行
+UNSTORED_STATUSES = frozenset({408, 409, 425, 429})
+REPLAYED_HEADER = (b"idempotent-replayed", b"true")
+
+
+class StoredResponse(NamedTuple):
+    status: int
+    headers: List[Tuple[bytes, bytes]]
+    body: bytes
+
+
+class _Entry:
+    """
+    一个 Idempotency-Key 对应的记录：执行中时 response 为 None，完成后保存响应。
+    failed 表示响应虽然正常结束，但内容中带有失败结果，不保存。
+    """
+    __slots__ = ("fingerprint", "done", "response", "expires", "failed")
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.done = asyncio.Event()
+        self.response: Optional[StoredResponse] = None
+        self.expires = 0.0
+        self.failed = False
+
+
+# 当前请求对应的执行中记录，由中间件设置；在请求内创建的任务和流式响应中同样可见
+_current_entry: ContextVar[Optional[_Entry]] = ContextVar("idempotency_entry", default=None)
+
+
+def mark_response_failed() -> None:
+    """
+    标记当前响应带有失败结果（SSE 的 error 事件、NDJSON 或 ZIP 清单中的失败项），
+    状态码为 200 也不保存，相同 Idempotency-Key 的重试会重新执行。未携带该请求头时无效果。
+    """
+    entry = _current_entry.get()
+    if entry is not None:
+        entry.failed = True
+
+
+class IdempotencyStore:
+    """
+    进程内的 Idempotency-Key 记录。
+
+    - 键：API Key + 方法 + 路径 + Idempotency-Key 的摘要，不同调用方的键互不影响；
+    - 每条记录保存请求指纹（查询参数 + 请求体的 SHA-256），相同键但请求体不同的请求被拒绝；
+    - 执行中的记录供重试请求等待，完成后保存状态码、响应头和响应体，保留 ttl 秒；
+    - 已完成的响应按总字节数淘汰最早完成的记录；执行失败或响应过大时删除记录，重试会重新执行。
+    """
+
+    def __init__(self, ttl: float, max_bytes: int, max_response_bytes: int,
+                 max_request_bytes: int = 0, enabled: bool = True):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_response_bytes = max_response_bytes
+        self.max_request_bytes = max_request_bytes
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self.executed = 0
+        self.replayed = 0
+        self.attached = 0
+        self.mismatched = 0
+        self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "executed": self.executed,
+            "replayed": self.replayed,
+            "attached": self.attached,
+            "mismatched": self.mismatched,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
+
+    @staticmethod
+    def _size(response: StoredResponse) -> int:
+        return len(response.body) + sum(len(k) + len(v) for k, v in response.headers)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        if entry.response is not None:
+            self._bytes -= self._size(entry.response)
+
+    def _expire(self, now: float) -> None:
+        # 已完成的记录按完成时间排在前面，TTL 相同，因此从头检查即可
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.response is None or entry.expires > now:
+                break
+            self._remove(key)
+
+    def lookup(self, key: str) -> Optional[_Entry]:
+        self._expire(time.monotonic())
+        return self._entries.get(key)
+
+    def begin(self, key: str, fingerprint: str) -> _Entry:
+        entry = self._entries[key] = _Entry(fingerprint)
+        # 执行中的记录排到末尾，不参与淘汰
+        self._entries.move_to_end(key)
+        return entry
+
+    def complete(self, key: str, entry: _Entry, response: Optional[StoredResponse]) -> None:
+        """执行结束：保存响应并唤醒等待者；response 为 None 表示不可重放，删除记录。"""
+        if self._entries.get(key) is entry:
+            if response is None or self._size(response) > self.max_response_bytes:
+                del self._entries[key]
+            else:
+                entry.response = response
+                entry.expires = time.monotonic() + self.ttl
+                self._entries.move_to_end(key)
+                self._bytes += self._size(response)
+                self._evict()
+        entry.done.set()
+
+    def _evict(self) -> None:
+        for key in list(self._entries):
+            if self._bytes <= self.max_bytes:
+                break
+            if self._entries[key].response is not None:
+                self._remove(key)
+                self.evictions += 1
+
+
+def _fingerprint(scope: Scope, headers: Headers, body: bytes) -> str:
+    """
+    请求指纹。multipart 请求的分隔符每次随机生成，计算前从请求体中去掉，
+    否则客户端重新编码后的同一份上传会被误判为不同的请求体。
+    """
+    content_type = headers.get("content-type", "")
+    boundary = ""
+    if content_type.startswith("multipart/"):
+        for part in content_type.split(";"):
+            name, _, value = part.strip().partition("=")
+            if name.lower() == "boundary":
+                boundary = value.strip('"')
+        if boundary:
+            body = body.replace(boundary.encode("latin-1"), b"")
+        content_type = content_type.split(";")[0]
+    digest = hashlib.sha256()
+    for part in (scope.get("query_string", b""), content_type.encode("latin-1"), body):
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class IdempotencyMiddleware:
+    """
+    为所有修改类请求提供 Idempotency-Key 支持。
+
+    - 请求携带 Idempotency-Key 时，相同键和请求体的重试请求会等待执行中的原请求，
+      或直接重放已保存的响应（状态码、响应头、响应体），并附带 Idempotent-Replayed: true；
+    - 相同键但请求体不同时返回 422；
+    - 未携带该请求头的请求不受影响。
+
+    流式响应（SSE、NDJSON、ZIP）同样会被完整保存，重放时一次性返回；超过大小上限的响应、
+    5xx 和 UNSTORED_STATUSES 中的响应，以及路由通过 mark_response_failed() 标记为失败的响应不保存。
+    纯 ASGI 实现，不缓冲未携带该请求头的请求。
+    """
+
+    def __init__(self, app: ASGIApp, store: Optional[IdempotencyStore] = None):
+        self.app = app
+        self.store = store or idempotency_store
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] not in IDEMPOTENT_METHODS or not self.store.enabled:
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        idempotency_key = headers.get("idempotency-key")
+        if idempotency_key is None:
+            await self.app(scope, receive, send)
+            return
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            response = ORJSONResponse(status_code=400,
+                                      content={"detail": f"Idempotency-Key 长度必须在 1 到 {MAX_KEY_LENGTH} 之间。"})
+            await response(scope, receive, send)
+            return
+
+        limit = self.store.max_request_bytes
+        declared = headers.get("content-length", "")
+        if limit and declared.isdigit() and int(declared) > limit:
+            await self._reject_too_large(scope, receive, send, limit)
+            return
+        body, disconnected = await self._read_body(receive, limit)
+        if disconnected:
+            return
+        if body is None:
+            await self._reject_too_large(scope, receive, send, limit)
+            return
+        fingerprint = _fingerprint(scope, headers, body)
+        key = hashlib.sha256("\n".join((
+            headers.get("x-api-key", ""), scope["method"], scope["path"], idempotency_key,
+        )).encode()).hexdigest()
+
+        attached = False
+        while True:
+            entry = self.store.lookup(key)
+            if entry is None:
+                break
+            if entry.fingerprint != fingerprint:
+                self.store.mismatched += 1
+                IDEMPOTENCY_REQUESTS.labels("mismatch").inc()
+                response = ORJSONResponse(status_code=422,
+                                          content={"detail": "该 Idempotency-Key 已用于另一个不同的请求。"})
+                await response(scope, receive, send)
+                return
+            if entry.response is None:
+                # 原请求仍在执行：等待其完成后重放；原请求失败时记录已删除，由本请求重新执行
+                attached = True
+                await entry.done.wait()
+                continue
+            if attached:
+                self.store.attached += 1
+                IDEMPOTENCY_REQUESTS.labels("attached").inc()
+            else:
+                self.store.replayed += 1
+                IDEMPOTENCY_REQUESTS.labels("replayed").inc()
+            await self._replay(entry.response, send)
+            return
+
+        entry = self.store.begin(key, fingerprint)
+        self.store.executed += 1
+        IDEMPOTENCY_REQUESTS.labels("executed").inc()
+        await self._execute(scope, receive, send, body, key, entry)
+
+    async def _read_body(self, receive: Receive, limit: int = 0) -> Tuple[Optional[bytes], bool]:
+        """读入完整请求体；超过 limit 字节时停止读取并返回 (None, False)，limit 为 0 表示不限。"""
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return b"", True
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if limit and size > limit:
+                return None, False
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                return b"".join(chunks), False
+
+    @staticmethod
+    async def _reject_too_large(scope: Scope, receive: Receive, send: Send, limit: int) -> None:
+        response = ORJSONResponse(status_code=413,
+                                  content={"detail": f"带 Idempotency-Key 的请求体不能超过 {limit} 字节。"})
+        await response(scope, receive, send)
+
+    async def _execute(self, scope: Scope, receive: Receive, send: Send,
+                       body: bytes, key: str, entry: _Entry) -> None:
+        body_sent = False
+
+        async def replay_receive() -> Message:
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        status = 500
+        response_headers: List[Tuple[bytes, bytes]] = []
+        chunks: List[bytes] = []
+        size = 0
+        complete = False
+
+        async def capture_send(message: Message) -> None:
+            nonlocal status, response_headers, size, complete
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_headers = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                # 超过上限后不再保留内容，只继续转发
+                if size <= self.store.max_response_bytes:
+                    chunks.append(chunk)
+                if not message.get("more_body", False):
+                    complete = True
+            await send(message)
+
+        stored = None
+        token = _current_entry.set(entry)
+        try:
+            await self.app(scope, replay_receive, capture_send)
+            if (complete and not entry.failed and status < 500 and status not in UNSTORED_STATUSES
+                    and size <= self.store.max_response_bytes):
+                stored = StoredResponse(status, response_headers, b"".join(chunks))
+        finally:
+            _current_entry.reset(token)
+            self.store.complete(key, entry, stored)
+
+    async def _replay(self, response: StoredResponse, send: Send) -> None:
+        await send({"type": "http.response.start", "status": response.status,
+                    "headers": response.headers + [REPLAYED_HEADER]})
+        await send({"type": "http.response.body", "body": response.body, "more_body": False})
+
+
+# 创建一个全局的 Idempotency-Key 记录实例
+idempotency_store = IdempotencyStore(
+    ttl=settings.IDEMPOTENCY_TTL,
+    max_bytes=settings.IDEMPOTENCY_MAX_BYTES,
+    max_response_bytes=settings.IDEMPOTENCY_MAX_RESPONSE_BYTES,
+    max_request_bytes=settings.IDEMPOTENCY_MAX_REQUEST_BYTES,
+    enabled=settings.IDEMPOTENCY_ENABLED,
+)
@@ -0,0 +1,407 @@
+import asyncio
+import ipaddress
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Optional, Tuple, Type
+from urllib.parse import urlsplit
+
+import httpx
+import orjson
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+
+from app.core.config import settings
+from app.models.schemas import TextInput, PromptTextInput, NewResumeProfile
+from app.services.dify_client import dify_client, parse_statement_answer
+from app.services.pdf_cache import pdf_cache
+from app.services.render_engine import render_engine
+
+logger = logging.getLogger(__name__)
+
+# 任务结果：JSON 可序列化对象，或 (二进制内容, MIME 类型)
+JobResult = Any
+JobHandler = Callable[[BaseModel], Awaitable[JobResult]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           TEXT PRIMARY KEY,
+    operation    TEXT NOT NULL,
+    payload      TEXT NOT NULL,
+    status       TEXT NOT NULL,
+    result       BLOB,
+    media_type   TEXT,
+    error        TEXT,
+    callback_url TEXT,
+    client       TEXT,
+    owner        TEXT,
+    lease_expires REAL,
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    created_at   REAL NOT NULL,
+    started_at   REAL,
+    finished_at  REAL,
+    expires_at   REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_expires ON jobs (expires_at);
+"""
+# 旧版本创建的数据库缺少的列
+_ADDED_COLUMNS = (("client", "TEXT"), ("owner", "TEXT"), ("lease_expires", "REAL"))
+
+
+class JobNotFoundError(KeyError):
+    """任务不存在、已过期或不属于当前调用方。"""
+
+
+class CallbackURLError(ValueError):
+    """callback_url 不是 http(s) 地址，或主机不在允许范围内。"""
+
+
+def _is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address)
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def _host_allowed(host: str, allowed_hosts: FrozenSet[str]) -> bool:
+    return any(host == pattern or (pattern.startswith("*.") and host.endswith(pattern[1:]))
+               for pattern in allowed_hosts)
+
+
+def check_callback_url(url: str, allowed_hosts: FrozenSet[str]) -> None:
+    """
+    提交任务时校验 callback_url：只允许 http(s)；配置了允许的主机时必须在其中，
+    否则主机为 IP 字面量时必须是公网地址（域名在回调前解析后再检查，见 JobQueue._notify）。
+    """
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme not in ("http", "https") or not host:
+        raise CallbackURLError("callback_url 必须是 http 或 https 地址。")
+    if allowed_hosts:
+        if not _host_allowed(host, allowed_hosts):
+            raise CallbackURLError(f"callback_url 的主机 {host} 不在允许的范围内。")
+        return
+    try:
+        public = _is_public(host)
+    except ValueError:
+        return
+    if not public:
+        raise CallbackURLError("callback_url 不能指向内网、回环或保留地址。")
+
+
+# --- 可作为任务提交的操作 ---
+
+async def _parse_job(data: TextInput) -> JobResult:
+    result = await dify_client.parse_text(data.text)
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return result
+
+
+def _text_job(operation: str, result_key: str) -> JobHandler:
+    async def handler(data: TextInput) -> JobResult:
+        return {result_key: await dify_client.transform_text(operation, data.text)}
+    return handler
+
+
+async def _prompt_job(data: PromptTextInput) -> JobResult:
+    return {"text": await dify_client.transform_text('prompt', data.text, data.prompt)}
+
+
+async def _statement_job(data: TextInput) -> JobResult:
+    return parse_statement_answer(await dify_client.generate_statement(data.text))
+
+
+async def _recommendation_job(data: TextInput) -> JobResult:
+    result = await dify_client.generate_recommendation(data.text)
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return result
+
+
+async def _render_job(profile: NewResumeProfile) -> JobResult:
+    cache_key = pdf_cache.key_for(profile)
+    pdf_bytes = await pdf_cache.get_or_render(cache_key, lambda: render_engine.render(profile))
+    return pdf_bytes, 'application/pdf'
+
+
+# 操作名 -> (请求体模型, 处理函数)
+JOB_OPERATIONS: Dict[str, Tuple[Type[BaseModel], JobHandler]] = {
+    'parse': (TextInput, _parse_job),
+    'rewrite': (TextInput, _text_job('rewrite', 'rewritten_text')),
+    'expand': (TextInput, _text_job('expand', 'expanded_text')),
+    'contract': (TextInput, _text_job('contract', 'contracted_text')),
+    'prompt': (PromptTextInput, _prompt_job),
+    'statement': (TextInput, _statement_job),
+    'recommendation': (TextInput, _recommendation_job),
+    'render': (NewResumeProfile, _render_job),
+}
+
+
+class JobQueue:
+    """
+    基于本地 SQLite 的持久化异步任务队列。
+
+    - 任务提交后立即返回任务 ID，由后台 worker 以可配置的并发执行；
+    - 任务和结果保存在 SQLite 中，多个进程可以共用同一个数据库文件；
+    - 执行中的任务带有执行进程的租约（lease_ttl 秒，执行期间定期续期），
+      进程退出或崩溃后租约过期，任务由任一进程重新排队；
+    - 结果保留 result_ttl 秒后清理；
+    - 提交时可指定 callback_url，任务结束后以 POST 回调通知；回调地址受 callback_allowed_hosts 限制，
+      未配置时只允许公网地址；
+    - 任务记录提交它的调用方，查询时只能看到自己的任务。
+    SQLite 调用都在线程池中执行，并由同一把锁串行化。
+    """
+
+    def __init__(self, db_path: str, workers: int = 4, result_ttl: float = 86400,
+                 max_attempts: int = 3, poll_interval: float = 5.0, callback_allowed_hosts=(),
+                 lease_ttl: float = 60.0):
+        self.db_path = db_path
+        # 本进程领取任务时写入的租约持有者
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_ttl = lease_ttl
+        self.callback_allowed_hosts = frozenset(host.lower() for host in callback_allowed_hosts)
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: list = []
+        self._http: Optional[httpx.AsyncClient] = None
+
+    # --- 生命周期 ---
+
+    def _open(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for name, column_type in _ADDED_COLUMNS:
+            if name not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {column_type}")
+        self._conn = conn
+        self._requeue_expired()
+
+    async def startup(self) -> None:
+        """打开数据库并启动后台 worker，在 FastAPI 启动时调用。"""
+        await run_in_threadpool(self._open)
+        self._wakeup = asyncio.Event()
+        self._http = httpx.AsyncClient(timeout=10)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._janitor()))
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def shutdown(self) -> None:
+        """停止后台 worker 并关闭数据库；本进程执行中的任务立即重新排队，由其他进程或下次启动继续执行。"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self._conn is not None:
+            await run_in_threadpool(
+                self._execute,
+                "UPDATE jobs SET status = 'queued', owner = NULL, lease_expires = NULL "
+                "WHERE status = 'running' AND owner = ?", (self.owner,))
+            self._conn.close()
+            self._conn = None
+
+    # --- 数据库操作（线程池中执行） ---
+
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """
+        领取最早排队的任务。选取和标记在同一条 UPDATE 中完成，
+        多个进程共用同一个数据库文件时同一任务也只会被领取一次。
+        """
+        now = time.time()
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, lease_expires = ?, started_at = ?, "
+                "attempts = attempts + 1 "
+                "WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1) "
+                "AND status = 'queued' RETURNING *",
+                (self.owner, now + self.lease_ttl, now)).fetchone()
+
+    def _requeue_expired(self) -> int:
+        """
+        租约已过期（执行进程已退出或崩溃）的任务重新排队，超过重试次数的标记为失败；
+        其他进程仍在执行的任务不受影响。返回重新排队的任务数。
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', error = '任务多次中断，已放弃', owner = NULL, "
+                "lease_expires = NULL, finished_at = ?, expires_at = ? "
+                "WHERE status = 'running' AND (lease_expires IS NULL OR lease_expires <= ?) AND attempts >= ?",
+                (now, now + self.result_ttl, now, self.max_attempts))
+            return len(self._conn.execute(
+                "UPDATE jobs SET status = 'queued', owner = NULL, lease_expires = NULL "
+                "WHERE status = 'running' AND (lease_expires IS NULL OR lease_expires <= ?) RETURNING id",
+                (now,)).fetchall())
+
+    # --- 对外接口 ---
+
+    @staticmethod
+    def validate(operation: str, payload: Dict[str, Any]) -> BaseModel:
+        """校验操作名和请求体，返回对应的模型实例；不合法时抛出 ValueError / ValidationError。"""
+        if operation not in JOB_OPERATIONS:
+            raise ValueError(f"不支持的操作: {operation}")
+        model, _ = JOB_OPERATIONS[operation]
+        return model.model_validate(payload)
+
+    async def submit(self, operation: str, payload: Dict[str, Any], callback_url: Optional[str] = None,
+                     client: Optional[str] = None) -> str:
+        """
+        校验并提交任务，返回任务 ID。client 为提交任务的调用方，之后只有它能查询该任务。
+        callback_url 不允许时抛出 CallbackURLError。
+        """
+        data = self.validate(operation, payload)
+        if callback_url:
+            check_callback_url(callback_url, self.callback_allowed_hosts)
+        job_id = uuid.uuid4().hex
+        await run_in_threadpool(
+            self._execute,
+            "INSERT INTO jobs (id, operation, payload, status, callback_url, client, created_at) "
+            "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+            (job_id, operation, data.model_dump_json(by_alias=True), callback_url, client, time.time()))
+        self._wakeup.set()
+        return job_id
+
+    async def get(self, job_id: str, client: Optional[str] = None) -> sqlite3.Row:
+        """
+        返回任务记录；传入 client 时只返回该调用方提交的任务，
+        其他调用方的任务与不存在的任务一样抛出 JobNotFoundError，不暴露任务是否存在。
+        """
+        rows = await run_in_threadpool(
+            self._execute, "SELECT * FROM jobs WHERE id = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (job_id, time.time()))
+        if not rows or (client is not None and rows[0]["client"] != client):
+            raise JobNotFoundError(job_id)
+        return rows[0]
+
+    @staticmethod
+    def describe(row: sqlite3.Row) -> Dict[str, Any]:
+        """将任务记录转为对外返回的状态描述；JSON 结果直接内联，二进制结果给出下载路径。"""
+        info = {
+            "job_id": row["id"],
+            "operation": row["operation"],
+            "status": row["status"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+        }
+        if row["status"] == "succeeded":
+            if row["media_type"] == "application/json":
+                info["result"] = orjson.loads(row["result"])
+            else:
+                info["result_url"] = f"/jobs/{row['id']}/result"
+        elif row["status"] == "failed":
+            info["error"] = row["error"]
+        return info
+
+    # --- 后台执行 ---
+
+    async def _worker(self) -> None:
+        """
+        循环领取并执行任务。领取前先清除唤醒信号，领取后才提交的任务会重新设置信号，不会被错过；
+        数据库等异常只记录日志，等待一个轮询间隔后继续，不会让 worker 退出。
+        """
+        while True:
+            self._wakeup.clear()
+            try:
+                row = await run_in_threadpool(self._claim)
+                if row is not None:
+                    await self._run(row)
+                    continue
+            except Exception:
+                logger.exception("Job worker failed, retrying in %.1fs", self.poll_interval)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, row: sqlite3.Row) -> None:
+        model, handler = JOB_OPERATIONS[row["operation"]]
+        try:
+            result = await handler(model.model_validate_json(row["payload"]))
+            if isinstance(result, tuple):
+                content, media_type = result
+            else:
+                content, media_type = orjson.dumps(result), "application/json"
+            status, error = "succeeded", None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            content, media_type, status, error = None, None, "failed", str(e)
+
+        now = time.time()
+        updated = await run_in_threadpool(
+            self._execute,
+            "UPDATE jobs SET status = ?, result = ?, media_type = ?, error = ?, finished_at = ?, expires_at = ?, "
+            "lease_expires = NULL WHERE id = ? AND status = 'running' AND owner = ? RETURNING id",
+            (status, content, media_type, error, now, now + self.result_ttl, row["id"], self.owner))
+        if not updated:
+            # 租约已过期，任务已被重新排队或由其他进程执行，以那边的结果为准
+            return
+        if row["callback_url"]:
+            await self._notify(row["callback_url"], await self.get(row["id"]))
+
+    async def _notify(self, callback_url: str, row: sqlite3.Row) -> None:
+        """
+        任务结束后回调通知；回调失败只记录日志，不影响任务结果。
+        主机不在允许列表中时，先解析域名，任一地址不是公网地址就不回调；不跟随重定向。
+        """
+        try:
+            check_callback_url(callback_url, self.callback_allowed_hosts)
+            parts = urlsplit(callback_url)
+            if not self.callback_allowed_hosts:
+                infos = await asyncio.get_running_loop().getaddrinfo(
+                    parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+                if not all(_is_public(info[4][0]) for info in infos):
+                    raise CallbackURLError(f"callback_url 的主机 {parts.hostname} 解析到了非公网地址。")
+            await self._http.post(callback_url, json=self.describe(row), follow_redirects=False)
+        except Exception as e:
+            print(f"Job callback to {callback_url} failed: {e}")
+
+    async def _heartbeat(self) -> None:
+        """定期为本进程执行中的任务续租，并把租约过期的任务重新排队。"""
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            await run_in_threadpool(
+                self._execute,
+                "UPDATE jobs SET lease_expires = ? WHERE status = 'running' AND owner = ?",
+                (time.time() + self.lease_ttl, self.owner))
+            if await run_in_threadpool(self._requeue_expired):
+                self._wakeup.set()
+
+    async def _janitor(self) -> None:
+        """定期清理已过期的任务结果。"""
+        while True:
+            await asyncio.sleep(60)
+            await run_in_threadpool(
+                self._execute, "DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+
+# 创建一个全局的任务队列实例
+job_queue = JobQueue(
+    db_path=settings.JOB_DB_PATH,
+    workers=settings.JOB_WORKERS,
+    result_ttl=settings.JOB_RESULT_TTL,
+    callback_allowed_hosts=[host.strip() for host in settings.JOB_CALLBACK_ALLOWED_HOSTS.split(",") if host.strip()],
+    lease_ttl=settings.JOB_LEASE_TTL,
+)
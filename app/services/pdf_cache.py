@@ -0,0 +1,252 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.tracing import tracer
+from app.models.schemas import NewResumeProfile
+from app.services.template_registry import template_registry
+
+# 最多记录多少个精简 PDF 的原始大小（只保存在内存中，进程重启后丢失）
+MAX_ORIGINAL_SIZES = 4096
+
+
+class PDFCache:
+    """
+    内容寻址的 PDF 结果缓存。
+
+    - 键：规范化简历数据（model_dump(by_alias=True)，键排序）+ 所选样式指纹的 SHA-256，
+      模板或样式表变化后旧结果自然失效；精简输出（compact）使用单独的键；
+    - 第一层：进程内 LRU，按字节数淘汰；
+    - 第二层：磁盘存储，进程重启后仍可命中；
+    - 同一个键的并发请求只会触发一次渲染。
+    """
+
+    def __init__(self, max_memory_bytes: int, disk_dir: Optional[str], max_disk_bytes: int,
+                 enabled: bool = True):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes: Optional[int] = None
+        # 磁盘层在多个线程池线程中并发写入，占用统计和清理需要加锁
+        self._disk_lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[str, int] = {}
+        self._original_sizes: "OrderedDict[str, int]" = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self.coalesced = 0
+
+    def key_for(self, profile: NewResumeProfile, compact: bool = False) -> str:
+        """
+        计算简历对应的缓存键（同时用作 ETag），compact 为 True 时为精简输出的键。
+        样式不存在时抛出 UnknownTemplateError。
+        """
+        version = template_registry.version(profile.style)
+        if compact:
+            version = f"{version}:compact"
+        # style 已体现在样式指纹中，不再参与序列化，未指定与显式指定 default 命中同一缓存
+        canonical = json.dumps(profile.model_dump(by_alias=True, exclude={'style'}), sort_keys=True,
+                               ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(f"{version}:{canonical}".encode()).hexdigest()
+
+    def note_original_size(self, key: str, size: Optional[int]) -> None:
+        """记录精简 PDF 对应的常规输出大小，缓存命中时同样可以报告精简前后的大小。"""
+        if not size:
+            return
+        self._original_sizes[key] = size
+        self._original_sizes.move_to_end(key)
+        while len(self._original_sizes) > MAX_ORIGINAL_SIZES:
+            self._original_sizes.popitem(last=False)
+
+    def original_size(self, key: str) -> Optional[int]:
+        return self._original_sizes.get(key)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "disk_evictions": self.disk_evictions,
+            "coalesced": self.coalesced,
+            "entries": len(self._entries),
+            "memory_bytes": self._memory_bytes,
+            "disk_bytes": self._disk_bytes or 0,
+        }
+
+    # --- 内存层 ---
+
+    def _get_memory(self, key: str) -> Optional[bytes]:
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+        return data
+
+    def _put_memory(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_memory_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._entries[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.evictions += 1
+
+    # --- 磁盘层（在线程池中执行） ---
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.pdf")
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _disk_files(self):
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if name.endswith('.pdf'):
+                    yield os.path.join(root, name)
+
+    def _write_disk(self, key: str, data: bytes) -> None:
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再原子替换，避免并发读到半个文件
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        with self._disk_lock:
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.replace(tmp_path, path)
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(os.path.getsize(p) for p in self._disk_files())
+            else:
+                self._disk_bytes += len(data) - replaced
+            if self._disk_bytes > self.max_disk_bytes:
+                self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        """按修改时间从旧到新删除磁盘缓存，直到占用降到上限的 90%。调用方须持有 _disk_lock。"""
+        files = sorted(self._disk_files(), key=lambda p: os.path.getmtime(p))
+        total = sum(os.path.getsize(p) for p in files)
+        for path in files:
+            if total <= self.max_disk_bytes * 0.9:
+                break
+            size = os.path.getsize(path)
+            os.remove(path)
+            total -= size
+            self.disk_evictions += 1
+        self._disk_bytes = total
+
+    def _scan_disk(self) -> None:
+        os.makedirs(self.disk_dir, exist_ok=True)
+        with self._disk_lock:
+            self._disk_bytes = sum(os.path.getsize(p) for p in self._disk_files())
+
+    async def warm_up(self) -> None:
+        """启动时统计磁盘层占用，避免首次写入时在请求路径上遍历缓存目录。"""
+        if self.enabled and self.disk_dir:
+            await run_in_threadpool(self._scan_disk)
+
+    # --- 对外接口 ---
+
+    async def get_or_render(self, key: str, render: Callable[[], Awaitable[bytes]],
+                            cancel_if_abandoned: bool = False) -> bytes:
+        """
+        返回缓存中的 PDF；未命中时调用 render() 生成并写入缓存。
+        cancel_if_abandoned 为 True 时，若本调用取消后已没有其他等待者，同时取消共享的渲染
+        （例如被更新的预览请求取代），尚未开始的渲染任务会让出渲染队列。
+        """
+        if not self.enabled:
+            return await render()
+
+        with tracer.span("pdf_cache.lookup", key=key[:16]) as span:
+            data = self._get_memory(key)
+            if data is not None:
+                self.hits += 1
+                span.set(outcome="memory")
+                return data
+            # 渲染任务在此 Span 内创建，继承其上下文，磁盘读取和渲染的 Span 记在它下面
+            span.set(outcome="coalesced" if key in self._inflight else "miss")
+            return await self._wait_inflight(key, render, cancel_if_abandoned)
+
+    async def _wait_inflight(self, key: str, render: Callable[[], Awaitable[bytes]],
+                             cancel_if_abandoned: bool) -> bytes:
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # 渲染放在独立任务中执行：发起者断开连接不会取消其他等待者共享的渲染
+            task = asyncio.ensure_future(self._load_or_render(key, render))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish_inflight(key, t))
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if cancel_if_abandoned and self._waiters[key] == 1 and not task.done():
+                # 先移出 inflight，之后到达的同键请求会发起新的渲染而不是等到一个已取消的任务
+                self._inflight.pop(key, None)
+                task.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def _finish_inflight(self, key: str, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # 所有等待者都已离开时，避免 "exception was never retrieved" 警告
+            task.exception()
+
+    async def _load_or_render(self, key: str, render: Callable[[], Awaitable[bytes]]) -> bytes:
+        if self.disk_dir:
+            data = await run_in_threadpool(self._read_disk, key)
+            if data is not None:
+                self.disk_hits += 1
+                tracer.annotate(outcome="disk")
+                self._put_memory(key, data)
+                return data
+
+        self.misses += 1
+        data = await render()
+        self._put_memory(key, data)
+        if self.disk_dir:
+            try:
+                await run_in_threadpool(self._write_disk, key, data)
+            except OSError as e:
+                print(f"PDF cache disk write failed: {e}")
+        return data
+
+
+# 创建一个全局的PDF缓存实例
+pdf_cache = PDFCache(
+    max_memory_bytes=settings.PDF_CACHE_MEMORY_BYTES,
+    disk_dir=settings.PDF_CACHE_DIR or None,
+    max_disk_bytes=settings.PDF_CACHE_DISK_BYTES,
+    enabled=settings.PDF_CACHE_ENABLED,
+)
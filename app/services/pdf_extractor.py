@@ -0,0 +1,333 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.metrics import EXTRACT_PAGES, EXTRACT_SECONDS
+from app.core.tracing import tracer
+
+# 计算摘要时每次读取的块大小
+CHUNK_SIZE = 1024 * 1024
+
+
+class PDFIngestionError(ValueError):
+    """上传的PDF不符合限制，status_code 为应返回给客户端的状态码。"""
+    status_code = 400
+
+
+class UploadTooLargeError(PDFIngestionError):
+    status_code = 413
+
+
+class TooManyPagesError(PDFIngestionError):
+    status_code = 413
+
+
+class InvalidPDFError(PDFIngestionError):
+    """文件已损坏、不是PDF或已加密，PyMuPDF 无法打开或无法提取其中的页面。"""
+
+
+class ExtractedPDF(NamedTuple):
+    sha256: str
+    text: str
+    page_count: int
+    cached: bool
+
+
+class LayoutLine(NamedTuple):
+    """版面中的一行文本：最大字号、是否粗体，以及所在文本块的行数（用于识别标题）。"""
+    text: str
+    size: float
+    bold: bool
+    block_lines: int
+
+
+def _extract_range(pdf_bytes: bytes, start: int, end: int) -> List[str]:
+    """在工作进程中提取 [start, end) 页的文本。PyMuPDF 不支持多线程，因此按进程并行。"""
+    import fitz  # PyMuPDF，按需导入以加快服务启动
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return [doc[i].get_text() for i in range(start, end)]
+
+
+def _extract_layout_range(pdf_bytes: bytes, start: int, end: int) -> List[List[LayoutLine]]:
+    """在工作进程中按 get_text("dict") 提取 [start, end) 页的文本行及其字号、粗体信息。"""
+    import fitz  # PyMuPDF
+    pages = []
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        for i in range(start, end):
+            lines = []
+            for block in doc[i].get_text("dict")["blocks"]:
+                block_lines = [line["spans"] for line in block.get("lines", []) if line["spans"]]
+                for spans in block_lines:
+                    text = "".join(span["text"] for span in spans).strip()
+                    if not text:
+                        continue
+                    lines.append(LayoutLine(
+                        text,
+                        max(span["size"] for span in spans),
+                        # flags 的第 5 位（16）表示粗体
+                        all(span["flags"] & 16 for span in spans if span["text"].strip()),
+                        len(block_lines),
+                    ))
+            pages.append(lines)
+    return pages
+
+
+def _sample_pdf() -> bytes:
+    """生成一页的样例PDF，用于预热。"""
+    import fitz  # PyMuPDF
+    with fitz.open() as doc:
+        doc.new_page().insert_text((72, 72), "warm-up")
+        return doc.tobytes()
+
+
+class PDFTextExtractor:
+    """
+    非阻塞的PDF文本提取器。
+
+    - 上传文件由 Starlette 以 SpooledTemporaryFile 接收（小文件在内存，大文件落盘），
+      这里分块计算 SHA-256，不会把整个文件一次读入事件循环；
+    - 超过大小或页数上限时拒绝；
+    - 提取在线程池中进行，页数较多的文档按页段分发到进程池并行提取；
+    - 提取结果按 SHA-256 缓存，同一文件重复上传时直接返回。
+    """
+
+    def __init__(self, max_bytes: int, max_pages: int, parallel_threshold: int,
+                 workers: int = 0, cache_entries: int = 256):
+        self.max_bytes = max_bytes
+        self.max_pages = max_pages
+        self.parallel_threshold = parallel_threshold
+        self.workers = workers if workers > 0 else min(4, os.cpu_count() or 1)
+        self.cache_entries = cache_entries
+        self._cache: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # 进程池每次重建时加一，用来判断进程池是否已被其他请求替换
+        self._generation = 0
+
+    def startup(self) -> None:
+        """创建并行提取用的进程池，在 FastAPI 启动时调用。"""
+        if self._executor is None and self.workers > 1:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            self._generation += 1
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _restart(self, generation: int) -> None:
+        """
+        工作进程异常退出（例如解析恶意PDF时被 OOM 杀掉）后进程池不可再用，重建一个。
+        同一个损坏的进程池上失败的请求可能有多个，只有第一个会重建（见 RenderEngine._restart）。
+        """
+        if generation == self._generation:
+            self.shutdown()
+            self.startup()
+
+    async def warm_up(self) -> None:
+        """
+        导入 PyMuPDF 并提取一份样例PDF；开启进程池时让每个工作进程各提取一次，
+        提前完成进程启动，避免首个大文件承担这部分开销。
+        """
+        pdf_bytes = await run_in_threadpool(_sample_pdf)
+        await run_in_threadpool(_extract_range, pdf_bytes, 0, 1)
+        if self._executor is not None:
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(
+                loop.run_in_executor(self._executor, _extract_range, pdf_bytes, 0, 1)
+                for _ in range(self.workers)
+            ))
+
+    async def _digest_upload(self, file: UploadFile) -> str:
+        """分块读取上传文件计算 SHA-256，同时检查大小上限。"""
+        if file.size is not None and file.size > self.max_bytes:
+            raise UploadTooLargeError(f"文件过大，最大允许 {self.max_bytes // (1024 * 1024)} MB。")
+        digest = hashlib.sha256()
+        total = 0
+        await file.seek(0)
+        while chunk := await file.read(CHUNK_SIZE):
+            total += len(chunk)
+            if total > self.max_bytes:
+                raise UploadTooLargeError(f"文件过大，最大允许 {self.max_bytes // (1024 * 1024)} MB。")
+            digest.update(chunk)
+        await file.seek(0)
+        return digest.hexdigest()
+
+    def _open_and_extract(self, file: UploadFile) -> Tuple[bytes, int, Optional[str], float]:
+        """
+        在线程池中执行：打开文档并检查页数。
+        页数较少时直接提取文本；否则返回 None，由调用方分发到进程池。最后一项为开始执行的时间，用于统计线程池排队耗时。
+        """
+        started = time.perf_counter()
+        import fitz  # PyMuPDF
+        file.file.seek(0)
+        pdf_bytes = file.file.read()
+        try:
+            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        except Exception as e:  # PyMuPDF 对损坏或非PDF文件抛出 FzErrorFormat 等
+            raise InvalidPDFError("无法读取PDF文件，文件可能已损坏或不是PDF。") from e
+        with doc:
+            if doc.needs_pass:
+                raise InvalidPDFError("PDF文件已加密，请上传未加密的文件。")
+            page_count = doc.page_count
+            if page_count > self.max_pages:
+                raise TooManyPagesError(f"PDF页数过多（{page_count} 页），最多允许 {self.max_pages} 页。")
+            if self._executor is None or page_count < self.parallel_threshold:
+                try:
+                    text = "".join(page.get_text() for page in doc)
+                except Exception as e:
+                    raise InvalidPDFError("无法提取PDF中的文本，文件可能已损坏。") from e
+                return pdf_bytes, page_count, text, started
+        return pdf_bytes, page_count, None, started
+
+    async def _extract_pages(self, fn: Callable[[bytes, int, int], list], pdf_bytes: bytes, page_count: int) -> list:
+        """
+        按页段把 fn 分发到进程池并行执行，按页序拼接结果。
+        工作进程崩溃时重建进程池后抛出原异常；页面提取失败时抛出 InvalidPDFError。
+        """
+        generation = self._generation
+        step = -(-page_count // self.workers)
+        loop = asyncio.get_running_loop()
+        try:
+            parts = await asyncio.gather(*(
+                loop.run_in_executor(self._executor, fn, pdf_bytes, start, min(start + step, page_count))
+                for start in range(0, page_count, step)
+            ))
+        except BrokenProcessPool:
+            self._restart(generation)
+            raise
+        except Exception as e:
+            raise InvalidPDFError("无法提取PDF中的文本，文件可能已损坏。") from e
+        return [page for part in parts for page in part]
+
+    async def _extract_parallel(self, pdf_bytes: bytes, page_count: int) -> str:
+        return "".join(await self._extract_pages(_extract_range, pdf_bytes, page_count))
+
+    async def extract_layout(self, file: UploadFile, page_count: int) -> List[List[LayoutLine]]:
+        """
+        按页提取带字号和粗体信息的文本行，供分段解析识别章节标题。
+        需要在 extract() 之后、上传文件关闭之前调用；页数较多时同样分发到进程池。
+        """
+        with tracer.span("pdf.extract_layout", pages=page_count):
+            pdf_bytes = await run_in_threadpool(self._read_upload, file)
+            if self._executor is None or page_count < self.parallel_threshold:
+                try:
+                    return await run_in_threadpool(_extract_layout_range, pdf_bytes, 0, page_count)
+                except Exception as e:
+                    raise InvalidPDFError("无法提取PDF中的文本，文件可能已损坏。") from e
+            return await self._extract_pages(_extract_layout_range, pdf_bytes, page_count)
+
+    @staticmethod
+    def _read_upload(file: UploadFile) -> bytes:
+        file.file.seek(0)
+        return file.file.read()
+
+    def _remember(self, digest: str, text: str, page_count: int) -> None:
+        self._cache[digest] = (text, page_count)
+        self._cache.move_to_end(digest)
+        while len(self._cache) > self.cache_entries:
+            self._cache.popitem(last=False)
+
+    async def extract(self, file: UploadFile) -> ExtractedPDF:
+        """提取上传PDF的全部文本。"""
+        digest = await self._digest_upload(file)
+        cached = self._cache.get(digest)
+        if cached is not None:
+            self._cache.move_to_end(digest)
+            return ExtractedPDF(digest, cached[0], cached[1], True)
+
+        started = time.perf_counter()
+        with tracer.span("pdf.extract") as span:
+            pdf_bytes, page_count, text, dispatched = await run_in_threadpool(self._open_and_extract, file)
+            span.set(pages=page_count, bytes=len(pdf_bytes), parallel=text is None,
+                     threadpool_wait_ms=round((dispatched - started) * 1000, 3))
+            if text is None:
+                text = await self._extract_parallel(pdf_bytes, page_count)
+        EXTRACT_SECONDS.observe(time.perf_counter() - started)
+        EXTRACT_PAGES.observe(page_count)
+        self._remember(digest, text, page_count)
+        return ExtractedPDF(digest, text, page_count, False)
+
+
+# 创建一个全局的PDF文本提取器实例
+pdf_extractor = PDFTextExtractor(
+    max_bytes=settings.PDF_MAX_UPLOAD_BYTES,
+    max_pages=settings.PDF_MAX_PAGES,
+    parallel_threshold=settings.PDF_PARALLEL_PAGE_THRESHOLD,
+    workers=settings.PDF_EXTRACT_WORKERS,
+    cache_entries=settings.PDF_TEXT_CACHE_ENTRIES,
+)
+
+
+# multipart 请求体中分隔符和其他表单字段允许占用的额外字节数
+MULTIPART_OVERHEAD = 1024 * 1024
+
+
+class UploadLimitMiddleware:
+    """
+    在 Starlette 接收并暂存 multipart 上传之前限制请求体大小：
+    Content-Length 已超过上限时直接返回 413，否则边接收边计数，超过上限时停止读取并返回 413。
+    上限为 PDF_MAX_UPLOAD_BYTES 加 MULTIPART_OVERHEAD；_digest_upload 仍会按文件本身的大小再检查一次。
+    """
+
+    def __init__(self, app: ASGIApp, max_bytes: Optional[int] = None):
+        self.app = app
+        self.max_bytes = (pdf_extractor.max_bytes if max_bytes is None else max_bytes) + MULTIPART_OVERHEAD
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        if not headers.get("content-type", "").startswith("multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+        declared = headers.get("content-length", "")
+        if declared.isdigit() and int(declared) > self.max_bytes:
+            await self._too_large()(scope, receive, send)
+            return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # FastAPI 解析表单时遇到 HTTPException 会原样抛出，由异常处理返回 413
+                    raise HTTPException(status_code=413, detail=self._detail())
+            return message
+
+        async def tracking_send(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except HTTPException as e:
+            if e.status_code != 413 or response_started:
+                raise
+            await self._too_large()(scope, receive, send)
+
+    def _detail(self) -> str:
+        return f"文件过大，最大允许 {(self.max_bytes - MULTIPART_OVERHEAD) // (1024 * 1024)} MB。"
+
+    def _too_large(self) -> ORJSONResponse:
+        return ORJSONResponse(status_code=413, content={"detail": self._detail()})
@@ -1,30 +1,153 @@
 import os
-from jinja2 import Environment, FileSystemLoader
-from weasyprint import HTML, CSS
+import time
+from typing import Any, Dict, Optional, Sequence
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+from weasyprint import HTML, CSS, default_url_fetcher
+from weasyprint.text.fonts import FontConfiguration
+
+from app.core.config import settings
 from app.models.schemas import NewResumeProfile
+from app.services.template_registry import DEFAULT_STYLE, TEMPLATE_DIR, TemplateSpec, template_registry
 
-# 定义模板文件夹的路径 (相对于项目根目录)
-TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'templates')
-jinja_env = Environment(loader=FileSystemLoader(TEMPLATE_DIR))
 
-def create_resume_pdf(profile: NewResumeProfile) -> bytes:
+class LocalURLFetcher:
     """
-    根据简历数据生成PDF文件的二进制内容。
+    WeasyPrint 的 URL 获取器：只允许读取模板目录内的本地文件和 data: URL，
+    任何网络请求都会被直接拒绝，避免离线节点在渲染时等待超时。
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = os.path.realpath(root_dir)
+
+    def __call__(self, url: str, timeout: int = 10, ssl_context=None) -> Dict[str, Any]:
+        if url.startswith('data:'):
+            return default_url_fetcher(url, timeout=timeout, ssl_context=ssl_context)
+        parsed = urlparse(url)
+        if parsed.scheme == 'file':
+            path = os.path.realpath(url2pathname(parsed.path))
+            if os.path.commonpath([path, self.root_dir]) == self.root_dir:
+                return default_url_fetcher(url, timeout=timeout, ssl_context=ssl_context)
+        raise ValueError(f"渲染时禁止访问外部资源: {url}")
+
+
+class RenderContext:
+    """
+    PDF 渲染上下文：模板、样式表和字体配置只构建一次，之后的每次渲染只需做排版。
+    每个进程为每种样式持有一个实例（见 get_render_context），不跨进程共享。
+    """
+
+    def __init__(self, template_dir: str = TEMPLATE_DIR,
+                 template_name: str = "resume_template.html",
+                 stylesheet_names: Sequence[str] = ("fonts.css", "style.css"),
+                 subset_fonts: bool = True, version: Optional[str] = None,
+                 compact_jpeg_quality: int = 75, compact_dpi: int = 150):
+        self.template_dir = os.path.realpath(template_dir)
+        self.version = version
+        self.template = template_registry.jinja_env.get_template(template_name)
+        self.url_fetcher = LocalURLFetcher(self.template_dir)
+        # FontConfiguration 会在解析样式表时注册 @font-face，必须与渲染时使用的是同一个实例
+        self.font_config = FontConfiguration()
+        self.stylesheets = [
+            CSS(filename=os.path.join(self.template_dir, name),
+                font_config=self.font_config, url_fetcher=self.url_fetcher)
+            for name in stylesheet_names
+        ]
+        # full_fonts=False 时 WeasyPrint 只嵌入用到的字形（字体子集化）
+        self.write_options = {"full_fonts": not subset_fonts}
+        # 精简输出：强制子集化并去掉字体的 hinting 信息，图片降采样到 dpi 并按 jpeg_quality 重新压缩
+        self.compact_options = {
+            "full_fonts": False,
+            "hinting": False,
+            "optimize_images": True,
+            "jpeg_quality": compact_jpeg_quality,
+            "dpi": compact_dpi,
+        }
+
+    def render_html(self, profile_data: Dict[str, Any]) -> str:
+        return self.template.render(profile_data)
+
+    def render_pdf(self, profile_data: Dict[str, Any],
+                   timings: Optional[Dict[str, float]] = None,
+                   compact: bool = False, sizes: Optional[Dict[str, int]] = None) -> bytes:
+        """
+        渲染 PDF。传入 timings 字典时，会把 jinja（模板渲染）、layout（WeasyPrint 排版）
+        和 write_pdf（生成 PDF 字节）三个阶段的耗时（秒）写入其中。
+        compact 为 True 时按 compact_options 生成精简的 PDF；同时传入 sizes 字典时，
+        会用常规选项再写出一次同一份排版结果，把两者的大小写入 original 和 compact。
+        """
+        options = self.compact_options if compact else self.write_options
+        started = time.perf_counter()
+        html = self.render_html(profile_data)
+        templated = time.perf_counter()
+        # 先 render() 再 write_pdf() 与 HTML.write_pdf() 等价，拆开是为了分别计时
+        document = HTML(
+            string=html,
+            base_url=self.template_dir,
+            url_fetcher=self.url_fetcher,
+        ).render(
+            stylesheets=self.stylesheets,
+            font_config=self.font_config,
+            **options,
+        )
+        laid_out = time.perf_counter()
+        pdf_bytes = document.write_pdf(**options)
+        if timings is not None:
+            timings["jinja"] = templated - started
+            timings["layout"] = laid_out - templated
+            timings["write_pdf"] = time.perf_counter() - laid_out
+        if compact and sizes is not None:
+            # 图片选项在排版时生效，原始大小不含图片压缩的差别（内置模板没有图片）
+            sizes["original"] = len(document.write_pdf(**self.write_options))
+            sizes["compact"] = len(pdf_bytes)
+        return pdf_bytes
+
+
+_render_contexts: Dict[str, RenderContext] = {}
+
+
+def _build_context(spec: TemplateSpec) -> RenderContext:
+    return RenderContext(
+        template_name=spec.template,
+        stylesheet_names=spec.stylesheets,
+        subset_fonts=settings.RENDER_SUBSET_FONTS,
+        version=spec.version,
+        compact_jpeg_quality=settings.RENDER_COMPACT_JPEG_QUALITY,
+        compact_dpi=settings.RENDER_COMPACT_DPI,
+    )
+
+
+def get_render_context(style: Optional[str] = None, version: Optional[str] = None) -> RenderContext:
+    """
+    返回当前进程中指定样式的渲染上下文，首次调用时构建。
+    传入的 version 与已构建的上下文不一致时（模板已更新），重新扫描模板目录并重建该样式。
+    """
+    name = style or DEFAULT_STYLE
+    context = _render_contexts.get(name)
+    if context is None or (version and context.version != version):
+        known = template_registry.specs.get(name)
+        if version and (known is None or known.version != version):
+            # 主进程已经看到了新的模板内容，本进程重新扫描
+            template_registry.refresh()
+        spec = template_registry.resolve(style)
+        if context is None or spec.version != context.version:
+            context = _render_contexts[name] = _build_context(spec)
+    return context
+
+
+def create_resume_pdf(profile: NewResumeProfile,
+                      timings: Optional[Dict[str, float]] = None,
+                      version: Optional[str] = None, compact: bool = False,
+                      sizes: Optional[Dict[str, int]] = None) -> bytes:
+    """
+    根据简历数据生成PDF文件的二进制内容，模板由 profile.style 选择。
+    传入 timings 字典时会写入各渲染阶段的耗时，compact 和 sizes 的含义见 RenderContext.render_pdf；
+    version 为调用方看到的样式指纹，用于发现模板更新，见 get_render_context。
     """
     try:
         profile_data = profile.model_dump(by_alias=True)
-        
-        # 根据style字段选择模板（如果未来需要）
-        # 目前固定使用 resume_template.html
-        resume_template = jinja_env.get_template("resume_template.html")
-        css_file_path = os.path.join(TEMPLATE_DIR, 'style.css')
-        
-        rendered_html = resume_template.render(profile_data)
-        
-        css = CSS(filename=css_file_path)
-        pdf_bytes = HTML(string=rendered_html, base_url=TEMPLATE_DIR).write_pdf(stylesheets=[css])
-        
-        return pdf_bytes
+        return get_render_context(profile.style, version).render_pdf(profile_data, timings, compact, sizes)
     except Exception as e:
         # 可以在这里添加更详细的日志记录
         print(f"PDF generation failed: {e}")
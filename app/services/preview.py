@@ -0,0 +1,70 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Tuple, TypeVar
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+
+T = TypeVar("T")
+
+
+class PreviewSupersededError(RuntimeError):
+    """同一用户发起了更新的预览请求，本次预览已被取消。"""
+
+
+def _rasterize_first_page(pdf_bytes: bytes, dpi: int) -> Tuple[bytes, int]:
+    """在线程池中执行：把 PDF 第一页渲染为 PNG，同时返回总页数。"""
+    import fitz  # PyMuPDF，按需导入以加快服务启动
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        pixmap = doc[0].get_pixmap(dpi=dpi)
+        return pixmap.tobytes("png"), doc.page_count
+
+
+async def rasterize_first_page(pdf_bytes: bytes, dpi: int) -> Tuple[bytes, int]:
+    return await run_in_threadpool(_rasterize_first_page, pdf_bytes, dpi)
+
+
+class PreviewCoordinator:
+    """
+    按 user_uid 合并预览请求：同一用户的新请求会取消尚未完成的旧请求。
+
+    - 每个请求先等待 debounce 时间，期间被取代的请求不会发起渲染（连续输入时只渲染最后一次）；
+    - 已发起的渲染随请求一起取消，尚在渲染队列中的任务会让出队列；
+    - 被取代的请求抛出 PreviewSupersededError。
+    """
+
+    def __init__(self, debounce: float):
+        self.debounce = debounce
+        self._latest: Dict[str, Tuple[int, asyncio.Task]] = {}
+        self._generation = 0
+
+    async def _debounced(self, work: Callable[[], Awaitable[T]]) -> T:
+        if self.debounce > 0:
+            await asyncio.sleep(self.debounce)
+        return await work()
+
+    async def run(self, user_uid: str, work: Callable[[], Awaitable[T]]) -> T:
+        previous = self._latest.get(user_uid)
+        if previous is not None:
+            previous[1].cancel()
+
+        self._generation += 1
+        generation = self._generation
+        task = asyncio.ensure_future(self._debounced(work))
+        self._latest[user_uid] = (generation, task)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            current = self._latest.get(user_uid)
+            if task.cancelled() and (current is None or current[0] != generation):
+                raise PreviewSupersededError("已有更新的预览请求，本次预览已取消。")
+            # 客户端断开连接：一并取消后台任务
+            task.cancel()
+            raise
+        finally:
+            if self._latest.get(user_uid, (None,))[0] == generation:
+                del self._latest[user_uid]
+
+
+# 创建一个全局的预览协调器实例
+preview_coordinator = PreviewCoordinator(debounce=settings.PREVIEW_DEBOUNCE_MS / 1000)
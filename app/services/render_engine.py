@@ -0,0 +1,213 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import RENDER_COMPACT_RATIO, RENDER_IN_FLIGHT, observe_render
+from app.core.tracing import tracer
+from app.models.schemas import NewResumeProfile
+from app.services.clients import FairScheduler, current_share
+from app.services.template_registry import template_registry
+
+
+class RenderQueueFullError(RuntimeError):
+    """渲染队列已满，调用方应提示客户端稍后重试。"""
+
+
+def _init_worker() -> None:
+    """
+    工作进程启动时为每种样式预先构建渲染上下文（模板、样式表、字体），
+    让首个任务也只需要做排版。失败时不抛出，留给具体任务报告错误。
+    """
+    try:
+        from app.services.pdf_generator import get_render_context
+        for style in template_registry.refresh():
+            get_render_context(style)
+    except Exception as e:
+        print(f"Render worker warm-up failed: {e}")
+
+
+def _render_job(profile_data: Dict[str, Any], version: Optional[str] = None,
+                compact: bool = False) -> Tuple[bytes, Dict[str, float], Dict[str, int]]:
+    """
+    在工作进程中执行：重建简历模型并渲染 PDF，同时返回各阶段耗时和（精简输出时）前后大小。
+    version 为主进程看到的样式指纹，工作进程据此发现模板更新。
+    必须是模块级函数，才能被 ProcessPoolExecutor 序列化。
+    """
+    from app.services.pdf_generator import create_resume_pdf
+    timings: Dict[str, float] = {}
+    sizes: Dict[str, int] = {}
+    pdf_bytes = create_resume_pdf(NewResumeProfile.model_validate(profile_data), timings, version, compact, sizes)
+    return pdf_bytes, timings, sizes
+
+
+class RenderEngine:
+    """
+    基于多进程池的 PDF 渲染引擎。
+
+    WeasyPrint 的排版是 CPU 密集型操作，放在事件循环里会阻塞整个 worker；
+    这里把渲染交给独立的工作进程，事件循环只负责等待结果。
+    - 进程数默认等于 CPU 核数；
+    - 同时在途（执行中 + 排队中）的任务数有上限，超过时立即拒绝；
+    - 排队的任务按调用方加权轮询交给进程池，进程池内部不再排队；
+    - 每个任务有超时时间；
+    - 每个工作进程处理 N 个任务后自动重启，限制 WeasyPrint 的内存增长。
+    """
+
+    def __init__(self, workers: int = 0, queue_size: int = 16,
+                 job_timeout: float = 60, max_jobs_per_worker: int = 100):
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.queue_size = queue_size
+        self.job_timeout = job_timeout
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self._scheduler = FairScheduler(self.workers)
+        self._in_flight = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # 每次创建进程池时加一，用于判断损坏的进程池是否已被其他任务替换
+        self._generation = 0
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # max_tasks_per_child 要求使用 spawn 启动方式
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            max_tasks_per_child=self.max_jobs_per_worker or None,
+            initializer=_init_worker,
+        )
+
+    def startup(self) -> None:
+        """创建工作进程池，在 FastAPI 启动时调用。"""
+        if self._executor is None:
+            self._executor = self._create_executor()
+            self._generation += 1
+
+    def shutdown(self) -> None:
+        """关闭工作进程池并取消尚未开始的任务，在 FastAPI 关闭时调用。"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            raise RuntimeError("RenderEngine 进程池尚未创建，请先调用 startup()。")
+        return self._executor
+
+    async def submit(self, fn, *args) -> Any:
+        """
+        将任意模块级函数提交到工作进程执行，受队列上限和任务超时约束。
+        队列已满时抛出 RenderQueueFullError，超时抛出 asyncio.TimeoutError。
+        """
+        if self._in_flight >= self.workers + self.queue_size:
+            raise RenderQueueFullError("PDF渲染队列已满，请稍后重试。")
+        self._in_flight += 1
+        RENDER_IN_FLIGHT.inc()
+        generation = self._generation
+        try:
+            # 超时包含排队时间
+            async with asyncio.timeout(self.job_timeout):
+                queued_ns = time.time_ns()
+                await self._scheduler.acquire(*current_share())
+                tracer.record("render.queue", queued_ns, time.time_ns())
+                # 记录提交任务时的进程池，排队期间进程池可能已被替换
+                generation = self._generation
+                try:
+                    future = self.executor.submit(fn, *args)
+                except BaseException:
+                    self._scheduler.release()
+                    raise
+                try:
+                    with tracer.span("render.execute", job=getattr(fn, "__name__", "job")):
+                        return await asyncio.wrap_future(future)
+                finally:
+                    self._release_when_done(future)
+        except BrokenProcessPool:
+            self._restart(generation)
+            raise
+        finally:
+            self._in_flight -= 1
+            RENDER_IN_FLIGHT.dec()
+
+    def _release_when_done(self, future: Future) -> None:
+        """
+        任务结束后归还调度许可。超时或取消时工作进程可能仍在渲染，
+        此时等进程中的任务真正结束再归还，避免超时任务累积后同时运行的渲染数超过进程数。
+        """
+        if future.done():
+            self._scheduler.release()
+            return
+        loop = asyncio.get_running_loop()
+
+        def release(_: Future) -> None:
+            try:
+                loop.call_soon_threadsafe(self._scheduler.release)
+            except RuntimeError:
+                # 事件循环已关闭（服务正在退出），不再需要归还
+                pass
+
+        future.add_done_callback(release)
+
+    def _restart(self, generation: int) -> None:
+        """
+        工作进程异常退出（例如被 OOM 杀掉）后进程池不可再用，重建一个。
+        同一个损坏的进程池上失败的任务可能有多个，只有第一个会重建；之后的任务发现进程池
+        已被替换（generation 不同）时不再重建，以免关闭新进程池并取消其中的任务。
+        在事件循环中同步执行，检查和替换之间不会切换到其他任务。
+        """
+        if generation == self._generation:
+            self.shutdown()
+            self.startup()
+
+    async def warm_up(self, profile: NewResumeProfile) -> None:
+        """
+        同时提交与进程数相同的样例渲染任务：工作进程按需启动，这样所有进程都会提前
+        完成 WeasyPrint 导入、字体发现和模板加载，首个真实请求只需要做排版。
+        """
+        version = template_registry.version(profile.style)
+        profile_data = profile.model_dump(by_alias=True)
+        await asyncio.gather(*(self.submit(_render_job, profile_data, version) for _ in range(self.workers)))
+
+    async def render(self, profile: NewResumeProfile, compact: bool = False,
+                     sizes: Optional[Dict[str, int]] = None) -> bytes:
+        """
+        在工作进程中渲染简历 PDF，并记录各阶段耗时和输出大小。
+        compact 为 True 时生成精简的 PDF（见 RenderContext.render_pdf），并把精简前后的大小写入 sizes。
+        """
+        version = template_registry.version(profile.style)
+        with tracer.span("render", style=profile.style or "default", compact=compact) as span:
+            pdf_bytes, timings, job_sizes = await self.submit(
+                _render_job, profile.model_dump(by_alias=True), version, compact)
+            span.set(pdf_bytes=len(pdf_bytes), **{f"{name}_bytes": size for name, size in job_sizes.items()})
+            self._record_stages(timings)
+        observe_render(timings, len(pdf_bytes))
+        if job_sizes.get("original"):
+            RENDER_COMPACT_RATIO.observe(job_sizes["compact"] / job_sizes["original"])
+        if sizes is not None:
+            sizes.update(job_sizes)
+        return pdf_bytes
+
+    @staticmethod
+    def _record_stages(timings: Dict[str, float]) -> None:
+        """
+        create_resume_pdf 在工作进程中执行，无法直接记录 Span；
+        按返回的各阶段耗时补记子 Span，从当前时间往前依次排列（忽略结果回传的耗时）。
+        """
+        end_ns = time.time_ns()
+        stages = [(stage, int(timings[stage] * 1e9)) for stage in ("jinja", "layout", "write_pdf") if stage in timings]
+        start_ns = end_ns - sum(duration for _, duration in stages)
+        for stage, duration in stages:
+            tracer.record(f"render.{stage}", start_ns, start_ns + duration)
+            start_ns += duration
+
+
+# 创建一个全局的渲染引擎实例
+render_engine = RenderEngine(
+    workers=settings.RENDER_WORKERS,
+    queue_size=settings.RENDER_QUEUE_SIZE,
+    job_timeout=settings.RENDER_JOB_TIMEOUT,
+    max_jobs_per_worker=settings.RENDER_MAX_JOBS_PER_WORKER,
+)
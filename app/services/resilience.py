@@ -0,0 +1,454 @@
+import asyncio
+import math
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Optional
+
+import httpx
+from fastapi import Request
+
+from app.core.config import settings, parse_key_values
+from app.core.metrics import DIFY_ERRORS, DIFY_HEDGES, DIFY_IN_FLIGHT, DIFY_LATENCY, DIFY_RETRIES
+from app.core.tracing import tracer
+from app.services.clients import FairScheduler, TokenBucket, current_share
+
+# 可重试的上游状态码：网关错误和暂时不可用。429 表示上游在限流，重试只会加重负担
+RETRYABLE_STATUSES = frozenset({502, 503, 504})
+
+
+class DifyUnavailableError(RuntimeError):
+    """Dify 应用暂不可用（熔断打开或排队已满），调用方应快速返回 503。"""
+
+    def __init__(self, key_name: str, reason: str, retry_after: float):
+        super().__init__(f"Dify {key_name} 应用暂不可用: {reason}")
+        self.key_name = key_name
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(DifyUnavailableError):
+    """调用方给出的截止时间已到，不再等待 Dify，调用方应返回 504。"""
+
+    def __init__(self, key_name: str):
+        super().__init__(key_name, "已超过请求的截止时间", 0.0)
+
+
+# 当前请求的截止时间（time.monotonic()），由请求头 X-Request-Timeout 决定，None 表示不限
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+async def read_deadline(request: Request) -> None:
+    """
+    路由依赖：请求头 `X-Request-Timeout: 秒数` 表示客户端最多等待多久，
+    之后的 Dify 调用（含排队、重试和对冲）都不会超过这个截止时间。
+    必须是 async 函数，ContextVar 的修改才能传递到路由函数中。
+    """
+    try:
+        seconds = float(request.headers.get("x-request-timeout", ""))
+    except ValueError:
+        return
+    if seconds > 0:
+        request_deadline.set(time.monotonic() + seconds)
+
+
+def remaining_time() -> Optional[float]:
+    """距当前请求截止时间的剩余秒数；没有截止时间时返回 None。"""
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class RetryBudget:
+    """
+    全局重试预算：每个原始请求存入 ratio 个令牌，重试和对冲请求各消耗 1 个，
+    另有每秒 min_per_second 个的保底额度，保证低流量时也能重试。
+    上游整体故障时重试次数最多为正常请求数的 ratio 倍，不会成倍放大流量。
+    """
+
+    def __init__(self, ratio: float, min_per_second: float):
+        self.ratio = ratio
+        # 存入的令牌最多保留最近约 100 个请求挣得的额度
+        self.max_balance = max(1.0, ratio * 100)
+        self.balance = 0.0
+        self._floor = TokenBucket(min_per_second, max(1.0, min_per_second * 10)) if min_per_second > 0 else None
+        self.withdrawn = 0
+        self.rejected = 0
+
+    def deposit(self) -> None:
+        self.balance = min(self.max_balance, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.balance >= 1:
+            self.balance -= 1
+        elif self._floor is None or self._floor.take(1) > 0:
+            self.rejected += 1
+            return False
+        self.withdrawn += 1
+        return True
+
+    def stats(self) -> Dict[str, object]:
+        return {"balance": round(self.balance, 2), "withdrawn": self.withdrawn, "rejected": self.rejected}
+
+
+class LatencyTracker:
+    """记录最近 window 次成功调用的耗时，用于计算分位数。"""
+
+    def __init__(self, window: int = 200):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败 failure_threshold 次后打开，直接拒绝请求；
+    reset_timeout 秒后进入半开状态，只放行少量探测请求，探测成功则恢复，失败则再次打开。
+    探测请求没有得出结果就结束时（取消、截止时间已到、4xx 等）须调用 release_probe() 归还名额；
+    探测超过 reset_timeout 仍未结束时，名额也会被收回，避免一直拒绝请求。
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30, half_open_probes: int = 1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probes = 0
+        self._probe_started = 0.0
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN:
+            if self.retry_after() > 0:
+                return False
+            self.state = self.HALF_OPEN
+            self._probes = 0
+        if self.state == self.HALF_OPEN:
+            now = time.monotonic()
+            if self._probes and now - self._probe_started > self.reset_timeout:
+                self._probes = 0
+            if self._probes >= self.half_open_probes:
+                return False
+            self._probes += 1
+            self._probe_started = now
+        return True
+
+    def release_probe(self) -> None:
+        """归还没有得出结果的探测名额。"""
+        if self.state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class AppGuard:
+    """
+    单个 Dify 应用的隔离舱：独立的并发上限、排队上限、熔断器和自适应超时。
+    并发许可按调用方加权轮询分配（FairScheduler），批量调用方不会挤占交互请求。
+    """
+
+    def __init__(self, key_name: str, concurrency: int, max_queue: int, breaker: CircuitBreaker,
+                 min_timeout: float, max_timeout: float, percentile: float, multiplier: float,
+                 min_samples: int = 20):
+        self.key_name = key_name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.breaker = breaker
+        self.latency = LatencyTracker()
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self._scheduler = FairScheduler(concurrency)
+        self.in_flight = 0
+        self.queued = 0
+
+    def timeout(self) -> float:
+        """根据近期耗时分位数推算超时时间；样本不足时使用上限。"""
+        if len(self.latency) < self.min_samples:
+            return self.max_timeout
+        observed = self.latency.percentile(self.percentile) * self.multiplier
+        return min(self.max_timeout, max(self.min_timeout, observed))
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "queued_by_client": self._scheduler.waiting(),
+            "p50_seconds": self.latency.percentile(50),
+            "p99_seconds": self.latency.percentile(99),
+            "timeout_seconds": self.timeout(),
+        }
+
+    @staticmethod
+    def _error_reason(error: BaseException) -> str:
+        """将异常归类为指标标签，保持标签取值有限。"""
+        if isinstance(error, DeadlineExceededError):
+            return "deadline"
+        if isinstance(error, httpx.HTTPStatusError):
+            return f"http_{error.response.status_code}"
+        if isinstance(error, httpx.TimeoutException):
+            return "timeout"
+        if isinstance(error, httpx.TransportError):
+            return "transport"
+        return type(error).__name__
+
+    @staticmethod
+    def _is_failure(error: BaseException) -> bool:
+        # 4xx 说明请求本身有问题，不代表 Dify 应用不健康
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code >= 500 or error.response.status_code == 429
+        # 调用方取消、中途停止读取流式响应或截止时间已到，也不算失败
+        return not isinstance(error, (asyncio.CancelledError, GeneratorExit, DeadlineExceededError))
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[float]:
+        """
+        进入隔离舱并返回本次调用应使用的超时时间。
+        熔断打开或排队已满时抛出 DifyUnavailableError；退出时根据是否异常更新熔断器和耗时统计。
+        """
+        if not self.breaker.allow():
+            DIFY_ERRORS.labels(self.key_name, "circuit_open").inc()
+            raise DifyUnavailableError(self.key_name, "熔断中", self.breaker.retry_after() or 1.0)
+        # 半开状态下本次调用占用了一个探测名额，没有记录成功或失败就结束时需要归还
+        probing = self.breaker.state == CircuitBreaker.HALF_OPEN
+        recorded = False
+        try:
+            if self._scheduler.full and self.queued >= self.max_queue:
+                DIFY_ERRORS.labels(self.key_name, "queue_full").inc()
+                raise DifyUnavailableError(self.key_name, "排队请求过多", 1.0)
+
+            self.queued += 1
+            try:
+                await self._scheduler.acquire(*current_share())
+            finally:
+                self.queued -= 1
+            self.in_flight += 1
+            DIFY_IN_FLIGHT.labels(self.key_name).inc()
+            started = time.monotonic()
+            try:
+                yield self.timeout()
+            except BaseException as e:
+                if not isinstance(e, (asyncio.CancelledError, GeneratorExit)):
+                    DIFY_ERRORS.labels(self.key_name, self._error_reason(e)).inc()
+                    DIFY_LATENCY.labels(self.key_name).observe(time.monotonic() - started)
+                if self._is_failure(e):
+                    self.breaker.record_failure()
+                    recorded = True
+                raise
+            else:
+                elapsed = time.monotonic() - started
+                self.breaker.record_success()
+                recorded = True
+                self.latency.record(elapsed)
+                DIFY_LATENCY.labels(self.key_name).observe(elapsed)
+            finally:
+                self.in_flight -= 1
+                DIFY_IN_FLIGHT.labels(self.key_name).dec()
+                self._scheduler.release()
+        finally:
+            if probing and not recorded:
+                self.breaker.release_probe()
+
+
+class DifyResilience:
+    """
+    按 Dify 应用密钥名管理各自的 AppGuard，一个应用变慢不会拖垮其他应用。
+
+    call() 在隔离舱之上控制尾延迟：
+    - 对冲：hedge_apps 中的应用在等待超过近期耗时的 hedge_percentile 分位数后，再发出一个相同的请求，
+      采用先返回的结果并取消另一个；
+    - 重试：网络错误、超时和 502/503/504 按带抖动的指数退避重试，最多 max_attempts 次；
+    - 对冲和重试都从全局 RetryBudget 中扣除，预算耗尽时不再发出额外请求；
+    - 所有尝试都不会超过当前请求的截止时间（见 read_deadline）。
+    """
+
+    def __init__(self, key_names, default_concurrency: int, concurrency_overrides: Dict[str, float],
+                 max_queue: int, failure_threshold: int, reset_timeout: float,
+                 min_timeout: float, max_timeout: float, percentile: float, multiplier: float,
+                 retry_budget: Optional[RetryBudget] = None, max_attempts: int = 1,
+                 backoff_base: float = 0.2, backoff_max: float = 2.0, hedge_apps=(),
+                 hedge_percentile: float = 95, hedge_min_delay: float = 1.0, hedge_min_samples: int = 20):
+        self.guards = {
+            name: AppGuard(
+                name,
+                concurrency=int(concurrency_overrides.get(name, default_concurrency)),
+                max_queue=max_queue,
+                breaker=CircuitBreaker(failure_threshold, reset_timeout),
+                min_timeout=min_timeout,
+                max_timeout=max_timeout,
+                percentile=percentile,
+                multiplier=multiplier,
+            )
+            for name in key_names
+        }
+        self.retry_budget = retry_budget or RetryBudget(0.0, 0.0)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_apps = frozenset(hedge_apps)
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+
+    def guard(self, key_name: str):
+        return self.guards[key_name].acquire()
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        stats = {name: guard.stats() for name, guard in self.guards.items()}
+        for name, guard_stats in stats.items():
+            guard_stats["hedge_delay_seconds"] = self.hedge_delay(name)
+        return stats
+
+    def hedge_delay(self, key_name: str) -> Optional[float]:
+        """发出对冲请求前的等待时间；该应用不对冲或耗时样本不足时返回 None。"""
+        latency = self.guards[key_name].latency
+        if key_name not in self.hedge_apps or len(latency) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, latency.percentile(self.hedge_percentile))
+
+    @staticmethod
+    def _retry_reason(error: BaseException) -> Optional[str]:
+        """可重试的错误返回其指标标签，否则返回 None。"""
+        if isinstance(error, httpx.HTTPStatusError):
+            status = error.response.status_code
+            return f"http_{status}" if status in RETRYABLE_STATUSES else None
+        if isinstance(error, httpx.TimeoutException):
+            return "timeout"
+        if isinstance(error, httpx.TransportError):
+            return "transport"
+        return None
+
+    async def call(self, key_name: str, send: Callable[[float], Awaitable[httpx.Response]],
+                   hedge: bool = True) -> httpx.Response:
+        """
+        执行一次 Dify 调用：send(timeout) 发出请求并检查状态码，按需对冲和重试。
+        hedge 为 False 时不对冲（例如会话中的追问，重复发送会在同一会话中留下两条消息）。
+        超过截止时间时抛出 DeadlineExceededError，熔断或排队已满时抛出 DifyUnavailableError（不重试）。
+        """
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                if not hedge:
+                    return await self._attempt(key_name, send, attempt, False)
+                return await self._hedged(key_name, send, attempt)
+            except Exception as e:
+                reason = self._retry_reason(e)
+                attempt += 1
+                if reason is None or attempt >= self.max_attempts:
+                    raise
+                # full jitter：在 [0, 退避上限] 内均匀取值，避免大量请求同时重试
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+                remaining = remaining_time()
+                if remaining is not None and remaining <= delay:
+                    raise
+                if not self.retry_budget.withdraw():
+                    DIFY_RETRIES.labels(key_name, "budget_exhausted").inc()
+                    raise
+                DIFY_RETRIES.labels(key_name, reason).inc()
+                await asyncio.sleep(delay)
+
+    async def _hedged(self, key_name: str, send: Callable[[float], Awaitable[httpx.Response]],
+                      attempt: int) -> httpx.Response:
+        delay = self.hedge_delay(key_name)
+        if delay is None:
+            return await self._attempt(key_name, send, attempt, False)
+        tasks = [asyncio.ensure_future(self._attempt(key_name, send, attempt, False))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return tasks[0].result()
+            remaining = remaining_time()
+            if (remaining is not None and remaining <= 0) or not self.retry_budget.withdraw():
+                DIFY_HEDGES.labels(key_name, "budget_exhausted").inc()
+                return await tasks[0]
+            DIFY_HEDGES.labels(key_name, "sent").inc()
+            tasks.append(asyncio.ensure_future(self._attempt(key_name, send, attempt, True)))
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        DIFY_HEDGES.labels(key_name, "hedge_won" if task is tasks[1] else "primary_won").inc()
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            # 取消仍在等待的一方；被取消的请求不计入熔断和耗时统计
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _attempt(self, key_name: str, send: Callable[[float], Awaitable[httpx.Response]],
+                       attempt: int, hedge: bool) -> httpx.Response:
+        """在隔离舱内执行一次请求，排队和等待响应都受截止时间约束。"""
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceededError(key_name)
+        queued_at = time.perf_counter()
+        with tracer.span("dify.attempt", app=key_name, attempt=attempt, hedge=hedge) as span:
+            try:
+                async with asyncio.timeout(remaining):
+                    async with self.guard(key_name) as timeout:
+                        span.set(queue_ms=round((time.perf_counter() - queued_at) * 1000, 3))
+                        response = await send(timeout)
+                        span.set(status=response.status_code)
+                        return response
+            except TimeoutError:
+                # asyncio.timeout 到期说明截止时间已到（httpx 的超时抛出的是 httpx.TimeoutException）
+                if remaining is None:
+                    raise
+                raise DeadlineExceededError(key_name) from None
+
+
+# 创建一个全局的 Dify 容错层实例
+dify_resilience = DifyResilience(
+    settings.DIFY_API_KEYS.keys(),
+    default_concurrency=settings.DIFY_PER_KEY_CONCURRENCY,
+    concurrency_overrides=parse_key_values(settings.DIFY_APP_CONCURRENCY),
+    max_queue=settings.DIFY_APP_MAX_QUEUE,
+    failure_threshold=settings.DIFY_BREAKER_FAILURES,
+    reset_timeout=settings.DIFY_BREAKER_RESET_SECONDS,
+    min_timeout=settings.DIFY_TIMEOUT_MIN,
+    max_timeout=settings.DIFY_TIMEOUT,
+    percentile=settings.DIFY_TIMEOUT_PERCENTILE,
+    multiplier=settings.DIFY_TIMEOUT_MULTIPLIER,
+    retry_budget=RetryBudget(settings.DIFY_RETRY_BUDGET_RATIO, settings.DIFY_RETRY_BUDGET_MIN_PER_SECOND),
+    max_attempts=settings.DIFY_RETRY_MAX_ATTEMPTS,
+    backoff_base=settings.DIFY_RETRY_BACKOFF_BASE,
+    backoff_max=settings.DIFY_RETRY_BACKOFF_MAX,
+    hedge_apps=[name.strip() for name in settings.DIFY_HEDGE_APPS.split(",") if name.strip()],
+    hedge_percentile=settings.DIFY_HEDGE_PERCENTILE,
+    hedge_min_delay=settings.DIFY_HEDGE_MIN_DELAY,
+    hedge_min_samples=settings.DIFY_HEDGE_MIN_SAMPLES,
+)
@@ -0,0 +1,123 @@
+import asyncio
+import base64
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from app.core.config import settings
+from app.core.tracing import tracer
+from app.models.schemas import NewResumeProfile
+from app.services.bulk_transform import transform_texts
+from app.services.chunked_parse import parse_chunks
+from app.services.clients import charge
+from app.services.pdf_cache import pdf_cache
+from app.services.pdf_extractor import ExtractedPDF
+from app.services.render_engine import render_engine, RenderQueueFullError
+
+# 需要润色的经历字段（键为 model_dump(by_alias=True) 中的字段名）
+POLISH_SECTIONS = ("internship_experience", "user_research_experience", "user_extracurricular_activities")
+
+# 流水线事件：(事件名, 数据)，事件名为 progress 或 done
+PipelineEvent = Tuple[str, Dict[str, Any]]
+
+
+class PipelineError(RuntimeError):
+    """流水线某一阶段失败，status_code 为应返回给客户端的状态码。"""
+
+    def __init__(self, stage: str, status_code: int, detail: str):
+        super().__init__(detail)
+        self.stage = stage
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _collect_points(profile: Dict[str, Any]) -> List[Tuple[str, int, int]]:
+    """返回所有描述要点的位置 (字段名, 经历序号, 要点序号)。"""
+    locations = []
+    for section in POLISH_SECTIONS:
+        for i, item in enumerate(profile.get(section) or []):
+            for j, point in enumerate(item.get("description_points") or []):
+                if point and point.strip():
+                    locations.append((section, i, j))
+    return locations
+
+
+async def run_resume_pipeline(extracted: ExtractedPDF, operation: str = 'rewrite',
+                              style: Optional[str] = None, user_uid: Optional[str] = None,
+                              concurrency: int = 8, chunks: Optional[List[str]] = None) -> AsyncIterator[PipelineEvent]:
+    """
+    简历导入流水线：提取文本（由调用方在请求内完成）→ Dify 解析为 NewResumeProfile
+    → 并发润色所有描述要点 → 渲染 PDF。每个阶段结束时产出一条 progress 事件，
+    润色阶段每完成一条要点产出一次进度，最后产出 done 事件携带简历数据和 base64 编码的 PDF。
+    operation 为 None 时跳过润色；chunks 为分段解析的分段（见 chunked_parse.chunk_upload），默认整篇解析。
+    某一阶段失败时抛出 PipelineError；润色前按要点数向当前调用方计费，超出限速（包括分段解析失败后退回整篇解析时）抛出 RateLimitedError。
+    """
+    timings: Dict[str, float] = {}
+    chunks = chunks or [extracted.text]
+    yield "progress", {"stage": "extract", "pages": extracted.page_count, "cached": extracted.cached,
+                       "chunks": len(chunks)}
+
+    # 解析
+    started = time.perf_counter()
+    with tracer.span("pipeline.parse", chars=len(extracted.text)):
+        parsed = await parse_chunks(chunks, extracted.text, settings.PARSE_CHUNK_CONCURRENCY)
+    if "error" in parsed:
+        raise PipelineError("parse", 502, parsed["error"])
+    if user_uid:
+        parsed["user_uid"] = user_uid
+    if style:
+        parsed["style"] = style
+    try:
+        profile = NewResumeProfile.model_validate(parsed)
+    except ValidationError as e:
+        raise PipelineError("parse", 502, f"解析结果不符合简历格式: {e}")
+    profile_data = profile.model_dump(by_alias=True)
+    timings["parse"] = time.perf_counter() - started
+    yield "progress", {"stage": "parse", "seconds": round(timings["parse"], 3)}
+
+    # 润色：所有要点并发发出，失败的要点保留原文
+    locations = _collect_points(profile_data) if operation else []
+    failed = 0
+    if locations:
+        # 每条要点是一次 Dify 调用，发出前按要点数计费
+        charge('llm', len(locations))
+        started = time.perf_counter()
+        started_ns = time.time_ns()
+        texts = [profile_data[s][i]["description_points"][j] for s, i, j in locations]
+        completed = 0
+        async for item in transform_texts(texts, operation, concurrency=concurrency):
+            completed += 1
+            if "result" in item:
+                section, i, j = locations[item["index"]]
+                profile_data[section][i]["description_points"][j] = item["result"].strip()
+            else:
+                failed += 1
+            yield "progress", {"stage": "polish", "completed": completed, "total": len(texts)}
+        profile = NewResumeProfile.model_validate(profile_data)
+        timings["polish"] = time.perf_counter() - started
+        # 润色阶段中间有多次 yield，结束后补记 Span
+        tracer.record("pipeline.polish", started_ns, time.time_ns(), points=len(texts), failed=failed)
+
+    # 渲染：与 /generate-resume/ 共用结果缓存
+    started = time.perf_counter()
+    cache_key = pdf_cache.key_for(profile)
+    try:
+        with tracer.span("pipeline.render"):
+            pdf_bytes = await pdf_cache.get_or_render(cache_key, lambda: render_engine.render(profile))
+    except RenderQueueFullError as e:
+        raise PipelineError("render", 503, str(e))
+    except asyncio.TimeoutError:
+        raise PipelineError("render", 504, "生成PDF超时，请稍后重试。")
+    except Exception as e:
+        raise PipelineError("render", 500, f"生成PDF时发生内部错误: {e}")
+    timings["render"] = time.perf_counter() - started
+    yield "progress", {"stage": "render", "seconds": round(timings["render"], 3), "size": len(pdf_bytes)}
+
+    yield "done", {
+        "profile": profile.model_dump(by_alias=True),
+        "pdf": base64.b64encode(pdf_bytes).decode(),
+        "etag": f'"{cache_key}"',
+        "polish": {"total": len(locations), "failed": failed},
+        "timings": {stage: round(seconds, 3) for stage, seconds in timings.items()},
+    }
@@ -0,0 +1,204 @@
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type, get_args, get_origin
+
+import orjson
+from pydantic import BaseModel, ValidationError
+
+from app.core.tracing import tracer
+from app.models.schemas import NewResumeProfile
+
+# ```json ... ``` 代码块；达到最大 token 数被截断时可能没有结尾的 ```
+_FENCE = re.compile(r"```[ \t]*(?:json|JSON)?[ \t]*\n?(.*?)(?:```|\Z)", re.S)
+_CLOSERS = {'{': '}', '[': ']'}
+# 截断修复时最多回退的次数（每次回退到上一个逗号）
+_MAX_REPAIR_STEPS = 64
+
+
+class StructuredOutputError(ValueError):
+    """无法从模型回答中提取出有效的 JSON。"""
+
+
+class _Scan:
+    """对 JSON 文本做一次词法扫描的结果（只识别字符串和括号，足以定位结构）。"""
+
+    def __init__(self, text: str):
+        self.stack: List[str] = []
+        self.in_string = False
+        self.escaped = False
+        self.end: Optional[int] = None       # 顶层值结束的位置（不含）
+        self.commas: List[int] = []          # 字符串之外的逗号位置
+        for i, ch in enumerate(text):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == '\\':
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+            if ch == '"':
+                self.in_string = True
+            elif ch in _CLOSERS:
+                self.stack.append(ch)
+            elif ch in '}]':
+                if self.stack:
+                    self.stack.pop()
+                if not self.stack:
+                    self.end = i + 1
+                    return
+            elif ch == ',':
+                self.commas.append(i)
+
+
+def _strip_trailing_commas(text: str) -> str:
+    """删除字符串之外、紧跟在 } 或 ] 之前的逗号。"""
+    out = []
+    in_string = escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == ',':
+            rest = text[i + 1:].lstrip()
+            if not rest or rest[0] in '}]':
+                continue
+        out.append(ch)
+    return "".join(out)
+
+
+def _close_truncated(text: str, scan: _Scan) -> str:
+    """补全被截断的 JSON：闭合字符串、补上缺失的值和括号。"""
+    if scan.in_string:
+        if scan.escaped:
+            text = text[:-1]
+        text += '"'
+    text = text.rstrip()
+    if text.endswith(':'):
+        text += ' null'
+    return text + "".join(_CLOSERS[ch] for ch in reversed(scan.stack))
+
+
+def _loads(text: str) -> Any:
+    return orjson.loads(text)
+
+
+def _repair(candidate: str) -> Any:
+    """截取第一个完整的 JSON 值并修复常见缺陷；仍无法解析时抛出 orjson.JSONDecodeError。"""
+    starts = [i for i in (candidate.find('{'), candidate.find('[')) if i != -1]
+    if not starts:
+        raise orjson.JSONDecodeError("no JSON object found", candidate, 0)
+    text = candidate[min(starts):]
+    scan = _Scan(text)
+    if scan.end is not None:
+        # 完整的值后面可能还有说明文字
+        return _loads(_strip_trailing_commas(text[:scan.end]))
+
+    # 被截断：先直接补全；失败说明最后一个成员不完整（如只有键名、数字写了一半），回退到上一个逗号再试
+    error: Optional[Exception] = None
+    for _ in range(_MAX_REPAIR_STEPS):
+        try:
+            return _loads(_strip_trailing_commas(_close_truncated(text, scan)))
+        except orjson.JSONDecodeError as e:
+            error = e
+        if not scan.commas:
+            break
+        text = text[:scan.commas[-1]]
+        scan = _Scan(text)
+    raise error
+
+
+def _candidates(answer: str) -> Iterator[str]:
+    stripped = answer.strip()
+    yield stripped
+    for match in _FENCE.finditer(stripped):
+        yield match.group(1).strip()
+
+
+def extract_json(answer: str) -> Any:
+    """
+    从模型回答中提取 JSON：依次尝试整段回答、```json 代码块以及夹杂在说明文字中的第一个 JSON 值，
+    并修复尾随逗号和因达到最大 token 数而截断的结构。无法提取时抛出 StructuredOutputError。
+    """
+    if not answer or not answer.strip():
+        raise StructuredOutputError("模型返回了空回答。")
+    with tracer.span("llm.extract_json", answer_chars=len(answer)) as span:
+        candidates = list(_candidates(answer))
+        for candidate in candidates:
+            try:
+                return _loads(candidate)
+            except orjson.JSONDecodeError:
+                pass
+        span.set(repaired=True)
+        for candidate in candidates:
+            try:
+                return _repair(candidate)
+            except orjson.JSONDecodeError:
+                pass
+        raise StructuredOutputError("模型返回的内容不是有效的 JSON。")
+
+
+def extract_json_object(answer: str) -> Dict[str, Any]:
+    """提取 JSON 并要求其为对象。"""
+    data = extract_json(answer)
+    if not isinstance(data, dict):
+        raise StructuredOutputError("模型返回的 JSON 不是对象。")
+    return data
+
+
+def _empty_value(annotation: Any) -> Any:
+    """必填字段缺失时使用的占位值。"""
+    origin = get_origin(annotation)
+    if origin in (list, List):
+        return []
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return {}
+    return ""
+
+
+def _item_model(annotation: Any) -> Optional[Type[BaseModel]]:
+    """List[Model] / Optional[List[Model]] / Model 中的模型类型。"""
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    for arg in get_args(annotation):
+        nested = _item_model(arg)
+        if nested is not None:
+            return nested
+    return None
+
+
+def _fill_required(model: Type[BaseModel], data: Dict[str, Any]) -> Dict[str, Any]:
+    """为缺失或为 null 的必填字段补上空值，并递归处理嵌套模型。"""
+    data = dict(data)
+    for name, field in model.model_fields.items():
+        key = field.alias or name
+        value = data.get(key)
+        if value is None:
+            if field.is_required():
+                data[key] = _empty_value(field.annotation)
+            continue
+        nested = _item_model(field.annotation)
+        if nested is None:
+            continue
+        if isinstance(value, list):
+            data[key] = [_fill_required(nested, item) if isinstance(item, dict) else item for item in value]
+        elif isinstance(value, dict):
+            data[key] = _fill_required(nested, value)
+    return data
+
+
+def validate_profile(data: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+    """
+    宽松地把解析结果校验为 NewResumeProfile：缺失的必填字段补空值，类型可转换的字段按模型转换。
+    返回 (结果, 是否通过校验)。模型之外的字段原样保留；无法通过校验时返回原始数据。
+    """
+    try:
+        profile = NewResumeProfile.model_validate(_fill_required(NewResumeProfile, data))
+    except ValidationError:
+        return data, False
+    return {**data, **profile.model_dump(by_alias=True, exclude={'style'})}, True
@@ -0,0 +1,231 @@
+import asyncio
+import hashlib
+import logging
+import os
+import posixpath
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 定义模板文件夹的路径 (相对于项目根目录)
+TEMPLATE_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', 'templates'))
+
+# 默认样式：templates/ 根目录下的 resume_template.html + style.css
+DEFAULT_STYLE = "default"
+DEFAULT_TEMPLATE = "resume_template.html"
+DEFAULT_STYLESHEET = "style.css"
+# 其他样式：templates/styles/<样式名>/style.css，可选 template.html（缺省时沿用默认模板）
+STYLES_DIR = "styles"
+# 所有样式共用的字体定义及字体文件
+SHARED_FILES = ("fonts.css",)
+SHARED_DIRS = ("fonts",)
+# HTML 预览中共用目录（字体文件）的访问路径，由 main.py 以静态文件挂载
+PREVIEW_ASSET_PATH = "/preview-assets/"
+# 样式表中的 url(...) 引用
+_CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+?)\1\s*\)""")
+
+
+class UnknownTemplateError(ValueError):
+    """请求的样式不存在。"""
+
+
+class TemplateSpec(NamedTuple):
+    name: str
+    template: str                  # 相对模板目录的 Jinja 模板名
+    stylesheets: Tuple[str, ...]   # 相对模板目录的样式表路径，按顺序应用
+    version: str                   # 模板、样式表和字体内容的指纹
+
+
+def _hash_file(digest, root: str, relpath: str) -> None:
+    digest.update(relpath.replace(os.sep, '/').encode())
+    with open(os.path.join(root, relpath), 'rb') as f:
+        digest.update(f.read())
+
+
+def _shared_digest(template_dir: str, subset_fonts: bool):
+    """所有样式共用部分（字体和影响输出的渲染选项）的摘要。"""
+    digest = hashlib.sha256()
+    for name in SHARED_FILES:
+        if os.path.isfile(os.path.join(template_dir, name)):
+            _hash_file(digest, template_dir, name)
+    for shared_dir in SHARED_DIRS:
+        for root, dirs, files in os.walk(os.path.join(template_dir, shared_dir)):
+            dirs.sort()
+            for name in sorted(files):
+                _hash_file(digest, template_dir, os.path.relpath(os.path.join(root, name), template_dir))
+    digest.update(f"subset_fonts={subset_fonts}".encode())
+    return digest
+
+
+def _make_spec(template_dir: str, shared, name: str, template: str, stylesheet: str) -> TemplateSpec:
+    stylesheets = tuple(f for f in SHARED_FILES if os.path.isfile(os.path.join(template_dir, f))) + (stylesheet,)
+    digest = shared.copy()
+    digest.update(name.encode())
+    _hash_file(digest, template_dir, template)
+    for path in stylesheets:
+        _hash_file(digest, template_dir, path)
+    return TemplateSpec(name, template, stylesheets, digest.hexdigest()[:16])
+
+
+def _absolute_urls(css: str, stylesheet: str, asset_base: str) -> str:
+    """
+    把样式表中相对其所在目录的 url() 改写为 asset_base 下的绝对路径，
+    内联到预览 HTML 后浏览器不会按 API 的地址解析；data:、带协议和以 / 开头的地址保持不变。
+    """
+    base_dir = posixpath.dirname(stylesheet)
+
+    def replace(match: re.Match) -> str:
+        quote, target = match.groups()
+        if target.startswith(("data:", "/", "#")) or "://" in target:
+            return match.group(0)
+        path = posixpath.normpath(posixpath.join(base_dir, target))
+        return f"url({quote}{asset_base}{path}{quote})"
+
+    return _CSS_URL.sub(replace, css)
+
+
+def discover_templates(template_dir: str = TEMPLATE_DIR,
+                       subset_fonts: bool = True) -> Dict[str, TemplateSpec]:
+    """扫描模板目录，返回 {样式名: TemplateSpec}。"""
+    shared = _shared_digest(template_dir, subset_fonts)
+    specs = {DEFAULT_STYLE: _make_spec(template_dir, shared, DEFAULT_STYLE, DEFAULT_TEMPLATE, DEFAULT_STYLESHEET)}
+
+    styles_root = os.path.join(template_dir, STYLES_DIR)
+    if os.path.isdir(styles_root):
+        for name in sorted(os.listdir(styles_root)):
+            style_dir = f"{STYLES_DIR}/{name}"
+            if not os.path.isfile(os.path.join(template_dir, style_dir, "style.css")):
+                continue
+            template = f"{style_dir}/template.html"
+            if not os.path.isfile(os.path.join(template_dir, template)):
+                template = DEFAULT_TEMPLATE
+            specs[name] = _make_spec(template_dir, shared, name, template, f"{style_dir}/style.css")
+    return specs
+
+
+class TemplateRegistry:
+    """
+    简历模板注册表：启动时发现 templates/ 下的所有样式，并为每个样式计算内容指纹。
+
+    指纹用于 PDF 缓存键，并随渲染任务一起发给工作进程；工作进程发现指纹与自己持有的
+    渲染上下文不一致时会重新加载该样式（见 pdf_generator.get_render_context）。
+    开启 TEMPLATE_HOT_RELOAD 后监听模板目录，文件变化时重新扫描，无需重启服务。
+    本模块不导入 WeasyPrint，主进程只需要样式列表和指纹，以及用于即时预览的 HTML。
+    """
+
+    def __init__(self, template_dir: str = TEMPLATE_DIR, subset_fonts: bool = True,
+                 hot_reload: bool = False, bytecode_dir: Optional[str] = None):
+        self.template_dir = template_dir
+        self.subset_fonts = subset_fonts
+        self.hot_reload = hot_reload
+        # 编译结果按模板源码校验，多个渲染进程共用同一目录，重启后的进程无需重新编译
+        bytecode_cache = None
+        if bytecode_dir:
+            os.makedirs(bytecode_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(bytecode_dir)
+        self.jinja_env = Environment(loader=FileSystemLoader(template_dir), bytecode_cache=bytecode_cache)
+        self._specs: Dict[str, TemplateSpec] = {}
+        # (样式指纹, 资源路径前缀) -> 内联后的 CSS 文本，供 HTML 预览使用
+        self._inline_css: Dict[Tuple[str, str], str] = {}
+        self._watcher: Optional[asyncio.Task] = None
+        self._stop: Optional[asyncio.Event] = None
+
+    def refresh(self) -> Dict[str, TemplateSpec]:
+        """重新扫描模板目录并返回最新的样式表。"""
+        self._specs = discover_templates(self.template_dir, self.subset_fonts)
+        versions = {spec.version for spec in self._specs.values()}
+        self._inline_css = {key: css for key, css in self._inline_css.items() if key[0] in versions}
+        return self._specs
+
+    @property
+    def specs(self) -> Dict[str, TemplateSpec]:
+        if not self._specs:
+            self.refresh()
+        return self._specs
+
+    def resolve(self, style: Optional[str] = None) -> TemplateSpec:
+        """按样式名查找模板，未指定时使用默认样式；不存在时抛出 UnknownTemplateError。"""
+        spec = self.specs.get(style or DEFAULT_STYLE)
+        if spec is None:
+            raise UnknownTemplateError(f"未知的简历样式: {style}，可用样式: {', '.join(self.specs)}")
+        return spec
+
+    def version(self, style: Optional[str] = None) -> str:
+        return self.resolve(style).version
+
+    def describe(self) -> List[Dict[str, object]]:
+        return [spec._asdict() for spec in self.specs.values()]
+
+    def _stylesheet_text(self, spec: TemplateSpec, asset_base: str) -> str:
+        css = self._inline_css.get((spec.version, asset_base))
+        if css is None:
+            parts = []
+            for path in spec.stylesheets:
+                with open(os.path.join(self.template_dir, path), encoding='utf-8') as f:
+                    parts.append(_absolute_urls(f.read(), path, asset_base))
+            css = self._inline_css[(spec.version, asset_base)] = "\n".join(parts)
+        return css
+
+    def render_html(self, profile_data: Dict[str, object], style: Optional[str] = None,
+                    asset_base: str = PREVIEW_ASSET_PATH) -> str:
+        """
+        渲染简历的 HTML，样式表以 <style> 内联，浏览器可直接展示，不经过 WeasyPrint 排版。
+        样式表中的字体等相对地址改写为 asset_base 下的绝对路径，预览与 PDF 使用同一份字体。
+        模板和样式表的读取结果按样式指纹缓存。会读取文件并执行 Jinja 渲染，应在线程池中调用。
+        """
+        spec = self.resolve(style)
+        html = self.jinja_env.get_template(spec.template).render(profile_data)
+        style_tag = f"<style>\n{self._stylesheet_text(spec, asset_base)}\n</style>\n"
+        head_end = html.find("</head>")
+        if head_end == -1:
+            return style_tag + html
+        return html[:head_end] + style_tag + html[head_end:]
+
+    async def startup(self) -> None:
+        """扫描模板目录，并在开启热加载时启动文件监听，在 FastAPI 启动时调用。"""
+        await run_in_threadpool(self.refresh)
+        if self.hot_reload and self._watcher is None:
+            self._stop = asyncio.Event()
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def shutdown(self) -> None:
+        """停止文件监听，在 FastAPI 关闭时调用。"""
+        if self._watcher is not None:
+            self._stop.set()
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    async def _watch(self) -> None:
+        try:
+            from watchfiles import awatch
+        except ImportError:
+            logger.warning("TEMPLATE_HOT_RELOAD 需要安装 watchfiles，模板热加载未启用。")
+            return
+        async for _ in awatch(self.template_dir, stop_event=self._stop):
+            try:
+                before = {name: spec.version for name, spec in self._specs.items()}
+                specs = await run_in_threadpool(self.refresh)
+                changed = sorted(name for name, spec in specs.items() if before.get(name) != spec.version)
+                if changed:
+                    logger.info("Templates reloaded: %s", ", ".join(changed))
+            except Exception:
+                # 文件写到一半时可能读取失败，等待下一次变化
+                logger.exception("Template reload failed")
+
+
+# 创建一个全局的模板注册表实例
+template_registry = TemplateRegistry(
+    subset_fonts=settings.RENDER_SUBSET_FONTS,
+    hot_reload=settings.TEMPLATE_HOT_RELOAD,
+    bytecode_dir=settings.TEMPLATE_BYTECODE_DIR or None,
+)
@@ -0,0 +1,78 @@
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.readiness import readiness
+from app.models.schemas import NewResumeProfile
+from app.services.pdf_cache import pdf_cache
+from app.services.pdf_extractor import pdf_extractor
+from app.services.render_engine import render_engine
+from app.services.template_registry import template_registry
+
+# 后台预热的组件，全部完成后 /ready 才返回就绪
+WARMUP_COMPONENTS = ("render_engine", "pdf_extractor", "pdf_cache", "preview_html")
+
+# 预热用的样例简历：包含中文和各类经历，确保字体和模板的各个分支都被加载
+SAMPLE_PROFILE = NewResumeProfile.model_validate({
+    "user_uid": "warm-up",
+    "user_name": "张三",
+    "user_contact_info": {"phone": "13800000000", "email": "warmup@example.com"},
+    "user_education": [{
+        "user_university": "示例大学",
+        "user_major": "计算机科学与技术",
+        "degree": "本科",
+        "dates": "2019.09 - 2023.06",
+        "user_gpa": "3.8/4.0",
+    }],
+    "internship_experience": [{
+        "company": "示例公司",
+        "role": "后端开发实习生",
+        "location": "北京",
+        "dates": "2022.06 - 2022.09",
+        "description_points": ["负责接口设计与性能优化。", "Built data pipelines in Python."],
+    }],
+    "user_research_experience": [{
+        "research project": "示例研究项目",
+        "role": "研究助理",
+        "dates": "2021.09 - 2022.06",
+        "description_points": ["设计实验并分析数据。"],
+    }],
+    "user_extracurricular_activities": [{
+        "organization": "学生会",
+        "role": "部长",
+        "dates": "2020.09 - 2021.06",
+        "description_points": ["组织校园活动。"],
+    }],
+    "user_target": "后端开发工程师",
+})
+
+
+async def _warm(name: str, step: Callable[[], Awaitable[None]]) -> None:
+    started = time.perf_counter()
+    try:
+        await step()
+    except Exception as e:
+        readiness.mark_failed(name, e)
+        print(f"Warm-up of {name} failed: {e}")
+    else:
+        readiness.mark_ready(name, time.perf_counter() - started)
+
+
+async def warm_up(enabled: bool = True) -> None:
+    """
+    后台预热：在每个渲染进程中渲染样例简历、提取一份样例PDF、统计PDF缓存磁盘占用、
+    渲染一次预览 HTML。未开启时直接标记为就绪（首个请求承担冷启动开销）。
+    """
+    if not enabled:
+        for name in WARMUP_COMPONENTS:
+            readiness.mark_ready(name)
+        return
+    await asyncio.gather(
+        _warm("render_engine", lambda: render_engine.warm_up(SAMPLE_PROFILE)),
+        _warm("pdf_extractor", pdf_extractor.warm_up),
+        _warm("pdf_cache", pdf_cache.warm_up),
+        _warm("preview_html", lambda: run_in_threadpool(
+            template_registry.render_html, SAMPLE_PROFILE.model_dump(by_alias=True))),
+    )
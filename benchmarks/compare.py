@@ -0,0 +1,73 @@
+"""
+比较两次基准测试的结果，列出各场景 p50/p95/p99 和吞吐量的变化。
+任一场景的 p95 变慢超过阈值（或吞吐量下降超过阈值）时以退出码 1 结束，可用于 CI。
+
+用法:
+    python -m benchmarks.compare benchmarks/results/load-abc1234-....json benchmarks/results/load-def5678-....json
+    python -m benchmarks.compare base.json new.json --threshold 0.15
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, Optional
+
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def _change(old: Optional[float], new: Optional[float]) -> Optional[float]:
+    if old in (None, 0) or new is None:
+        return None
+    return (new - old) / old
+
+
+def _fmt(change: Optional[float]) -> str:
+    return "     n/a" if change is None else f"{change * 100:+7.1f}%"
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], threshold: float) -> int:
+    """打印对比表并返回回退的场景数。"""
+    print(f"base: {base.get('commit')} ({base.get('created_at')})")
+    print(f"new:  {new.get('commit')} ({new.get('created_at')})")
+    print(f"{'case':32s} {'p50':>8s} {'p95':>8s} {'p99':>8s} {'rps':>8s}")
+
+    regressions = 0
+    for name, new_case in new["cases"].items():
+        old_case = base["cases"].get(name)
+        if old_case is None:
+            print(f"{name:32s} (新增)")
+            continue
+        changes = [_change(old_case.get(key), new_case.get(key)) for key in LATENCY_KEYS]
+        throughput = _change(old_case.get("throughput_rps"), new_case.get("throughput_rps"))
+        regressed = (changes[1] is not None and changes[1] > threshold) or \
+                    (throughput is not None and throughput < -threshold)
+        regressions += regressed
+        marker = "  << 回退" if regressed else ""
+        print(f"{name:32s} {' '.join(_fmt(c) for c in changes)} {_fmt(throughput)}{marker}")
+
+    for name in base["cases"].keys() - new["cases"].keys():
+        print(f"{name:32s} (已移除)")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="比较两次基准测试结果")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.10, help="判定为回退的相对变化，默认 10%%")
+    args = parser.parse_args()
+
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    if base.get("kind") != new.get("kind"):
+        raise SystemExit(f"结果类型不同: {base.get('kind')} vs {new.get('kind')}")
+
+    regressions = compare(base, new, args.threshold)
+    if regressions:
+        print(f"{regressions} 个场景超过 {args.threshold:.0%} 阈值")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+本地 Dify 替身：模拟 /v1/chat-messages 的 blocking 和 streaming 两种模式，
+用于在没有真实 Dify 的环境中压测本服务。
+
+应用按 API 密钥区分：密钥 fake-<应用名>（例如 fake-parse）对应 parse 应用，
+压测脚本会用这种密钥启动被测服务。
+
+用法:
+    python -m benchmarks.fake_dify --port 8681 --latency-ms 800 --latency-dist lognormal \\
+        --error-rate 0.01 --app-latency-ms parse=3000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from benchmarks.synthetic import make_profile
+
+KEY_PREFIX = "fake-"
+DIFY_APPS = ("parse", "rewrite", "expand", "contract", "process_text",
+             "personal_statement", "recommendation", "prompt_based")
+
+
+def _fenced(data: Dict[str, Any]) -> str:
+    # 真实的 Dify 应用经常把 JSON 包在 ```json 代码块里，这里保持一致
+    return "```json\n" + json.dumps(data, ensure_ascii=False) + "\n```"
+
+
+DEFAULT_ANSWERS: Dict[str, str] = {
+    "parse": _fenced(make_profile(1)),
+    "personal_statement": _fenced({"title": "个人陈述", "content": "这是一段用于压测的个人陈述。" * 20}),
+    "recommendation": _fenced({"title": "推荐信", "content": "这是一段用于压测的推荐信。" * 20}),
+    "default": "这是一段用于压测的改写结果，长度与真实返回大致相当。" * 6,
+}
+
+
+def _parse_overrides(spec: str) -> Dict[str, float]:
+    result = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        result[name.strip()] = float(value)
+    return result
+
+
+def service_env(dify_url: str, api_key: str) -> Dict[str, str]:
+    """被测服务指向 Dify 替身时需要的环境变量。"""
+    env = {"API_KEY": api_key, "DIFY_API_URL": f"{dify_url}/v1/chat-messages"}
+    env.update({f"DIFY_API_KEY_{name.upper()}": f"{KEY_PREFIX}{name}" for name in DIFY_APPS})
+    return env
+
+
+class FakeDify:
+    """按配置生成延迟、错误和固定回答。"""
+
+    def __init__(self, latency_ms: float, latency_dist: str, spread: float,
+                 app_latency_ms: Dict[str, float], error_rate: float, error_status: int,
+                 answers: Dict[str, str], stream_chunks: int, seed: Optional[int]):
+        self.latency_ms = latency_ms
+        self.latency_dist = latency_dist
+        self.spread = spread
+        self.app_latency_ms = app_latency_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.answers = answers
+        self.stream_chunks = max(1, stream_chunks)
+        self.rng = random.Random(seed)
+        self.requests = 0
+
+    def app_for(self, request: Request) -> str:
+        token = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+        return token[len(KEY_PREFIX):] if token.startswith(KEY_PREFIX) else "default"
+
+    def latency(self, app: str) -> float:
+        """返回一次请求的延迟（秒）。latency_ms 为中位数，spread 控制离散程度。"""
+        median = self.app_latency_ms.get(app, self.latency_ms) / 1000
+        if self.latency_dist == "fixed":
+            return median
+        if self.latency_dist == "uniform":
+            return max(0.0, self.rng.uniform(median * (1 - self.spread), median * (1 + self.spread)))
+        # lognormal：长尾分布，更接近 LLM 的真实耗时
+        return median * self.rng.lognormvariate(0, self.spread)
+
+    def answer(self, app: str) -> str:
+        return self.answers.get(app) or self.answers["default"]
+
+    def should_fail(self) -> bool:
+        return self.rng.random() < self.error_rate
+
+
+def create_app(fake: FakeDify) -> FastAPI:
+    app = FastAPI(title="Fake Dify")
+
+    @app.post("/v1/chat-messages")
+    async def chat_messages(request: Request):
+        fake.requests += 1
+        payload = await request.json()
+        name = fake.app_for(request)
+        delay = fake.latency(name)
+        conversation_id = payload.get("conversation_id") or str(uuid.uuid4())
+        message_id = str(uuid.uuid4())
+
+        if fake.should_fail():
+            await asyncio.sleep(delay / 2)
+            return JSONResponse(status_code=fake.error_status,
+                                content={"code": "fake_error", "message": "injected failure"})
+
+        answer = fake.answer(name)
+        if payload.get("response_mode") != "streaming":
+            await asyncio.sleep(delay)
+            return JSONResponse(content={
+                "event": "message",
+                "message_id": message_id,
+                "conversation_id": conversation_id,
+                "mode": "advanced-chat",
+                "answer": answer,
+                "metadata": {"usage": {"total_tokens": len(answer)}},
+                "created_at": int(time.time()),
+            })
+
+        async def events():
+            step = -(-len(answer) // fake.stream_chunks)
+            pause = delay / fake.stream_chunks
+            for start in range(0, len(answer), step):
+                await asyncio.sleep(pause)
+                event = {"event": "message", "message_id": message_id,
+                         "conversation_id": conversation_id, "answer": answer[start:start + step]}
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+            end = {"event": "message_end", "message_id": message_id, "conversation_id": conversation_id}
+            yield f"data: {json.dumps(end)}\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": fake.requests}
+
+    return app
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="本地 Dify 替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8681)
+    parser.add_argument("--latency-ms", type=float, default=800, help="延迟中位数（毫秒）")
+    parser.add_argument("--latency-dist", choices=("fixed", "uniform", "lognormal"), default="lognormal")
+    parser.add_argument("--latency-spread", type=float, default=0.5,
+                        help="uniform 为相对中位数的浮动比例，lognormal 为 sigma")
+    parser.add_argument("--app-latency-ms", default="", help="按应用覆盖延迟中位数，例如 parse=3000,rewrite=600")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入错误的比例（0-1）")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--answers", help="JSON 文件，{应用名: 回答文本}，覆盖默认回答")
+    parser.add_argument("--stream-chunks", type=int, default=20, help="streaming 模式下回答被拆成的事件数")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser
+
+
+def fake_from_args(args: argparse.Namespace) -> FakeDify:
+    answers = dict(DEFAULT_ANSWERS)
+    if args.answers:
+        with open(args.answers, encoding="utf-8") as f:
+            answers.update(json.load(f))
+    return FakeDify(
+        latency_ms=args.latency_ms,
+        latency_dist=args.latency_dist,
+        spread=args.latency_spread,
+        app_latency_ms=_parse_overrides(args.app_latency_ms),
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        answers=answers,
+        stream_chunks=args.stream_chunks,
+        seed=args.seed,
+    )
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+    uvicorn.run(create_app(fake_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
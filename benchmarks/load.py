@@ -0,0 +1,296 @@
+"""
+压测脚本：以固定并发依次压测 app/api/routes.py 中的每个路由，输出吞吐量和 p50/p95/p99。
+
+默认会自动启动本地 Dify 替身（benchmarks.fake_dify）和被测服务（uvicorn main:app），
+结果写入 benchmarks/results/load-<提交号>-<时间>.json。
+
+用法:
+    python -m benchmarks.load --concurrency 16 --requests 200
+    python -m benchmarks.load --scenarios rewrite-text,rewrite-text/stream --dify-latency-ms 1500
+    python -m benchmarks.load --api-url http://127.0.0.1:8000 --api-key xxx   # 压测已启动的服务
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+import httpx
+
+from benchmarks.fake_dify import service_env
+from benchmarks.results import REPO_ROOT, summarize, write_results
+from benchmarks.synthetic import make_pdf, make_profile, make_resume_text
+
+# 每个场景执行一次请求；成功时返回首字节耗时（秒，仅流式场景）或 None，失败时抛出异常
+Scenario = Callable[[httpx.AsyncClient, "Fixtures"], Awaitable[Optional[float]]]
+
+
+class Fixtures:
+    """所有场景共用的请求体，启动前生成一次。"""
+
+    def __init__(self, profile_size: int, batch_size: int, pdf_pages: int, bulk_texts: int):
+        self.profile = make_profile(profile_size)
+        self.batch = [dict(make_profile(profile_size), user_uid=f"bench-{i}") for i in range(batch_size)]
+        self.pdf = make_pdf(pdf_pages)
+        self.text = make_resume_text()
+        self.bulk = [make_resume_text(2, seed=i) for i in range(bulk_texts)]
+
+
+def _check(response: httpx.Response) -> None:
+    if response.status_code >= 400:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+
+
+def _post_json(path: str, body: Callable[[Fixtures], Any]) -> Scenario:
+    async def run(client: httpx.AsyncClient, fx: Fixtures) -> None:
+        _check(await client.post(path, json=body(fx)))
+    return run
+
+
+def _get(path: str) -> Scenario:
+    async def run(client: httpx.AsyncClient, fx: Fixtures) -> None:
+        _check(await client.get(path))
+    return run
+
+
+def _upload(path: str) -> Scenario:
+    async def run(client: httpx.AsyncClient, fx: Fixtures) -> None:
+        _check(await client.post(path, files={"file": ("resume.pdf", fx.pdf, "application/pdf")}))
+    return run
+
+
+def _stream(path: str, body: Callable[[Fixtures], Any]) -> Scenario:
+    """流式接口：读完整个响应，同时返回首字节耗时。"""
+    async def run(client: httpx.AsyncClient, fx: Fixtures) -> float:
+        started = time.perf_counter()
+        first: Optional[float] = None
+        received = bytearray()
+        async with client.stream("POST", path, json=body(fx)) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                _check(response)
+            async for chunk in response.aiter_bytes():
+                if first is None and chunk:
+                    first = time.perf_counter() - started
+                received += chunk
+        # 出错时最后一个事件是 error，正常结束时是 done
+        last_event = received[received.rfind(b"event: "):].split(b"\n", 1)[0]
+        if last_event != b"event: done":
+            raise RuntimeError(f"stream did not finish with a done event: {bytes(received[-200:])!r}")
+        return first if first is not None else time.perf_counter() - started
+    return run
+
+
+async def _wait_for_job(client: httpx.AsyncClient, job_id: str, poll_interval: float = 0.05) -> None:
+    while True:
+        response = await client.get(f"/jobs/{job_id}")
+        _check(response)
+        status = response.json()["status"]
+        if status == "succeeded":
+            _check(await client.get(f"/jobs/{job_id}/result"))
+            return
+        if status == "failed":
+            raise RuntimeError(f"job failed: {response.json().get('error')}")
+        await asyncio.sleep(poll_interval)
+
+
+def _job(operation: str, body: Callable[[Fixtures], Any]) -> Scenario:
+    """异步任务：计时范围为提交到下载结果。"""
+    async def run(client: httpx.AsyncClient, fx: Fixtures) -> None:
+        response = await client.post("/jobs/", json={"operation": operation, "payload": body(fx)})
+        _check(response)
+        await _wait_for_job(client, response.json()["job_id"])
+    return run
+
+
+async def _job_upload(client: httpx.AsyncClient, fx: Fixtures) -> None:
+    response = await client.post("/jobs/parse-resume/", files={"file": ("resume.pdf", fx.pdf, "application/pdf")})
+    _check(response)
+    await _wait_for_job(client, response.json()["job_id"])
+
+
+def _text(fx: Fixtures) -> Dict[str, str]:
+    return {"text": fx.text}
+
+
+def _prompt(fx: Fixtures) -> Dict[str, str]:
+    return {"text": fx.text, "prompt": "请用更正式的语气改写"}
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    "generate-resume": _post_json("/generate-resume/", lambda fx: fx.profile),
+    "generate-resume/batch": _post_json("/generate-resume/batch/", lambda fx: fx.batch),
+    "parse-resume": _upload("/parse-resume/"),
+    "parse-resume-text": _post_json("/parse-resume-text/", _text),
+    "rewrite-text": _post_json("/rewrite-text/", _text),
+    "expand-text": _post_json("/expand-text/", _text),
+    "contract-text": _post_json("/contract-text/", _text),
+    "process_json_to_text": _post_json("/process_json_to_text/", lambda fx: {"text": json.dumps(fx.profile)}),
+    "generate_statement": _post_json("/generate_statement/", _text),
+    "generate_recommendation": _post_json("/generate_recommendation/", _text),
+    "rewrite_prompt": _post_json("/rewrite_prompt/", _prompt),
+    "bulk-transform": _post_json("/bulk-transform/", lambda fx: {"texts": fx.bulk, "operation": "rewrite"}),
+    "rewrite-text/stream": _stream("/rewrite-text/stream", _text),
+    "expand-text/stream": _stream("/expand-text/stream", _text),
+    "contract-text/stream": _stream("/contract-text/stream", _text),
+    "rewrite_prompt/stream": _stream("/rewrite_prompt/stream", _prompt),
+    "generate_statement/stream": _stream("/generate_statement/stream", _text),
+    "jobs/rewrite": _job("rewrite", _text),
+    "jobs/render": _job("render", lambda fx: fx.profile),
+    "jobs/parse-resume": _job_upload,
+    "cache/stats": _get("/cache/stats/"),
+    "dify/status": _get("/dify/status/"),
+}
+
+
+async def run_scenario(client: httpx.AsyncClient, fx: Fixtures, scenario: Scenario,
+                       requests: int, concurrency: int, warmup: int) -> Dict[str, Any]:
+    """先执行 warmup 次不计入结果的请求，再以固定并发执行 requests 次。"""
+    for _ in range(warmup):
+        try:
+            await scenario(client, fx)
+        except Exception:
+            pass
+
+    latencies: List[float] = []
+    first_bytes: List[float] = []
+    errors: List[str] = []
+    remaining = iter(range(requests))
+
+    async def worker() -> None:
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                ttfb = await scenario(client, fx)
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            latencies.append(time.perf_counter() - started)
+            if ttfb is not None:
+                first_bytes.append(ttfb)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result = summarize(latencies, time.perf_counter() - started, len(errors))
+    if first_bytes:
+        ttfb = summarize(first_bytes, 1)
+        result.update({f"ttfb_{k}": ttfb[k] for k in ("p50_ms", "p95_ms", "p99_ms")})
+    if errors:
+        result["sample_errors"] = sorted(set(errors))[:5]
+    return result
+
+
+def _wait_until_up(url: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} 在 {timeout} 秒内没有启动")
+
+
+@contextmanager
+def _process(args: List[str], env: Dict[str, str], health_url: str) -> Iterator[None]:
+    proc = subprocess.Popen(args, cwd=REPO_ROOT, env=env)
+    try:
+        _wait_until_up(health_url)
+        yield
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+@contextmanager
+def _local_stack(args: argparse.Namespace) -> Iterator[str]:
+    """启动 Dify 替身和被测服务，返回被测服务的地址。"""
+    fake_url = f"http://127.0.0.1:{args.dify_port}"
+    fake_cmd = [
+        sys.executable, "-m", "benchmarks.fake_dify", "--port", str(args.dify_port),
+        "--latency-ms", str(args.dify_latency_ms), "--latency-dist", args.dify_latency_dist,
+        "--error-rate", str(args.dify_error_rate), "--seed", "1",
+    ]
+    api_url = f"http://127.0.0.1:{args.api_port}"
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.update(service_env(fake_url, args.api_key))
+        env.update({
+            # 默认关闭缓存，测的是真实处理耗时；需要时可用 --env 打开
+            "PDF_CACHE_ENABLED": "false",
+            "DIFY_CACHE_ENABLED": "false",
+            "JOB_DB_PATH": os.path.join(tmp, "jobs.sqlite3"),
+        })
+        env.update(dict(item.split("=", 1) for item in args.env))
+        api_cmd = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.api_port),
+                   "--log-level", "warning"]
+        with _process(fake_cmd, env, f"{fake_url}/stats"), _process(api_cmd, env, f"{api_url}/"):
+            yield api_url
+
+
+async def run_all(api_url: str, args: argparse.Namespace, names: List[str]) -> Dict[str, Dict[str, Any]]:
+    fx = Fixtures(args.profile_size, args.batch_size, args.pdf_pages, args.bulk_texts)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=api_url, headers={"X-API-Key": args.api_key},
+                                 timeout=args.timeout, limits=limits) as client:
+        cases = {}
+        for name in names:
+            cases[name] = await run_scenario(client, fx, SCENARIOS[name],
+                                             args.requests, args.concurrency, args.warmup)
+            case = cases[name]
+            print(f"{name:28s} {case['throughput_rps'] or 0:9.2f} req/s  "
+                  f"p50 {case['p50_ms'] or 0:9.1f} ms  p95 {case['p95_ms'] or 0:9.1f} ms  "
+                  f"p99 {case['p99_ms'] or 0:9.1f} ms  errors {case['errors']}")
+        return cases
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="按路由压测 Resume API")
+    parser.add_argument("--scenarios", default="", help=f"逗号分隔，默认全部: {','.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="每个场景的请求数")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--profile-size", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=5)
+    parser.add_argument("--pdf-pages", type=int, default=2)
+    parser.add_argument("--bulk-texts", type=int, default=10)
+    parser.add_argument("--api-url", help="压测已启动的服务；不指定时自动启动本地服务和 Dify 替身")
+    parser.add_argument("--api-key", default="bench-key")
+    parser.add_argument("--api-port", type=int, default=8700)
+    parser.add_argument("--dify-port", type=int, default=8681)
+    parser.add_argument("--dify-latency-ms", type=float, default=200)
+    parser.add_argument("--dify-latency-dist", default="lognormal")
+    parser.add_argument("--dify-error-rate", type=float, default=0.0)
+    parser.add_argument("--env", action="append", default=[], help="传给被测服务的环境变量，KEY=VALUE，可重复")
+    parser.add_argument("--output", help="结果文件路径")
+    return parser
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+    names = [name for name in args.scenarios.split(",") if name] or list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"未知场景: {', '.join(sorted(unknown))}")
+
+    if args.api_url:
+        cases = asyncio.run(run_all(args.api_url, args, names))
+    else:
+        with _local_stack(args) as api_url:
+            cases = asyncio.run(run_all(api_url, args, names))
+
+    params = {key: value for key, value in vars(args).items() if key not in ("api_key", "output")}
+    print(f"结果已写入 {write_results('load', params, cases, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+微基准：
+- create_resume_pdf 在不同规模的简历数据上的耗时，按 jinja / layout / write_pdf 阶段拆分，并记录输出大小；
+- PyMuPDF 在不同页数的PDF上的文本提取耗时（单进程，对应 pdf_extractor 的串行路径）。
+
+用法:
+    python -m benchmarks.micro --repeat 20
+    python -m benchmarks.micro --only extract --pages 1,10,50
+"""
+import argparse
+import os
+import statistics
+import time
+from typing import Any, Dict, List
+
+from benchmarks.fake_dify import service_env
+from benchmarks.results import summarize, write_results
+from benchmarks.synthetic import make_pdf, make_profile
+
+
+def _parse_sizes(spec: str) -> List[int]:
+    return [int(item) for item in spec.split(",") if item]
+
+
+def bench_render(sizes: List[int], repeat: int, warmup: int) -> Dict[str, Dict[str, Any]]:
+    # 导入 app 模块时会校验 Dify 配置；渲染用不到 Dify，缺少时补上占位值
+    for key, value in service_env("http://127.0.0.1:8681", "bench-key").items():
+        os.environ.setdefault(key, value)
+    from app.models.schemas import NewResumeProfile
+    from app.services.pdf_generator import create_resume_pdf
+
+    cases = {}
+    for size in sizes:
+        profile = NewResumeProfile.model_validate(make_profile(size))
+        for _ in range(warmup):
+            create_resume_pdf(profile)
+
+        latencies: List[float] = []
+        phases: Dict[str, List[float]] = {}
+        pdf_size = 0
+        started = time.perf_counter()
+        for _ in range(repeat):
+            timings: Dict[str, float] = {}
+            began = time.perf_counter()
+            pdf_size = len(create_resume_pdf(profile, timings))
+            latencies.append(time.perf_counter() - began)
+            for phase, seconds in timings.items():
+                phases.setdefault(phase, []).append(seconds)
+
+        case = summarize(latencies, time.perf_counter() - started)
+        case["pdf_bytes"] = pdf_size
+        case["phases_median_ms"] = {
+            phase: round(statistics.median(values) * 1000, 3) for phase, values in phases.items()
+        }
+        cases[f"render/size={size}"] = case
+        print(f"render size={size:<3d} p50 {case['p50_ms']:8.1f} ms  {case['phases_median_ms']}  {pdf_size} B")
+    return cases
+
+
+def bench_extract(pages: List[int], repeat: int, warmup: int) -> Dict[str, Dict[str, Any]]:
+    import fitz  # PyMuPDF
+
+    def extract(pdf_bytes: bytes) -> str:
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            return "".join(page.get_text() for page in doc)
+
+    cases = {}
+    for count in pages:
+        pdf_bytes = make_pdf(count)
+        for _ in range(warmup):
+            extract(pdf_bytes)
+
+        latencies: List[float] = []
+        started = time.perf_counter()
+        for _ in range(repeat):
+            began = time.perf_counter()
+            extract(pdf_bytes)
+            latencies.append(time.perf_counter() - began)
+
+        case = summarize(latencies, time.perf_counter() - started)
+        case["pdf_bytes"] = len(pdf_bytes)
+        case["per_page_ms"] = round(statistics.median(latencies) * 1000 / count, 3)
+        cases[f"extract/pages={count}"] = case
+        print(f"extract pages={count:<4d} p50 {case['p50_ms']:8.1f} ms  {case['per_page_ms']} ms/page")
+    return cases
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="PDF 渲染与提取微基准")
+    parser.add_argument("--only", choices=("render", "extract"))
+    parser.add_argument("--sizes", default="1,3,6,12", help="简历规模（经历条数）")
+    parser.add_argument("--pages", default="1,5,20,100", help="PDF 页数")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--output", help="结果文件路径")
+    args = parser.parse_args()
+
+    cases: Dict[str, Dict[str, Any]] = {}
+    if args.only in (None, "render"):
+        cases.update(bench_render(_parse_sizes(args.sizes), args.repeat, args.warmup))
+    if args.only in (None, "extract"):
+        cases.update(bench_extract(_parse_sizes(args.pages), args.repeat, args.warmup))
+
+    params = {key: value for key, value in vars(args).items() if key != "output"}
+    print(f"结果已写入 {write_results('micro', params, cases, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+基准测试用的合成数据：不同规模的简历数据和多页PDF，保证每次运行输入一致。
+"""
+import random
+from typing import Any, Dict, List
+
+# 固定随机种子，不同提交之间的结果才可比
+SEED = 20240601
+
+_WORDS = (
+    "负责 设计 实现 优化 分析 数据 模型 系统 平台 用户 增长 性能 方案 项目 团队 "
+    "协调 推动 上线 指标 提升 降低 成本 自动化 报告 调研 实验 策略 产品 运营 研究"
+).split()
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return "".join(rng.choice(_WORDS) for _ in range(words)) + "。"
+
+
+def make_profile(size: int, seed: int = SEED) -> Dict[str, Any]:
+    """
+    生成一份简历数据（NewResumeProfile 的 JSON 形式）。
+    size 控制各类经历的条数，每条经历包含 size + 2 个描述要点。
+    """
+    rng = random.Random(seed + size)
+
+    def points() -> List[str]:
+        return [_sentence(rng, rng.randint(8, 20)) for _ in range(size + 2)]
+
+    return {
+        "user_uid": f"bench-{size}",
+        "user_name": "张三",
+        "user_contact_info": {"phone": "13800000000", "email": "bench@example.com"},
+        "user_education": [
+            {
+                "user_university": f"示例大学{i}",
+                "user_major": "计算机科学与技术",
+                "degree": "本科",
+                "dates": "2019.09 - 2023.06",
+                "user_gpa": "3.8/4.0",
+                "details": _sentence(rng, 12),
+            }
+            for i in range(max(1, size // 2))
+        ],
+        "internship_experience": [
+            {
+                "company": f"示例公司{i}",
+                "role": "后端开发实习生",
+                "location": "北京",
+                "dates": "2022.06 - 2022.09",
+                "description_points": points(),
+            }
+            for i in range(size)
+        ],
+        "user_research_experience": [
+            {
+                "research project": f"示例课题{i}",
+                "role": "研究助理",
+                "dates": "2021.03 - 2021.12",
+                "description_points": points(),
+            }
+            for i in range(size // 2)
+        ],
+        "user_extracurricular_activities": [
+            {
+                "organization": f"示例社团{i}",
+                "role": "负责人",
+                "dates": "2020.09 - 2021.06",
+                "description_points": points(),
+            }
+            for i in range(size // 2)
+        ],
+        "user_target": "软件工程师",
+    }
+
+
+def make_resume_text(paragraphs: int = 6, seed: int = SEED) -> str:
+    """生成一段简历纯文本，用作文本类接口的请求体。"""
+    rng = random.Random(seed + paragraphs)
+    return "\n".join(_sentence(rng, rng.randint(20, 40)) for _ in range(paragraphs))
+
+
+def make_pdf(pages: int, lines_per_page: int = 40, seed: int = SEED) -> bytes:
+    """用 PyMuPDF 生成指定页数的文本PDF。"""
+    import fitz  # PyMuPDF
+
+    rng = random.Random(seed + pages)
+    doc = fitz.open()
+    try:
+        for _ in range(pages):
+            page = doc.new_page()
+            text = "\n".join(
+                " ".join(rng.choice(("experience", "project", "python", "design", "data",
+                                     "optimize", "system", "team", "result", "research"))
+                         for _ in range(10))
+                for _ in range(lines_per_page)
+            )
+            page.insert_textbox(fitz.Rect(40, 40, 560, 800), text, fontsize=9)
+        return doc.tobytes()
+    finally:
+        doc.close()
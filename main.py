@@ -1,14 +1,78 @@
+import asyncio
+import math
 import os
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.staticfiles import StaticFiles
 from app.api import routes
+from app.core.config import settings
+from app.core.compression import CompressionMiddleware
+from app.core.metrics import CONTENT_TYPE_LATEST, MetricsMiddleware, render_latest
+from app.core.readiness import readiness
+from app.core.tracing import TracingMiddleware, TRACE_ID_HEADER, tracer
+from app.services.dify_client import dify_client, DifyCallError
+from app.services.render_engine import render_engine
+from app.services.template_registry import template_registry, PREVIEW_ASSET_PATH, SHARED_DIRS
+from app.services.pdf_extractor import pdf_extractor, UploadLimitMiddleware
+from app.services.job_queue import job_queue
+from app.services.resilience import DifyUnavailableError, DeadlineExceededError
+from app.services.warmup import warm_up, WARMUP_COMPONENTS
+from app.services.idempotency import IdempotencyMiddleware
+from app.services.clients import RateLimitedError
 from dotenv import load_dotenv
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    应用生命周期：启动时打开 Dify 连接池、扫描简历模板、PDF 渲染和文本提取进程池以及异步任务队列，关闭时释放。
+    进程池等组件在后台预热，完成后 /ready 才返回就绪。
+    """
+    readiness.expect("dify_pool", "templates", "job_queue", *WARMUP_COMPONENTS)
+    await tracer.startup()
+    await dify_client.startup()
+    readiness.mark_ready("dify_pool")
+    await template_registry.startup()
+    readiness.mark_ready("templates")
+    render_engine.startup()
+    pdf_extractor.startup()
+    await job_queue.startup()
+    readiness.mark_ready("job_queue")
+    warmup_task = asyncio.create_task(warm_up(settings.WARMUP_ENABLED))
+    try:
+        yield
+    finally:
+        readiness.drain()
+        warmup_task.cancel()
+        await asyncio.gather(warmup_task, return_exceptions=True)
+        await job_queue.shutdown()
+        pdf_extractor.shutdown()
+        render_engine.shutdown()
+        await template_registry.shutdown()
+        await dify_client.shutdown()
+        await tracer.shutdown()
+
+
 app = FastAPI(
     title="简历与文本处理API (重构版)",
-    description="一个结构清晰、模块化的API服务，提供简历生成与文本处理功能。"
+    description="一个结构清晰、模块化的API服务，提供简历生成与文本处理功能。",
+    lifespan=lifespan,
+    # 所有 JSON 响应默认使用 orjson 序列化
+    default_response_class=ORJSONResponse,
 )
 
+# 上传大小限制：在 Starlette 暂存 multipart 上传之前拒绝超过 PDF_MAX_UPLOAD_BYTES 的请求
+app.add_middleware(UploadLimitMiddleware)
+
+# Idempotency-Key：先于 CORS 添加，位于其内层，重放的响应同样带有 CORS 响应头
+app.add_middleware(IdempotencyMiddleware)
+
+# 响应压缩：位于 Idempotency-Key 外层，保存和重放的都是未压缩的响应，按每个请求的 Accept-Encoding 压缩
+if settings.COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
 # CORS 配置
 origins = os.getenv("ORIGINS", "").split(",")
 
@@ -18,11 +82,61 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],          # 允许所有 HTTP 方法，包括 OPTIONS、GET、POST 等
     allow_headers=["*"],          # 允许所有请求头
+    expose_headers=[TRACE_ID_HEADER, "X-PDF-Size", "X-PDF-Original-Size"],
 )
 
+# 请求追踪：位于 CORS 外层，预检请求同样带有 X-Trace-Id
+app.add_middleware(TracingMiddleware)
+
+# 请求指标（最后添加的中间件位于最外层，CORS 预检请求也会被统计）
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+@app.exception_handler(DifyUnavailableError)
+async def dify_unavailable_handler(request: Request, exc: DifyUnavailableError):
+    """
+    Dify 应用熔断或排队已满时快速失败，返回 503 并提示客户端何时重试。
+    """
+    return ORJSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+    )
+
+@app.exception_handler(DeadlineExceededError)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceededError):
+    """
+    已超过请求头 X-Request-Timeout 给出的截止时间，不再等待 Dify，返回 504。
+    """
+    return ORJSONResponse(status_code=504, content={"detail": str(exc)})
+
+@app.exception_handler(DifyCallError)
+async def dify_call_error_handler(request: Request, exc: DifyCallError):
+    """
+    Dify 返回错误或响应无效时返回 502，而不是把错误文本当作 200 的结果返回。
+    """
+    return ORJSONResponse(status_code=502, content={"detail": str(exc)})
+
+@app.exception_handler(RateLimitedError)
+async def rate_limited_handler(request: Request, exc: RateLimitedError):
+    """
+    调用方超出 llm / render 类操作的速率限制时返回 429，并提示客户端何时重试。
+    """
+    return ORJSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
+
 # 注册所有来自 routes.py 的路由
 app.include_router(routes.router)
 
+# HTML 预览引用的共用字体文件，与 PDF 渲染使用同一份；只读且不需要鉴权，浏览器加载字体时不会带 X-API-Key
+for shared_dir in SHARED_DIRS:
+    app.mount(f"{PREVIEW_ASSET_PATH}{shared_dir}",
+              StaticFiles(directory=os.path.join(template_registry.template_dir, shared_dir), check_dir=False),
+              name=f"preview-{shared_dir}")
+
 @app.get("/", tags=["Health Check"])
 def read_root():
     """
@@ -30,6 +144,22 @@ def read_root():
     """
     return {"status": "ok", "message": "API服务已成功启动！"}
 
+@app.get("/ready", tags=["Health Check"])
+def read_ready():
+    """
+    就绪探针：连接池、模板、任务队列和后台预热全部完成后返回 200，否则返回 503。
+    用于滚动发布时判断新实例能否接收流量；/ 只表示进程存活。
+    """
+    return ORJSONResponse(status_code=200 if readiness.ready else 503, content=readiness.status())
+
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        """
+        Prometheus 指标采集接口，不需要 API Key，部署时应只对内网开放。
+        """
+        return Response(content=render_latest(), media_type=CONTENT_TYPE_LATEST)
+
 
 
 